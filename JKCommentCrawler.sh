@@ -9,6 +9,11 @@
 ## 5分おきに実行
 # */5 * * * * sudo -u ubuntu /home/ubuntu/JKCommentCrawler/JKCommentCrawler.sh cron_minutes
 
+# 常駐モードの設定例 (Cron の代わりに使う)
+## 1つのプロセスに常駐し、5分おきの差分収集・1日ごとの収集・Hugging Face への commit & push を内部のスケジューラーで行う
+## systemd のサービスなどから起動する (ExecStart=/home/ubuntu/JKCommentCrawler/JKCommentCrawler.sh daemon)
+## SIGTERM を受け取ると、実行中の収集が終わるのを待ってから終了する
+
 # 現在時刻
 current_time=`date +"%Y/%m/%d %H:%M"`
 
@@ -24,13 +29,30 @@ if [ ! -d ${SCRIPT_DIR}/log ]; then
     mkdir ${SCRIPT_DIR}/log
 fi
 
+# 今回の実行で内容が変わったファイルの一覧
+## 前回の実行結果を誤って使わないよう、実行前に削除しておく (常駐モードから同期だけを実行する場合を除く)
+CHANGED_FILES_LIST=${SCRIPT_DIR}/log/changed_files.txt
+if [[ $1 != 'sync' ]]; then
+    rm -f ${CHANGED_FILES_LIST}
+fi
+
+# 段階ごとの所要時間・バイト数・リトライ回数などのメトリクスの出力先
+## JSON Lines 形式の実行ログは日付ごとのファイルに追記し、Prometheus の textfile collector 用のファイルは実行ごとに置き換える
+## node_exporter の --collector.textfile.directory には ${SCRIPT_DIR}/log/metrics/ を指定する
+METRICS_DIR=${SCRIPT_DIR}/log/metrics
+METRICS_JSONL=${METRICS_DIR}/`date +"%Y%m%d"`.jsonl
+
 # JKCommentCrawler を実行
 # Cron（5分ごと）
 if [[ $1 = 'cron_minutes' ]]; then
 
     # 今日分の JKCommentCrawler を実行
+    ## 5分以内に収集を終えられるよう、4チャンネルずつ並列に収集する
+    ## 前回実行時から増えたコメントだけを既存のログに追記する
     echo 'JKCommentCrawler.sh (Cron minutes)'
-    ${SCRIPT_DIR}/.venv/bin/python -m jkcommentcrawler all `date +"%Y/%m/%d"` --save-dataset-structure-json \
+    ${SCRIPT_DIR}/.venv/bin/python -m jkcommentcrawler all `date +"%Y/%m/%d"` --save-dataset-structure-json --concurrency 4 --incremental \
+    --changed-files-list ${CHANGED_FILES_LIST} \
+    --metrics-jsonl ${METRICS_JSONL} --metrics-prom ${METRICS_DIR}/jkcommentcrawler_minutes.prom \
     1>  ${SCRIPT_DIR}/log/minutes.log \
     2>> ${SCRIPT_DIR}/log/minutes.error.log
 
@@ -42,14 +64,37 @@ elif [[ $1 = 'cron_daily' ]]; then
     ## ニコ生の実況番組の放送終了後にスパム判定されたコメント (特に AA) がごっそり削除されることがあり、
     ## それによって新しいログが保存されなくなる事態を避ける
     echo 'JKCommentCrawler.sh (Cron daily)'
-    ${SCRIPT_DIR}/.venv/bin/python -m jkcommentcrawler all `date -d '-1 day' +"%Y/%m/%d"` --save-dataset-structure-json --force \
+    ${SCRIPT_DIR}/.venv/bin/python -m jkcommentcrawler all `date -d '-1 day' +"%Y/%m/%d"` --save-dataset-structure-json --force --concurrency 4 \
+    --changed-files-list ${CHANGED_FILES_LIST} \
+    --metrics-jsonl ${METRICS_JSONL} --metrics-prom ${METRICS_DIR}/jkcommentcrawler_daily.prom \
     1>  ${SCRIPT_DIR}/log/daily.log \
     2>> ${SCRIPT_DIR}/log/daily.error.log
 
+# 常駐モード
+## 収集が終わるたびに、このスクリプトを sync を指定して実行し、Hugging Face に commit & push する
+## Prometheus の textfile collector 用のファイルは、jkcommentcrawler_minutes.prom と jkcommentcrawler_daily.prom に出力される
+elif [[ $1 = 'daemon' ]]; then
+
+    echo 'JKCommentCrawler.sh (Daemon)'
+    exec ${SCRIPT_DIR}/.venv/bin/python -m jkcommentcrawler all --daemon --save-dataset-structure-json --concurrency 4 \
+    --poll-interval 300 --daily-at 00:01,00:15,12:01,12:15 \
+    --changed-files-list ${CHANGED_FILES_LIST} \
+    --metrics-jsonl ${METRICS_DIR}/daemon.jsonl --metrics-prom ${METRICS_DIR}/jkcommentcrawler.prom \
+    --sync-command "${SCRIPT_PATH} sync" \
+    1>> ${SCRIPT_DIR}/log/daemon.log \
+    2>> ${SCRIPT_DIR}/log/daemon.error.log
+
+# 常駐モードからの同期
+## 収集は常駐しているプロセスが行うため、ここでは Hugging Face への commit & push だけを行う
+elif [[ $1 = 'sync' ]]; then
+
+    echo "JKCommentCrawler.sh (Sync after ${JKCOMMENTCRAWLER_PASS} pass)"
+
 # 通常実行
 else
     echo 'JKCommentCrawler.sh (Nornal)'
-    ${SCRIPT_DIR}/.venv/bin/python -m jkcommentcrawler all `date +"%Y/%m/%d"` --save-dataset-structure-json
+    ${SCRIPT_DIR}/.venv/bin/python -m jkcommentcrawler all `date +"%Y/%m/%d"` --save-dataset-structure-json \
+    --changed-files-list ${CHANGED_FILES_LIST}
 fi
 
 # Hugging Face (KakologArchives) に commit & push する
@@ -57,8 +102,25 @@ fi
 # 前回のコミットメッセージが Add kakolog until 20xx/xx/xx 00:00 or 12:00 の時だけ、前回コミットを上書きせずそのままコミットする
 # こうすることで、1日に2回は必ずコミットされるようになる
 cd ${SCRIPT_DIR}/kakolog/
+
+# 強制終了した際に残った一時ファイル (.*.tmp) をコミットしないよう、.gitignore に追加する
+if ! grep -qxF '.*.tmp' .gitignore 2>/dev/null; then
+    echo '.*.tmp' >> .gitignore
+fi
 last_commit_message=$(git log -1 --pretty=%B)
-git add .
+
+# 今回の実行で内容が変わったファイルだけをステージングする
+## 変更されたファイルが1つもなければステージングだけをスキップし、以前の push に失敗して残っている変更のコミット・push は続けて行う
+## 一覧が出力されていない (途中で異常終了した) 場合は、従来通り全体をステージングする
+if [[ -f ${CHANGED_FILES_LIST} ]]; then
+    if [[ -s ${CHANGED_FILES_LIST} ]]; then
+        git add --pathspec-from-file=${CHANGED_FILES_LIST}
+    else
+        echo 'No files changed. Skipping git add.'
+    fi
+else
+    git add .
+fi
 if [[ $last_commit_message == *"00:00" ]] || [[ $last_commit_message == *"12:00" ]]; then
     git commit -m "Add kakolog until ${current_time}"
 else
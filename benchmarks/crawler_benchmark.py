@@ -0,0 +1,453 @@
+"""
+ローカルのスタンドインサーバーに対してクローラーの各段階のスループットを計測するベンチマーク
+
+実際の NX-Jikkyo・ニコニコ生放送に接続せずに、以下の段階の所要時間・スループット (件数/秒)・最大メモリ使用量を計測する
+    getThreadIDsOnDate: NX-Jikkyo のスレッド一覧の取得と、日付に放送されたスレッドの検索
+    downloadBackwardComments: NX-Jikkyo スレッド・ニコニコ生放送番組 (スタブ) のコメントのダウンロード
+    merge: 取得元ごとのコメントの日付での絞り込みとマージ (ソート)
+    convertToXMLString: マージしたコメントの XML 文字列への変換
+    crawl: 上記を含む Crawler による収集・保存全体 (空のキャッシュから)
+
+NX-Jikkyo API はスタンドインサーバー (benchmarks/stand_in_server.py) を別プロセスで起動して置き換え、
+ニコニコ生放送は合成したコメントを返す NDGRClient のスタブで置き換える
+計測結果は Git のコミットとあわせて JSON で保存でき、--compare で別のコミットの計測結果と比較できる
+
+Usage:
+    python -m benchmarks.crawler_benchmark [--channels 3] [--days 365] [--comments-per-thread 20000]
+        [--nicolive-programs 2] [--nicolive-comments 20000] [--workers 0] [--repeat 3] [--trace-memory]
+        [--payload-dir DIR] [--output result.json] [--compare baseline.json]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Iterator
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Any
+
+import anyio
+from ndgr_client import NDGRClient, XMLCompatibleComment
+
+import jkcommentcrawler.crawler
+from benchmarks.stand_in_server import JST, PayloadConfig, start_server_process
+from jkcommentcrawler.auth import NiconicoAuthManager
+from jkcommentcrawler.comment_batch import CommentBatch
+from jkcommentcrawler.crawler import Crawler
+from jkcommentcrawler.http_pool import HTTPConnectionPool
+from jkcommentcrawler.merge import merge_comment_sources
+from jkcommentcrawler.nx_client import NXClient
+from jkcommentcrawler.thread_index import ThreadIndex
+
+
+try:
+    import resource
+except ImportError:
+    # Windows では resource モジュールが使えないため、最大 RSS は計測しない
+    resource = None
+
+
+# 計測結果の JSON のフォーマットのバージョン
+RESULT_VERSION = 1
+
+
+class StubNDGRClient(NDGRClient):
+    """
+    ニコニコ生放送に接続せず、合成したコメントを返す NDGRClient のスタブ
+    番組は NX-Jikkyo のスレッドと同様に、毎日 04:00 ~ 翌日 04:00 に放送されたものとして扱う
+    コメントは最初から XMLCompatibleComment として合成するため、convertToXMLCompatibleComment() は何もしない
+    """
+
+    # 1日あたりの番組数・番組ごとのコメント数
+    PROGRAMS_PER_DAY = 2
+    COMMENTS_PER_PROGRAM = 20000
+
+    def __init__(self, nicolive_program_id: str, verbose: bool = False, console_output: bool = False) -> None:
+        self.nicolive_program_id = nicolive_program_id
+
+    def __del__(self) -> None:
+        pass
+
+    async def __aenter__(self) -> StubNDGRClient:
+        return self
+
+    async def __aexit__(self, *args: Any) -> None:
+        pass
+
+    async def login(
+        self, mail: str | None = None, password: str | None = None, cookies: dict[str, str] | None = None
+    ) -> dict[str, str] | None:
+        return cookies or {}
+
+    @classmethod
+    async def getProgramIDsOnDate(cls, jikkyo_channel_id: str, date: date) -> list[str]:
+        # 前日 04:00 ~ 当日 04:00 と、当日 04:00 ~ 翌日 04:00 に放送された番組
+        channel_index = NXClient.JIKKYO_CHANNEL_ID_LIST.index(jikkyo_channel_id)
+        return [
+            f'lv{(date - timedelta(days=days)).toordinal()}{channel_index:02d}{program_index:02d}'
+            for days in (1, 0)
+            for program_index in range(cls.PROGRAMS_PER_DAY)
+        ]
+
+    async def downloadBackwardComments(self) -> list[XMLCompatibleComment]:  # type: ignore
+        program_number = int(self.nicolive_program_id[2:])
+        ordinal, program_index = divmod(program_number, 10000)
+        program_index %= 100
+        start_date = date.fromordinal(ordinal)
+        start_at = datetime(start_date.year, start_date.month, start_date.day, 4, tzinfo=JST).timestamp()
+        # 1日の放送時間を番組で分担する
+        length = 24 * 60 * 60 / self.PROGRAMS_PER_DAY
+        program_start_at = start_at + length * program_index
+
+        rng = random.Random(program_number)
+        timestamps = sorted(program_start_at + rng.uniform(0, length) for _ in range(self.COMMENTS_PER_PROGRAM))
+        return [
+            XMLCompatibleComment.model_construct(
+                thread=self.nicolive_program_id,
+                no=no,
+                vpos=int((timestamp - program_start_at) * 100),
+                date=int(timestamp),
+                date_usec=int((timestamp % 1) * 1000000),
+                mail='184',
+                user_id=f'user{rng.randrange(5000):05d}',
+                premium=None,
+                anonymity=1,
+                content=f'ニコニコ生放送のコメント {no}',
+            )
+            for no, timestamp in enumerate(timestamps, start=1)
+        ]
+
+    @staticmethod
+    def convertToXMLCompatibleComment(comment: Any) -> XMLCompatibleComment:
+        return comment
+
+
+class BenchmarkAuthManager(NiconicoAuthManager):
+    """ニコニコへのログインと cookies.json の読み書きを行わない NiconicoAuthManager"""
+
+    async def login(self, ndgr_client: NDGRClient) -> int:
+        return 0
+
+    async def refresh(self, ndgr_client: NDGRClient, generation: int) -> int:
+        return 0
+
+
+class BenchmarkCrawler(Crawler):
+    """ニコニコへのログインと cookies.json の読み書きを行わない Crawler"""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.auth = BenchmarkAuthManager(self.niconico_mail, self.niconico_password, self.auth.cookies_json)
+
+
+class StageTimer:
+    """
+    ベンチマークの段階ごとの所要時間・処理件数・メモリ使用量を記録するクラス
+    """
+
+    def __init__(self, trace_memory: bool) -> None:
+        """
+        StageTimer のコンストラクタ
+
+        Args:
+            trace_memory (bool): tracemalloc で段階ごとの Python ヒープの最大使用量を計測するかどうか (計測自体が遅くなる)
+        """
+
+        self.trace_memory = trace_memory
+
+        # 段階ごとの、繰り返しごとの計測結果
+        self.records: dict[str, list[dict[str, Any]]] = {}
+
+    @contextmanager
+    def measure(self, stage: str, unit: str) -> Iterator[dict[str, Any]]:
+        """
+        with ブロック内の処理を1つの段階として計測する
+        with ブロック内で、返された辞書の 'count' に処理した件数を設定する
+
+        Args:
+            stage (str): 段階の名前
+            unit (str): 処理した件数の単位 (ex: comments)
+
+        Yields:
+            dict[str, Any]: 処理した件数を設定する辞書
+        """
+
+        record: dict[str, Any] = {'count': 0, 'unit': unit}
+        if self.trace_memory is True:
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield record
+        record['wall_time'] = time.perf_counter() - start
+        if self.trace_memory is True:
+            record['peak_heap_mb'] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        record['max_rss_mb'] = get_max_rss_mb()
+        self.records.setdefault(stage, []).append(record)
+
+    def summarize(self) -> dict[str, dict[str, Any]]:
+        """
+        段階ごとに、繰り返しの所要時間の中央値でスループットを求めた計測結果を返す
+
+        Returns:
+            dict[str, dict[str, Any]]: 段階ごとの計測結果
+        """
+
+        summary: dict[str, dict[str, Any]] = {}
+        for stage, records in self.records.items():
+            wall_times = [record['wall_time'] for record in records]
+            median = statistics.median(wall_times)
+            summary[stage] = {
+                'unit': records[0]['unit'],
+                'count': records[0]['count'],
+                'wall_time_median': median,
+                'wall_time_min': min(wall_times),
+                'per_second': records[0]['count'] / median if median > 0 else 0.0,
+                'max_rss_mb': max((record['max_rss_mb'] or 0) for record in records) or None,
+                'peak_heap_mb': max(record['peak_heap_mb'] for record in records) if self.trace_memory else None,
+            }
+        return summary
+
+
+def get_max_rss_mb() -> float | None:
+    """
+    プロセス開始からの最大 RSS (Resident Set Size) を MiB 単位で返す
+    最大 RSS は減ることがないため、段階の実行後に記録した値はその段階までの最大値になる
+
+    Returns:
+        float | None: 最大 RSS (計測できない環境では None)
+    """
+
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS ではバイト単位、Linux では KiB 単位で返される
+    return max_rss / 1024 / 1024 if sys.platform == 'darwin' else max_rss / 1024
+
+
+def get_git_revision() -> dict[str, Any]:
+    """
+    計測したコードの Git のコミットと、未コミットの変更があるかどうかを返す
+
+    Returns:
+        dict[str, Any]: コミットハッシュ・未コミットの変更があるかどうか (Git リポジトリでない場合は None)
+    """
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, check=True, text=True).stdout
+        status = subprocess.run(
+            ['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, check=True, text=True
+        ).stdout
+        return {'commit': commit.strip(), 'dirty': status.strip() != ''}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+
+async def run_stages(
+    timer: StageTimer, jikkyo_channel_ids: list[str], target_date: date, temp_dir: anyio.Path, workers: int = 0
+) -> None:
+    """
+    各段階を1回ずつ計測する
+
+    Args:
+        timer (StageTimer): 計測結果を記録する StageTimer
+        jikkyo_channel_ids (list[str]): 計測に使う実況チャンネル ID のリスト
+        target_date (date): 計測に使う日付
+        temp_dir (anyio.Path): スレッドインデックス・過去ログなどを保存する一時フォルダのパス
+        workers (int, default=0): Crawler がコメントの変換に使うワーカープロセスの数
+    """
+
+    async with HTTPConnectionPool(user_agent=NXClient.USER_AGENT) as http_pool:
+        # スレッド一覧の取得と、日付に放送されたスレッドの検索
+        ## スレッドインデックスは空の状態から作るため、スレッド一覧全体を取得・検証する
+        thread_ids: dict[str, list[int]] = {}
+        with timer.measure('getThreadIDsOnDate', 'threads') as record:
+            for jikkyo_channel_id in jikkyo_channel_ids:
+                thread_ids[jikkyo_channel_id] = await NXClient.getThreadIDsOnDate(
+                    jikkyo_channel_id, target_date, http_pool=http_pool, thread_index_dir=temp_dir / 'thread_index'
+                )
+        for jikkyo_channel_id in jikkyo_channel_ids:
+            thread_index = await ThreadIndex.load(jikkyo_channel_id, temp_dir / 'thread_index')
+            record['count'] += len(thread_index.threads)
+
+        # コメントのダウンロード
+        ## Crawler と同様に、NX-Jikkyo のコメントは downloadBackwardCommentBatch() で CommentBatch として取得する
+        sources: dict[str, dict[str, list[XMLCompatibleComment] | CommentBatch]] = {}
+        with timer.measure('downloadBackwardComments', 'comments') as record:
+            for jikkyo_channel_id in jikkyo_channel_ids:
+                channel_sources: dict[str, list[XMLCompatibleComment] | CommentBatch] = {}
+                for program_id in await StubNDGRClient.getProgramIDsOnDate(jikkyo_channel_id, target_date):
+                    async with StubNDGRClient(program_id) as ndgr_client:
+                        channel_sources[f'nicolive:{program_id}'] = [
+                            StubNDGRClient.convertToXMLCompatibleComment(comment)
+                            for comment in await ndgr_client.downloadBackwardComments()
+                        ]
+                for thread_id in thread_ids[jikkyo_channel_id]:
+                    async with NXClient(thread_id, http_pool=http_pool) as nx_client:
+                        channel_sources[f'nx-jikkyo:{thread_id}'] = await nx_client.downloadBackwardCommentBatch()
+                sources[jikkyo_channel_id] = channel_sources
+                record['count'] += sum(len(comments) for comments in channel_sources.values())
+
+    # 日付での絞り込みとマージ
+    merged: dict[str, list[XMLCompatibleComment]] = {}
+    with timer.measure('merge', 'comments') as record:
+        for jikkyo_channel_id, channel_sources in sources.items():
+            merged[jikkyo_channel_id], _ = merge_comment_sources(channel_sources, target_date)
+            record['count'] += sum(len(comments) for comments in channel_sources.values())
+    del sources
+
+    # XML 文字列への変換
+    with timer.measure('convertToXMLString', 'comments') as record:
+        for comments in merged.values():
+            NDGRClient.convertToXMLString(comments)
+            record['count'] += len(comments)
+    del merged
+
+    # Crawler による収集・保存全体
+    ## ニコニコ生放送はスタブで置き換え、キャッシュ・過去ログは空の状態から作る
+    with timer.measure('crawl', 'comments') as record:
+        async with BenchmarkCrawler(
+            kakolog_dir=temp_dir / 'kakolog',
+            cache_dir=temp_dir / 'cache',
+            niconico_mail='',
+            niconico_password='',
+            workers=workers,
+        ) as crawler:
+            comment_counts = await crawler.crawlChannels(jikkyo_channel_ids, target_date)
+        record['count'] = sum(comment_counts.values())
+
+
+def print_summary(summary: dict[str, dict[str, Any]], baseline: dict[str, Any] | None) -> None:
+    """
+    段階ごとの計測結果を表示する (比較対象がある場合は、比較対象に対する所要時間の比も表示する)
+
+    Args:
+        summary (dict[str, dict[str, Any]]): 段階ごとの計測結果
+        baseline (dict[str, Any] | None): 比較対象の計測結果の JSON
+    """
+
+    print(f'{"stage":<26}{"count":>12}{"wall time":>12}{"throughput":>22}{"max RSS":>12}{"peak heap":>12}', end='')
+    print(f'{"vs baseline":>14}' if baseline is not None else '')
+    for stage, result in summary.items():
+        max_rss = f'{result["max_rss_mb"]:.1f} MiB' if result['max_rss_mb'] is not None else '-'
+        peak_heap = f'{result["peak_heap_mb"]:.1f} MiB' if result['peak_heap_mb'] is not None else '-'
+        print(
+            f'{stage:<26}{result["count"]:>12}{result["wall_time_median"]:>11.3f}s'
+            f'{result["per_second"]:>14.0f} {result["unit"] + "/s":<7}{max_rss:>12}{peak_heap:>12}',
+            end='',
+        )
+        if baseline is not None:
+            baseline_result = baseline['stages'].get(stage)
+            if baseline_result is not None and result['wall_time_median'] > 0:
+                print(f'{baseline_result["wall_time_median"] / result["wall_time_median"]:>13.2f}x', end='')
+            else:
+                print(f'{"-":>14}', end='')
+        print()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Offline crawler benchmark')
+    parser.add_argument('--channels', type=int, default=3, help='number of channels to crawl')
+    parser.add_argument('--date', type=str, default='2024/08/05', help='target date (YYYY/MM/DD)')
+    parser.add_argument('--days', type=int, default=365, help='number of threads in each channel thread list')
+    parser.add_argument('--comments-per-thread', type=int, default=20000)
+    parser.add_argument('--nicolive-ratio', type=float, default=0.05)
+    parser.add_argument('--nicolive-programs', type=int, default=2, help='Nicolive programs per day')
+    parser.add_argument('--nicolive-comments', type=int, default=20000, help='comments per Nicolive program')
+    parser.add_argument('--payload-dir', type=str, default=None, help='directory with recorded API responses')
+    parser.add_argument('--workers', type=int, default=0, help='worker processes used by the crawler for serialization')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--trace-memory', action='store_true', help='measure peak Python heap with tracemalloc')
+    parser.add_argument('--output', type=str, default=None, help='write results as JSON to this path')
+    parser.add_argument('--compare', type=str, default=None, help='compare with results JSON of another commit')
+    args = parser.parse_args()
+
+    target_date = datetime.strptime(args.date, '%Y/%m/%d').date()
+    jikkyo_channel_ids = NXClient.JIKKYO_CHANNEL_ID_LIST[: args.channels]
+    parameters = {
+        'channels': args.channels,
+        'date': args.date,
+        'days': args.days,
+        'comments_per_thread': args.comments_per_thread,
+        'nicolive_ratio': args.nicolive_ratio,
+        'nicolive_programs': args.nicolive_programs,
+        'nicolive_comments': args.nicolive_comments,
+        'payload_dir': args.payload_dir,
+        'workers': args.workers,
+        'repeat': args.repeat,
+        'trace_memory': args.trace_memory,
+    }
+
+    baseline: dict[str, Any] | None = None
+    if args.compare is not None:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        # 繰り返し回数以外のパラメータが異なる場合は、計測結果を比較できない可能性がある
+        if {key: value for key, value in baseline['parameters'].items() if key != 'repeat'} != {
+            key: value for key, value in parameters.items() if key != 'repeat'
+        }:
+            print('Warning: the baseline was measured with different parameters.')
+
+    # NX-Jikkyo API をスタンドインサーバーに、ニコニコ生放送を NDGRClient のスタブに置き換える
+    server_process, base_url = start_server_process(
+        PayloadConfig(
+            end_date=target_date,
+            days=args.days,
+            comments_per_thread=args.comments_per_thread,
+            nicolive_ratio=args.nicolive_ratio,
+            payload_dir=args.payload_dir,
+        )
+    )
+    NXClient.API_BASE_URL = base_url
+    StubNDGRClient.PROGRAMS_PER_DAY = args.nicolive_programs
+    StubNDGRClient.COMMENTS_PER_PROGRAM = args.nicolive_comments
+    jkcommentcrawler.crawler.NDGRClient = StubNDGRClient  # type: ignore
+
+    # 1回目はスタンドインサーバーがレスポンスを合成するため、計測結果に含めない
+    timer = StageTimer(trace_memory=args.trace_memory)
+    try:
+        if args.trace_memory is True:
+            tracemalloc.start()
+        for repeat in range(args.repeat + 1):
+            if repeat == 0:
+                print('Warming up the stand-in server ...')
+            else:
+                print(f'Running benchmark ({repeat}/{args.repeat}) ...')
+            stage_timer = StageTimer(trace_memory=args.trace_memory) if repeat == 0 else timer
+            with tempfile.TemporaryDirectory() as temp_dir:
+                asyncio.run(
+                    run_stages(stage_timer, jikkyo_channel_ids, target_date, anyio.Path(temp_dir), args.workers)
+                )
+    finally:
+        server_process.terminate()
+        server_process.join()
+
+    summary = timer.summarize()
+    print_summary(summary, baseline)
+
+    # コミット間で比較できるよう、計測したコミット・環境・パラメータとあわせて保存する
+    if args.output is not None:
+        result = {
+            'version': RESULT_VERSION,
+            'git': get_git_revision(),
+            'measured_at': datetime.now().astimezone().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'parameters': parameters,
+            'stages': summary,
+        }
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, ensure_ascii=False, indent=4)
+        print(f'Results saved to {args.output}.')
+
+
+if __name__ == '__main__':
+    main()
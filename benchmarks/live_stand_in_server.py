@@ -0,0 +1,385 @@
+"""
+tail (WebSocket でのコメント受信) の検証用の、放送中の NX-Jikkyo スレッドのスタンドインサーバー
+
+実際の NX-Jikkyo に接続せずに tailThread() の動作を確かめられるよう、実況チャンネルごとに1つの ACTIVE なスレッドを合成し、
+以下の API とコメントサーバーを同じポートで提供する
+    /api/v1/channels/{channel_id}/threads: スレッド情報取得 API (放送中のスレッドだけを返す)
+    /api/v1/threads/{thread_id}: スレッド取得 API (その時点までに投稿されたコメントを返す)
+    /api/v1/channels/{channel_id}/ws/comment: 2024/06/08 以前のニコニコ生放送互換のコメントサーバー (WebSocket)
+コメントは --rate の頻度で投稿され、購読中の全ての接続に chat メッセージで送信される
+--drop-interval を指定すると、その間隔でコメントサーバーの全ての接続を切断する (再接続・再同期の検証用)
+
+Usage:
+    python -m benchmarks.live_stand_in_server [--port 8000] [--channels 3] [--duration 60] [--rate 20]
+        [--initial-comments 1000] [--nicolive-ratio 0.05] [--drop-interval SECONDS]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import random
+import re
+from datetime import datetime, timedelta
+from http import HTTPStatus
+from multiprocessing.connection import Connection
+from typing import Any, NamedTuple
+
+import websockets.asyncio.server
+from websockets.asyncio.server import ServerConnection
+from websockets.datastructures import Headers
+from websockets.exceptions import ConnectionClosed
+from websockets.http11 import Request, Response
+
+from benchmarks.stand_in_server import JST
+from jkcommentcrawler.nx_client import NXClient
+
+
+class LiveConfig(NamedTuple):
+    """スタンドインサーバーが合成する放送中のスレッドの設定"""
+
+    channels: int  # 放送中のスレッドを合成する実況チャンネルの数 (jk1 から順に)
+    duration: float  # サーバーの起動から放送終了までの秒数
+    rate: float  # 実況チャンネルごとの1秒あたりのコメント数
+    initial_comments: int  # サーバーの起動時点ですでに投稿されているコメント数
+    nicolive_ratio: float  # ニコニコ実況からリアルタイムマージされたコメントの割合
+    drop_interval: float | None  # コメントサーバーの全ての接続を切断する間隔 (秒) (None なら切断しない)
+
+
+class LiveThread:
+    """
+    放送中の NX-Jikkyo スレッドを合成し、投稿されたコメントを購読中の接続に送信するクラス
+    """
+
+    def __init__(self, jikkyo_channel_id: str, thread_id: int, start_at: datetime, end_at: datetime, seed: int) -> None:
+        """
+        LiveThread のコンストラクタ
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            thread_id (int): スレッド ID
+            start_at (datetime): スレッドの放送開始日時
+            end_at (datetime): スレッドの放送終了日時
+            seed (int): コメントを合成する乱数のシード
+        """
+
+        self.jikkyo_channel_id = jikkyo_channel_id
+        self.thread_id = thread_id
+        self.start_at = start_at
+        self.end_at = end_at
+        self.rng = random.Random(seed)
+
+        # これまでに投稿されたコメント (スレッド取得 API と同じ形式、投稿日時昇順)
+        self.comments: list[dict[str, Any]] = []
+
+        # コメントを購読している接続
+        self.subscribers: set[ServerConnection] = set()
+
+    def getInfo(self) -> dict[str, Any]:
+        """
+        スレッド情報取得 API が返すスレッドの情報を返す (放送終了日時を過ぎたら PAST になる)
+
+        Returns:
+            dict[str, Any]: スレッドの情報
+        """
+
+        return {
+            'id': self.thread_id,
+            'channel_id': self.jikkyo_channel_id,
+            'start_at': self.start_at.isoformat(),
+            'end_at': self.end_at.isoformat(),
+            'duration': int((self.end_at - self.start_at).total_seconds()),
+            'title': f'{self.jikkyo_channel_id} 放送中のスレッド',
+            'description': 'tail の検証用に合成した放送中のスレッド',
+            'status': 'ACTIVE' if datetime.now(JST) < self.end_at else 'PAST',
+        }
+
+    def post(self, posted_at: datetime, nicolive_ratio: float) -> dict[str, Any]:
+        """
+        コメントを1件投稿する
+
+        Args:
+            posted_at (datetime): コメントの投稿日時
+            nicolive_ratio (float): ニコニコ実況からリアルタイムマージされたコメントの割合
+
+        Returns:
+            dict[str, Any]: 投稿したコメント (スレッド取得 API と同じ形式)
+        """
+
+        no = len(self.comments) + 1
+        user_number = self.rng.randrange(5000)
+        comment = {
+            'id': no,
+            'thread_id': self.thread_id,
+            'no': no,
+            'vpos': int((posted_at - self.start_at).total_seconds() * 100),
+            'date': posted_at.isoformat(),
+            'mail': self.rng.choice(['184', '184 white', '184 red shita', '']),
+            'user_id': f'nicolive:{user_number}' if self.rng.random() < nicolive_ratio else f'user{user_number:05d}',
+            'premium': self.rng.random() < 0.2,
+            'anonymity': self.rng.random() < 0.9,
+            'content': self.rng.choice(['草', 'ｷﾀ━━━━(ﾟ∀ﾟ)━━━━!!', 'こんばんは', '<おお> & "すごい"', 'www'])
+            + str(no % 100),
+        }
+        self.comments.append(comment)
+        return comment
+
+    @staticmethod
+    def toChatMessage(comment: dict[str, Any]) -> dict[str, Any]:
+        """
+        スレッド取得 API と同じ形式のコメントを、コメントサーバーが送信する chat メッセージに変換する
+        投稿日時は、スレッド取得 API のコメントを変換した場合と同じ値になるよう同じ計算で求める
+
+        Args:
+            comment (dict[str, Any]): スレッド取得 API と同じ形式のコメント
+
+        Returns:
+            dict[str, Any]: chat メッセージ
+        """
+
+        timestamp = datetime.fromisoformat(comment['date']).timestamp()
+        chat: dict[str, Any] = {
+            'thread': str(comment['thread_id']),
+            'no': comment['no'],
+            'vpos': comment['vpos'],
+            'date': int(timestamp),
+            'date_usec': int((timestamp % 1) * 1000000),
+            'user_id': comment['user_id'],
+            'content': comment['content'],
+        }
+        # mail・premium・anonymity は値がない場合は省略する
+        if comment['mail'] != '':
+            chat['mail'] = comment['mail']
+        if comment['premium'] is True:
+            chat['premium'] = 1
+        if comment['anonymity'] is True:
+            chat['anonymity'] = 1
+        return {'chat': chat}
+
+
+class LiveStandInServer:
+    """
+    放送中の NX-Jikkyo スレッドの API とコメントサーバーのスタンドインサーバー
+    """
+
+    THREADS_PATTERN = re.compile(r'^/api/v1/channels/(jk\d+)/threads$')
+    THREAD_PATTERN = re.compile(r'^/api/v1/threads/(\d+)$')
+    WEBSOCKET_PATTERN = re.compile(r'^/api/v1/channels/(jk\d+)/ws/comment$')
+
+    def __init__(self, config: LiveConfig) -> None:
+        """
+        LiveStandInServer のコンストラクタ
+        スレッドはサーバーの起動前に投稿された分のコメントを含めて合成する
+
+        Args:
+            config (LiveConfig): 合成する放送中のスレッドの設定
+        """
+
+        self.config = config
+        now = datetime.now(JST)
+        start_at = now - timedelta(minutes=10)
+        end_at = now + timedelta(seconds=config.duration)
+
+        self.threads: dict[int, LiveThread] = {}
+        self.channel_threads: dict[str, LiveThread] = {}
+        for channel_index, jikkyo_channel_id in enumerate(NXClient.JIKKYO_CHANNEL_ID_LIST[: config.channels]):
+            thread_id = (channel_index + 1) * 1000000 + now.date().toordinal()
+            thread = LiveThread(jikkyo_channel_id, thread_id, start_at, end_at, seed=thread_id)
+            offsets = sorted(
+                thread.rng.uniform(0, (now - start_at).total_seconds()) for _ in range(config.initial_comments)
+            )
+            for offset in offsets:
+                thread.post(start_at + timedelta(seconds=offset), config.nicolive_ratio)
+            self.threads[thread_id] = thread
+            self.channel_threads[jikkyo_channel_id] = thread
+
+    async def serve(self, port: int, connection: Connection | None = None) -> None:
+        """
+        スタンドインサーバーを起動し、終了されるまでリクエストを処理する
+
+        Args:
+            port (int): 待ち受けるポート番号 (0 なら空いているポートを使う)
+            connection (Connection | None, default=None): 待ち受けを開始したポート番号を親プロセスに通知するためのパイプ
+        """
+
+        async with websockets.asyncio.server.serve(
+            self._handleWebSocket, '127.0.0.1', port, process_request=self._handleHTTP
+        ) as server:
+            if connection is not None:
+                connection.send(server.sockets[0].getsockname()[1])
+                connection.close()
+            tasks = [asyncio.create_task(self._postComments(thread)) for thread in self.threads.values()]
+            if self.config.drop_interval is not None:
+                tasks.append(asyncio.create_task(self._dropConnections(self.config.drop_interval)))
+            try:
+                await server.serve_forever()
+            finally:
+                for task in tasks:
+                    task.cancel()
+
+    def _handleHTTP(self, connection: ServerConnection, request: Request) -> Response | None:
+        """
+        WebSocket 以外の HTTP リクエスト (スレッド情報取得 API・スレッド取得 API) に応答する
+
+        Args:
+            connection (ServerConnection): リクエストを受け付けた接続
+            request (Request): HTTP リクエスト
+
+        Returns:
+            Response | None: HTTP レスポンス (コメントサーバーへのリクエストなら None を返してハンドシェイクを続ける)
+        """
+
+        if self.WEBSOCKET_PATTERN.match(request.path):
+            return None
+
+        body: bytes | None = None
+        if (match := self.THREADS_PATTERN.match(request.path)) and match.group(1) in self.channel_threads:
+            body = json.dumps([self.channel_threads[match.group(1)].getInfo()], ensure_ascii=False).encode('utf-8')
+        elif (match := self.THREAD_PATTERN.match(request.path)) and int(match.group(1)) in self.threads:
+            thread = self.threads[int(match.group(1))]
+            body = json.dumps({**thread.getInfo(), 'comments': thread.comments}, ensure_ascii=False).encode('utf-8')
+
+        if body is None:
+            return connection.respond(HTTPStatus.NOT_FOUND, 'Not Found\n')
+        headers = Headers([('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+        return Response(HTTPStatus.OK.value, HTTPStatus.OK.phrase, headers, body)
+
+    async def _handleWebSocket(self, connection: ServerConnection) -> None:
+        """
+        コメントサーバーへの接続を処理する
+        thread メッセージを受け取ったら購読を開始し、以降に投稿されたコメントを送信する
+
+        Args:
+            connection (ServerConnection): コメントサーバーへの接続
+        """
+
+        assert connection.request is not None
+        match = self.WEBSOCKET_PATTERN.match(connection.request.path)
+        if match is None or match.group(1) not in self.channel_threads:
+            await connection.close(code=1008, reason='Unknown channel')
+            return
+        thread = self.channel_threads[match.group(1)]
+
+        try:
+            async for message in connection:
+                for data in NXClient._parseCommentServerMessage(message):
+                    if 'thread' not in data:
+                        continue
+                    resultcode = 0 if data['thread'].get('thread') == str(thread.thread_id) else 1
+                    await connection.send(
+                        json.dumps(
+                            {
+                                'thread': {
+                                    'resultcode': resultcode,
+                                    'thread': data['thread'].get('thread'),
+                                    'last_res': len(thread.comments),
+                                    'ticket': '0x00000000',
+                                    'revision': 1,
+                                    'server_time': int(datetime.now(JST).timestamp()),
+                                }
+                            }
+                        )
+                    )
+                    if resultcode == 0:
+                        thread.subscribers.add(connection)
+        except ConnectionClosed:
+            pass
+        finally:
+            thread.subscribers.discard(connection)
+
+    async def _postComments(self, thread: LiveThread) -> None:
+        """
+        放送終了日時まで、指定された頻度でコメントを投稿して購読中の接続に送信する
+
+        Args:
+            thread (LiveThread): コメントを投稿するスレッド
+        """
+
+        while True:
+            await asyncio.sleep(thread.rng.expovariate(self.config.rate))
+            posted_at = datetime.now(JST)
+            if posted_at >= thread.end_at:
+                break
+            message = json.dumps(LiveThread.toChatMessage(thread.post(posted_at, self.config.nicolive_ratio)))
+            for subscriber in list(thread.subscribers):
+                try:
+                    await subscriber.send(message)
+                except ConnectionClosed:
+                    thread.subscribers.discard(subscriber)
+
+    async def _dropConnections(self, interval: float) -> None:
+        """
+        指定された間隔で、コメントサーバーの全ての接続を切断する
+
+        Args:
+            interval (float): 切断する間隔 (秒)
+        """
+
+        while True:
+            await asyncio.sleep(interval)
+            for thread in self.threads.values():
+                for subscriber in list(thread.subscribers):
+                    thread.subscribers.discard(subscriber)
+                    subscriber.transport.abort()
+
+
+def serve(config: LiveConfig, port: int, connection: Connection | None = None) -> None:
+    """
+    スタンドインサーバーを起動し、終了されるまでリクエストを処理する
+
+    Args:
+        config (LiveConfig): 合成する放送中のスレッドの設定
+        port (int): 待ち受けるポート番号 (0 なら空いているポートを使う)
+        connection (Connection | None, default=None): 待ち受けを開始したポート番号を親プロセスに通知するためのパイプ
+    """
+
+    asyncio.run(LiveStandInServer(config).serve(port, connection))
+
+
+def start_server_process(config: LiveConfig) -> tuple[multiprocessing.Process, str]:
+    """
+    スタンドインサーバーを別プロセスで起動する
+
+    Args:
+        config (LiveConfig): 合成する放送中のスレッドの設定
+
+    Returns:
+        tuple[multiprocessing.Process, str]: サーバーのプロセスと、NX-Jikkyo API のベース URL の代わりに使う URL
+    """
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context('spawn').Process(target=serve, args=(config, 0, sender), daemon=True)
+    process.start()
+    sender.close()
+    port = receiver.recv()
+    receiver.close()
+    return process, f'http://127.0.0.1:{port}/api/v1'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Live NX-Jikkyo thread stand-in server for tail tests')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--channels', type=int, default=3)
+    parser.add_argument('--duration', type=float, default=60, help='seconds until the threads end')
+    parser.add_argument('--rate', type=float, default=20, help='comments per second in each thread')
+    parser.add_argument('--initial-comments', type=int, default=1000)
+    parser.add_argument('--nicolive-ratio', type=float, default=0.05)
+    parser.add_argument('--drop-interval', type=float, default=None, help='drop all WebSocket connections periodically')
+    args = parser.parse_args()
+
+    config = LiveConfig(
+        channels=args.channels,
+        duration=args.duration,
+        rate=args.rate,
+        initial_comments=args.initial_comments,
+        nicolive_ratio=args.nicolive_ratio,
+        drop_interval=args.drop_interval,
+    )
+    print(f'Serving live NX-Jikkyo stand-in on http://127.0.0.1:{args.port}/api/v1')
+    serve(config, args.port)
+
+
+if __name__ == '__main__':
+    main()
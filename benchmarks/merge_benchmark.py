@@ -0,0 +1,104 @@
+"""
+取得元ごとのコメントのマージ・日付での絞り込みのマイクロベンチマーク
+
+従来の「全コメントを1つのリストに連結 → コメントごとに datetime を作って日付で絞り込み → 全体をソート」という処理と、
+merge_comments() による「取得元ごとに二分探索で日付の範囲を切り出し → k-way マージ」という処理の所要時間を比較する
+
+Usage:
+    python -m benchmarks.merge_benchmark [--comments 300000] [--sources 6] [--repeat 5]
+"""
+
+from __future__ import annotations
+
+import argparse
+import random
+import timeit
+from datetime import date, datetime, time, timedelta
+
+from ndgr_client import XMLCompatibleComment
+
+from jkcommentcrawler.merge import merge_comments
+
+
+def generate_sources(target_date: date, comment_count: int, source_count: int) -> list[list[XMLCompatibleComment]]:
+    """
+    前日の深夜から翌日の未明までに投稿された、取得元ごとに投稿日時昇順のダミーコメントを生成する
+
+    Args:
+        target_date (date): 対象の日付
+        comment_count (int): 生成するコメントの総数
+        source_count (int): 取得元の数
+
+    Returns:
+        list[list[XMLCompatibleComment]]: 取得元ごとのコメントのリスト
+    """
+
+    random.seed(0)
+    day_start = datetime.combine(target_date, time.min).timestamp()
+    # 実際の番組・スレッドと同様に、日付の境界をまたぐ 28 時間分を取得元で分担する
+    range_start = day_start - 2 * 60 * 60
+    range_length = 28 * 60 * 60 / source_count
+
+    sources: list[list[XMLCompatibleComment]] = []
+    for source_index in range(source_count):
+        source_start = range_start + range_length * source_index
+        # 取得元同士の放送時間を少し重ねる
+        timestamps = sorted(
+            source_start + random.uniform(-600, range_length) for _ in range(comment_count // source_count)
+        )
+        sources.append(
+            [
+                XMLCompatibleComment.model_construct(
+                    thread=str(source_index),
+                    no=no,
+                    vpos=int((timestamp - source_start) * 100),
+                    date=int(timestamp),
+                    date_usec=int((timestamp % 1) * 1000000),
+                    mail='184',
+                    user_id=f'user{no % 1000}',
+                    premium=None,
+                    anonymity=1,
+                    content='わこつ',
+                )
+                for no, timestamp in enumerate(timestamps, start=1)
+            ]
+        )
+    return sources
+
+
+def sort_and_scan(sources: list[list[XMLCompatibleComment]], target_date: date) -> list[XMLCompatibleComment]:
+    """従来の処理 (連結 → datetime による日付の絞り込み → 全体のソート)"""
+
+    comments: list[XMLCompatibleComment] = []
+    for source_comments in sources:
+        comments.extend(source_comments)
+    comments = [comment for comment in comments if datetime.fromtimestamp(comment.date_with_usec).date() == target_date]
+    comments.sort(key=lambda comment: comment.date_with_usec)
+    return comments
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Micro-benchmark of merging and date-filtering comments.')
+    parser.add_argument('--comments', type=int, default=300000, help='Total number of comments.')
+    parser.add_argument('--sources', type=int, default=6, help='Number of programs / threads.')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of repetitions (the best time is reported).')
+    args = parser.parse_args()
+
+    target_date = date.today() - timedelta(days=1)
+    sources = generate_sources(target_date, args.comments, args.sources)
+
+    # 両者の結果が完全に一致することを確認する
+    expected = sort_and_scan(sources, target_date)
+    actual = merge_comments(sources, target_date)
+    assert [id(comment) for comment in expected] == [id(comment) for comment in actual], 'Results do not match.'
+
+    print(f'{sum(map(len, sources))} comments from {len(sources)} sources ({len(expected)} on {target_date})')
+    results: dict[str, float] = {}
+    for name, function in (('sort-and-scan', sort_and_scan), ('k-way merge', merge_comments)):
+        results[name] = min(timeit.repeat(lambda: function(sources, target_date), number=1, repeat=args.repeat))
+        print(f'{name:>14}: {results[name] * 1000:8.1f} ms')
+    print(f'{"speedup":>14}: {results["sort-and-scan"] / results["k-way merge"]:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
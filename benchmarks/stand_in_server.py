@@ -0,0 +1,307 @@
+"""
+ベンチマーク用の NX-Jikkyo API のスタンドインサーバー
+
+実際の NX-Jikkyo に接続せずにクローラーのスループットを計測できるよう、
+/api/v1/channels/{channel_id}/threads と /api/v1/threads/{thread_id} のレスポンスをローカルで返す
+レスポンスは指定された規模で合成するか、--payload-dir に保存した実際のレスポンスをそのまま返す
+
+--payload-dir には、以下のように実際の API のレスポンスを保存しておく (存在しないものは合成したレスポンスで補う)
+    {payload_dir}/channels/{channel_id}/threads.json
+    {payload_dir}/threads/{thread_id}.json
+
+Usage:
+    python -m benchmarks.stand_in_server [--port 8000] [--days 365] [--comments-per-thread 20000] [--payload-dir DIR]
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import multiprocessing
+import random
+import re
+from datetime import date, datetime, time, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any, NamedTuple
+
+from jkcommentcrawler.nx_client import NXClient
+
+
+# 日本標準時のタイムゾーン
+JST = timezone(timedelta(hours=9))
+
+
+class PayloadConfig(NamedTuple):
+    """スタンドインサーバーが返すレスポンスの規模"""
+
+    end_date: date  # 最後のスレッドの放送開始日 (この日の 04:00 ~ 翌日 04:00 のスレッドまでを返す)
+    days: int  # 実況チャンネルごとのスレッド数 (1日1スレッド)
+    comments_per_thread: int  # スレッドごとのコメント数
+    nicolive_ratio: float  # ニコニコ実況からリアルタイムマージされたコメントの割合
+    payload_dir: str | None  # 実際の API のレスポンスを保存したフォルダのパス
+
+
+class StandInPayloads:
+    """
+    スタンドインサーバーが返すレスポンスを合成・読み込みするクラス
+    合成するレスポンスは、同じ設定なら常に同じ内容になる (コミット間で計測結果を比較できるようにするため)
+    """
+
+    def __init__(self, config: PayloadConfig) -> None:
+        """
+        StandInPayloads のコンストラクタ
+
+        Args:
+            config (PayloadConfig): レスポンスの規模
+        """
+
+        self.config = config
+        self.payload_dir = Path(config.payload_dir) if config.payload_dir is not None else None
+
+        # エンコード済みのレスポンスのキャッシュ (繰り返し計測する際に、2回目以降は合成し直さない)
+        self._cache: dict[str, bytes] = {}
+
+    @staticmethod
+    def getThreadID(jikkyo_channel_id: str, start_date: date) -> int:
+        """
+        合成するスレッドの ID を返す (実況チャンネルをまたいで重複しないようにする)
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            start_date (date): スレッドの放送開始日
+
+        Returns:
+            int: スレッド ID
+        """
+
+        return NXClient.JIKKYO_CHANNEL_ID_LIST.index(jikkyo_channel_id) * 1000000 + start_date.toordinal()
+
+    def getThreads(self, jikkyo_channel_id: str) -> bytes:
+        """
+        スレッド情報取得 API (/api/v1/channels/{channel_id}/threads) のレスポンスを返す
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+
+        Returns:
+            bytes: JSON にエンコードしたレスポンス
+        """
+
+        key = f'channels/{jikkyo_channel_id}'
+        if key not in self._cache:
+            recorded = self._readRecorded(f'channels/{jikkyo_channel_id}/threads.json')
+            if recorded is not None:
+                self._cache[key] = recorded
+            else:
+                threads = [
+                    self._getThreadInfo(jikkyo_channel_id, self.config.end_date - timedelta(days=days))
+                    for days in range(self.config.days)
+                ]
+                self._cache[key] = json.dumps(threads, ensure_ascii=False).encode('utf-8')
+        return self._cache[key]
+
+    def getThread(self, thread_id: int) -> bytes | None:
+        """
+        スレッド取得 API (/api/v1/threads/{thread_id}) のレスポンスを返す
+
+        Args:
+            thread_id (int): スレッド ID
+
+        Returns:
+            bytes | None: JSON にエンコードしたレスポンス (存在しないスレッドの場合は None)
+        """
+
+        key = f'threads/{thread_id}'
+        if key not in self._cache:
+            recorded = self._readRecorded(f'threads/{thread_id}.json')
+            if recorded is not None:
+                self._cache[key] = recorded
+            else:
+                channel_index, ordinal = divmod(thread_id, 1000000)
+                if channel_index >= len(NXClient.JIKKYO_CHANNEL_ID_LIST) or ordinal == 0:
+                    return None
+                jikkyo_channel_id = NXClient.JIKKYO_CHANNEL_ID_LIST[channel_index]
+                start_date = date.fromordinal(ordinal)
+                thread = self._getThreadInfo(jikkyo_channel_id, start_date)
+                thread['comments'] = self._getComments(thread_id, datetime.fromisoformat(thread['start_at']))
+                self._cache[key] = json.dumps(thread, ensure_ascii=False).encode('utf-8')
+        return self._cache[key]
+
+    def _readRecorded(self, relative_path: str) -> bytes | None:
+        """
+        --payload-dir に保存された実際の API のレスポンスを読み込む
+
+        Args:
+            relative_path (str): --payload-dir からの相対パス
+
+        Returns:
+            bytes | None: 保存されたレスポンス (--payload-dir が指定されていないか、ファイルがない場合は None)
+        """
+
+        if self.payload_dir is None:
+            return None
+        try:
+            return (self.payload_dir / relative_path).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _getThreadInfo(self, jikkyo_channel_id: str, start_date: date) -> dict[str, Any]:
+        """
+        合成するスレッドの情報を返す (放送開始日の 04:00 ~ 翌日 04:00 に放送された、放送終了済みのスレッド)
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            start_date (date): スレッドの放送開始日
+
+        Returns:
+            dict[str, Any]: スレッドの情報
+        """
+
+        start_at = datetime.combine(start_date, time(4), tzinfo=JST)
+        return {
+            'id': self.getThreadID(jikkyo_channel_id, start_date),
+            'channel_id': jikkyo_channel_id,
+            'start_at': start_at.isoformat(),
+            'end_at': (start_at + timedelta(days=1)).isoformat(),
+            'duration': 24 * 60 * 60,
+            'title': f'{jikkyo_channel_id} {start_date.strftime("%Y/%m/%d")} のスレッド',
+            'description': 'ベンチマーク用に合成したスレッド',
+            'status': 'PAST',
+        }
+
+    def _getComments(self, thread_id: int, start_at: datetime) -> list[dict[str, Any]]:
+        """
+        合成するスレッドのコメントを返す (投稿日時昇順)
+
+        Args:
+            thread_id (int): スレッド ID
+            start_at (datetime): スレッドの放送開始日時
+
+        Returns:
+            list[dict[str, Any]]: コメントのリスト
+        """
+
+        rng = random.Random(thread_id)
+        count = self.config.comments_per_thread
+        offsets = sorted(rng.uniform(0, 24 * 60 * 60) for _ in range(count))
+        comments: list[dict[str, Any]] = []
+        for index, offset in enumerate(offsets):
+            is_nicolive = rng.random() < self.config.nicolive_ratio
+            user_number = rng.randrange(5000)
+            comments.append(
+                {
+                    'id': index + 1,
+                    'thread_id': thread_id,
+                    'no': index + 1,
+                    'vpos': int(offset * 100),
+                    'date': (start_at + timedelta(seconds=offset)).isoformat(),
+                    'mail': rng.choice(['184', '184 white', '184 red shita', '']),
+                    'user_id': f'nicolive:{user_number}' if is_nicolive else f'user{user_number:05d}',
+                    'premium': rng.random() < 0.2,
+                    'anonymity': rng.random() < 0.9,
+                    'content': rng.choice(['草', 'ｷﾀ━━━━(ﾟ∀ﾟ)━━━━!!', 'こんばんは', '<おお> & "すごい"', 'www'])
+                    + str(index % 100),
+                }
+            )
+        return comments
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    """NX-Jikkyo API のスタンドインサーバーのリクエストハンドラー"""
+
+    # keep-alive 接続を再利用できるよう HTTP/1.1 で応答する
+    protocol_version = 'HTTP/1.1'
+
+    # レスポンスを返す StandInPayloads (サーバーの起動時に設定する)
+    payloads: StandInPayloads
+
+    THREADS_PATTERN = re.compile(r'^/api/v1/channels/(jk\d+)/threads$')
+    THREAD_PATTERN = re.compile(r'^/api/v1/threads/(\d+)$')
+
+    def do_GET(self) -> None:
+        body: bytes | None = None
+        if match := self.THREADS_PATTERN.match(self.path):
+            body = self.payloads.getThreads(match.group(1))
+        elif match := self.THREAD_PATTERN.match(self.path):
+            body = self.payloads.getThread(int(match.group(1)))
+
+        if body is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # リクエストごとのアクセスログは計測の邪魔になるため出力しない
+        pass
+
+
+def serve(config: PayloadConfig, port: int, connection: Connection | None = None) -> None:
+    """
+    スタンドインサーバーを起動し、終了されるまでリクエストを処理する
+
+    Args:
+        config (PayloadConfig): レスポンスの規模
+        port (int): 待ち受けるポート番号 (0 なら空いているポートを使う)
+        connection (Connection | None, default=None): 待ち受けを開始したポート番号を親プロセスに通知するためのパイプ
+    """
+
+    StandInRequestHandler.payloads = StandInPayloads(config)
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandInRequestHandler)
+    if connection is not None:
+        connection.send(server.server_port)
+        connection.close()
+    server.serve_forever()
+
+
+def start_server_process(config: PayloadConfig) -> tuple[multiprocessing.Process, str]:
+    """
+    スタンドインサーバーを別プロセスで起動する
+    計測対象のプロセスと GIL・メモリを取り合わないよう、サーバーは必ず別プロセスで動かす
+
+    Args:
+        config (PayloadConfig): レスポンスの規模
+
+    Returns:
+        tuple[multiprocessing.Process, str]: サーバーのプロセスと、NX-Jikkyo API のベース URL の代わりに使う URL
+    """
+
+    receiver, sender = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.get_context('spawn').Process(target=serve, args=(config, 0, sender), daemon=True)
+    process.start()
+    sender.close()
+    port = receiver.recv()
+    receiver.close()
+    return process, f'http://127.0.0.1:{port}/api/v1'
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='NX-Jikkyo API stand-in server for benchmarks')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--end-date', type=str, default='2024/08/05')
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--comments-per-thread', type=int, default=20000)
+    parser.add_argument('--nicolive-ratio', type=float, default=0.05)
+    parser.add_argument('--payload-dir', type=str, default=None)
+    args = parser.parse_args()
+
+    config = PayloadConfig(
+        end_date=datetime.strptime(args.end_date, '%Y/%m/%d').date(),
+        days=args.days,
+        comments_per_thread=args.comments_per_thread,
+        nicolive_ratio=args.nicolive_ratio,
+        payload_dir=args.payload_dir,
+    )
+    print(f'Serving NX-Jikkyo API stand-in on http://127.0.0.1:{args.port}/api/v1')
+    serve(config, args.port)
+
+
+if __name__ == '__main__':
+    main()
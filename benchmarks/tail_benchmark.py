@@ -0,0 +1,142 @@
+"""
+放送中の NX-Jikkyo スレッドを tail (WebSocket でのコメント受信) で追記した過去ログが、
+放送終了後に全コメントを取得し直して保存した過去ログと一致するかを確かめ、tail の通信量・処理量を計測するベンチマーク
+
+ローカルのスタンドインサーバー (benchmarks/live_stand_in_server.py) を別プロセスで起動し、以下の順に実行する
+    1. 差分モードで当日分のコメントを収集する (常駐モードの差分収集と同じ)
+    2. 放送が終了するまで、ACTIVE なスレッドの新しいコメントを tailThread() で受信して追記する
+    3. 放送終了後に、別のフォルダに当日分のコメントを収集し直す
+    4. 2 と 3 の過去ログ・索引ファイルをバイト単位で比較する
+ニコニコ生放送は、番組がない NDGRClient のスタブで置き換える
+
+Usage:
+    python -m benchmarks.tail_benchmark [--channels 3] [--duration 30] [--rate 20] [--initial-comments 1000]
+        [--drop-interval SECONDS]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import anyio
+
+import jkcommentcrawler.crawler
+from benchmarks.crawler_benchmark import BenchmarkCrawler, StubNDGRClient
+from benchmarks.live_stand_in_server import LiveConfig, start_server_process
+from jkcommentcrawler.nx_client import NXClient
+
+
+async def run(jikkyo_channel_ids: list[str], temp_dir: anyio.Path) -> bool:
+    """
+    差分モードでの収集・tail での追記・収集し直しを実行し、tail で追記した過去ログが収集し直した過去ログと一致するかを返す
+
+    Args:
+        jikkyo_channel_ids (list[str]): tail する実況チャンネル ID のリスト
+        temp_dir (anyio.Path): 過去ログ・キャッシュを保存する一時フォルダのパス
+
+    Returns:
+        bool: 全ての実況チャンネルの過去ログが一致したなら True
+    """
+
+    target_date = datetime.now().date()
+
+    # 差分モードで当日分のコメントを収集してから、放送が終了するまで新しいコメントを受信して追記する
+    async with BenchmarkCrawler(
+        kakolog_dir=temp_dir / 'tail' / 'kakolog',
+        cache_dir=temp_dir / 'tail' / 'cache',
+        niconico_mail='',
+        niconico_password='',
+        incremental=True,
+    ) as crawler:
+        await crawler.crawlChannels(jikkyo_channel_ids, target_date)
+        if set(crawler.active_nx_threads) != set(jikkyo_channel_ids):
+            print(f'Expected active threads for all channels, got: {crawler.active_nx_threads}')
+            return False
+        crawl_requests = crawler.http_pool.request_count
+        crawl_bytes = crawler.http_pool.received_bytes
+
+        start = time.perf_counter()
+        results = await asyncio.gather(
+            *[
+                crawler.tailThread(jikkyo_channel_id, nx_thread_id)
+                for jikkyo_channel_id, nx_thread_id in crawler.active_nx_threads.items()
+            ]
+        )
+        tail_time = time.perf_counter() - start
+        tail_requests = crawler.http_pool.request_count - crawl_requests
+        tail_bytes = crawler.http_pool.received_bytes - crawl_bytes
+        appended = sum(
+            event.get('comments', 0) for event in crawler.metrics.events if event['stage'] == 'stream_append'
+        )
+        if not all(results):
+            print('Streaming stopped before the threads ended.')
+            return False
+
+    # 放送終了後に、別のフォルダに全コメントを収集し直す
+    async with BenchmarkCrawler(
+        kakolog_dir=temp_dir / 'rebuild' / 'kakolog',
+        cache_dir=temp_dir / 'rebuild' / 'cache',
+        niconico_mail='',
+        niconico_password='',
+    ) as crawler:
+        comment_counts = await crawler.crawlChannels(jikkyo_channel_ids, target_date)
+
+    print(f'Tail: {tail_time:.1f} seconds, {appended} comments received and appended')
+    print(f'REST requests during tail: {tail_requests} ({tail_bytes / 1024:.1f} KiB received)')
+
+    matched = True
+    for jikkyo_channel_id in jikkyo_channel_ids:
+        # 過去ログと、その1分ごとの索引ファイルの両方を比較する
+        relative_path = f'{jikkyo_channel_id}/{target_date.strftime("%Y")}/{target_date.strftime("%Y%m%d")}.nicojk'
+        channel_matched = True
+        for suffix in ('', '.idx'):
+            tailed = await (temp_dir / 'tail' / 'kakolog' / f'{relative_path}{suffix}').read_bytes()
+            rebuilt = await (temp_dir / 'rebuild' / 'kakolog' / f'{relative_path}{suffix}').read_bytes()
+            channel_matched = channel_matched and tailed == rebuilt
+        status = 'OK' if channel_matched is True else 'MISMATCH'
+        print(f'[{jikkyo_channel_id}] {comment_counts[jikkyo_channel_id]} comments: {status}')
+        matched = matched and channel_matched
+    return matched
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Check and measure tailing of active NX-Jikkyo threads')
+    parser.add_argument('--channels', type=int, default=3)
+    parser.add_argument('--duration', type=float, default=30, help='seconds until the threads end')
+    parser.add_argument('--rate', type=float, default=20, help='comments per second in each thread')
+    parser.add_argument('--initial-comments', type=int, default=1000)
+    parser.add_argument('--nicolive-ratio', type=float, default=0.05)
+    parser.add_argument('--drop-interval', type=float, default=None, help='drop all WebSocket connections periodically')
+    args = parser.parse_args()
+
+    # NX-Jikkyo API をスタンドインサーバーに、ニコニコ生放送を番組がない NDGRClient のスタブに置き換える
+    server_process, base_url = start_server_process(
+        LiveConfig(
+            channels=args.channels,
+            duration=args.duration,
+            rate=args.rate,
+            initial_comments=args.initial_comments,
+            nicolive_ratio=args.nicolive_ratio,
+            drop_interval=args.drop_interval,
+        )
+    )
+    NXClient.API_BASE_URL = base_url
+    StubNDGRClient.PROGRAMS_PER_DAY = 0
+    jkcommentcrawler.crawler.NDGRClient = StubNDGRClient  # type: ignore
+
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            matched = asyncio.run(run(NXClient.JIKKYO_CHANNEL_ID_LIST[: args.channels], anyio.Path(temp_dir)))
+    finally:
+        server_process.terminate()
+        server_process.join()
+    sys.exit(0 if matched is True else 1)
+
+
+if __name__ == '__main__':
+    main()
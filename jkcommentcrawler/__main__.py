@@ -1,18 +1,20 @@
-import asyncio
 import configparser
-import json
-import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
+from pathlib import Path
 
 import anyio
 import typer
-from ndgr_client import NDGRClient, XMLCompatibleComment
 from ndgr_client.utils import AsyncTyper
 from rich import print
 from rich.rule import Rule
 from rich.style import Style
 
 from jkcommentcrawler import NXClient, __version__
+from jkcommentcrawler.columnar_archive import ColumnarArchive
+from jkcommentcrawler.crawler import Crawler
+from jkcommentcrawler.daemon import CrawlerDaemon, CrawlPass
+from jkcommentcrawler.dataset_structure import DatasetStructure
+from jkcommentcrawler.utils import write_file_atomically
 
 
 app = AsyncTyper()
@@ -29,20 +31,117 @@ async def main(
     channel_id: str = typer.Argument(
         help='コメントを収集する実況チャンネル。(ex: jk211) all を指定すると全チャンネルのコメントを収集する。'
     ),
-    date: str = typer.Argument(help='コメントを収集する日付。(ex: 2024/08/05)'),
+    date: str | None = typer.Argument(
+        None, help='コメントを収集する日付。(ex: 2024/08/05) --from / --to・--daemon を指定する場合は省略する。'
+    ),
+    date_from: str | None = typer.Option(
+        None, '--from', help='コメントを収集する期間の開始日。(ex: 2024/08/01) --to とあわせて指定する。'
+    ),
+    date_to: str | None = typer.Option(
+        None, '--to', help='コメントを収集する期間の終了日 (この日を含む)。(ex: 2024/08/31) --from とあわせて指定する。'
+    ),
     save_dataset_structure_json: bool = typer.Option(
         False,
         '--save-dataset-structure-json',
         help='過去ログデータのフォルダ/ファイル構造を示す JSON ファイルを出力する。',
     ),
+    rebuild_dataset_structure_json: bool = typer.Option(
+        False,
+        '--rebuild-dataset-structure-json',
+        help='過去ログデータのフォルダ/ファイル構造を全て走査し直してから JSON ファイルを出力する。',
+    ),
+    export_columnar: Path | None = typer.Option(
+        None,
+        '--export-columnar',
+        help='今回の実行で内容が変わった日の過去ログを、実況チャンネル/年/月ごとにパーティション分割した列指向のファイルに書き出すフォルダ。',
+    ),
+    rebuild_columnar: bool = typer.Option(
+        False,
+        '--rebuild-columnar',
+        help='過去ログフォルダ全体を走査し、--export-columnar のフォルダにまだ書き出していない日・書き出した後に変更された日を全て書き出す。',
+    ),
+    changed_files_list: Path | None = typer.Option(
+        None,
+        '--changed-files-list',
+        help='今回の実行で内容が変わったファイルのパス (過去ログフォルダからの相対パス) の一覧を出力するファイル。',
+    ),
+    metrics_jsonl: Path | None = typer.Option(
+        None,
+        '--metrics-jsonl',
+        help='段階ごとの所要時間・バイト数・コメント数とリトライ回数を JSON Lines 形式で追記するファイル。',
+    ),
+    metrics_prom: Path | None = typer.Option(
+        None,
+        '--metrics-prom',
+        help='今回の実行のメトリクスを Prometheus の textfile collector 形式で出力するファイル。(拡張子は .prom)',
+    ),
     force: bool = typer.Option(False, '-f', '--force', help='以前取得したログの方が文字数が多い場合でも上書きする。'),
+    incremental: bool = typer.Option(
+        False,
+        '-i',
+        '--incremental',
+        help='前回保存したコメントからの差分だけを既存のログに追記する。(追記できない場合はログ全体を作り直す)',
+    ),
+    concurrency: int = typer.Option(
+        1, '-c', '--concurrency', min=1, help='同時にコメントを収集する実況チャンネルの数。(1 なら順番に収集する)'
+    ),
+    workers: int = typer.Option(
+        0,
+        '-w',
+        '--workers',
+        min=0,
+        help='コメントの変換・マージ・XML への変換を行うワーカープロセスの数。(0 ならプロセスを分けずに順番に行う)',
+    ),
+    nicolive_limit: int = typer.Option(2, '--nicolive-limit', min=1, help='ニコニコ生放送への同時リクエスト数の上限。'),
+    nx_jikkyo_limit: int = typer.Option(4, '--nx-jikkyo-limit', min=1, help='NX-Jikkyo への同時リクエスト数の上限。'),
+    daemon: bool = typer.Option(
+        False,
+        '--daemon',
+        help='常駐して定期的に当日分のコメントを差分収集し、--daily-at の時刻には前日分のコメントを強制的に収集し直す。',
+    ),
+    poll_interval: int = typer.Option(
+        300, '--poll-interval', min=1, help='常駐モードで当日分のコメントを差分収集する間隔 (秒)。'
+    ),
+    daily_at: str = typer.Option(
+        '00:01,00:15,12:01,12:15',
+        '--daily-at',
+        help='常駐モードで前日分のコメントを強制的に収集し直す時刻のカンマ区切りのリスト。(ex: 00:01,12:01)',
+    ),
+    sync_command: str | None = typer.Option(
+        None,
+        '--sync-command',
+        help='常駐モードで収集が終わるたびに実行するコマンド。(ex: ./JKCommentCrawler.sh sync)',
+    ),
+    tail: bool = typer.Option(
+        False,
+        '--tail',
+        help='常駐モードで、放送中の NX-Jikkyo スレッドの新しいコメントを WebSocket で受信し続けて追記する。(差分収集の代わりに使う)',
+    ),
     verbose: bool = typer.Option(False, '-v', '--verbose', help='詳細なログを表示する。'),
     version: bool = typer.Option(None, '--version', callback=version, is_eager=True, help='バージョン情報を表示する。'),
 ):
     print(Rule(characters='=', style=Style(color='#E33157')))
-    target_date = datetime.strptime(date, '%Y/%m/%d').date()
-    if target_date > datetime.now().date():
-        raise Exception('Target date is in the future.')
+
+    # コメントを収集する日付のリストを作成
+    ## --from / --to が指定された場合は、期間内の全ての日付のコメントを1回の実行でまとめて収集する
+    ## 常駐モードでは、収集する日付はスケジュールに従って決める
+    if daemon is True:
+        if date is not None or date_from is not None or date_to is not None:
+            raise Exception('Date cannot be specified in daemon mode.')
+        daily_times = [datetime.strptime(daily_time.strip(), '%H:%M').time() for daily_time in daily_at.split(',')]
+    elif date is not None and date_from is None and date_to is None:
+        start_date = end_date = datetime.strptime(date, '%Y/%m/%d').date()
+    elif date is None and date_from is not None and date_to is not None:
+        start_date = datetime.strptime(date_from, '%Y/%m/%d').date()
+        end_date = datetime.strptime(date_to, '%Y/%m/%d').date()
+        if start_date > end_date:
+            raise Exception('--from date is after --to date.')
+    else:
+        raise Exception('Specify either a date or both --from and --to.')
+    if daemon is False:
+        if end_date > datetime.now().date():
+            raise Exception('Target date is in the future.')
+        target_dates = [start_date + timedelta(days=days) for days in range((end_date - start_date).days + 1)]
 
     # 設定読み込み
     config_ini = anyio.Path(__file__).parent.parent / 'JKCommentCrawler.ini'
@@ -51,6 +150,10 @@ async def main(
     config = configparser.ConfigParser()
     config.read(config_ini, encoding='utf-8')
     kakolog_dir: anyio.Path = await anyio.Path(config.get('Default', 'jkcomment_folder').rstrip('/')).resolve()
+    cache_dir: anyio.Path = await anyio.Path(
+        config.get('Default', 'cache_folder', fallback='./cache/').rstrip('/')
+    ).resolve()
+    comment_cache_max_size: int = config.getint('Default', 'comment_cache_max_size_mb', fallback=1024) * 1024 * 1024
     niconico_mail: str = config.get('Default', 'nicologin_mail')
     niconico_password: str = config.get('Default', 'nicologin_password')
 
@@ -60,197 +163,193 @@ async def main(
     else:
         jikkyo_channel_ids = [channel_id]
 
-    # 過去ログ収集対象のニコニコ実況チャンネルごとに
-    comment_counts: dict[str, int] = {}
-    for jikkyo_channel_id in jikkyo_channel_ids:
-        # 最初の取得が失敗した場合は3回までリトライ
-        for retry_count in range(4):
-            try:
-                print(
-                    f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}]\\[{jikkyo_channel_id}] '
-                    f'Retrieve comments broadcast during {target_date.strftime("%Y/%m/%d")}.'
+    # 過去ログ収集対象のニコニコ実況チャンネルごとにコメントを収集
+    ## --concurrency に 2 以上が指定された場合は、複数の実況チャンネルを並列に収集する
+    async with Crawler(
+        kakolog_dir=kakolog_dir,
+        cache_dir=cache_dir,
+        niconico_mail=niconico_mail,
+        niconico_password=niconico_password,
+        force=force,
+        verbose=verbose,
+        concurrency=concurrency,
+        incremental=incremental,
+        nicolive_limit=nicolive_limit,
+        nx_jikkyo_limit=nx_jikkyo_limit,
+        comment_cache_max_size=comment_cache_max_size,
+        workers=workers,
+    ) as crawler:
+        # --daemon が指定された場合は常駐し、SIGTERM / SIGINT を受け取るまで繰り返し収集する
+        ## 収集が終わるたびに dataset_structure.json・変更されたファイルの一覧・メトリクスを保存してから、同期コマンドを実行する
+        ## Prometheus の textfile collector 用のファイルは、差分収集と1日ごとの収集で別々のファイルに出力する
+        if daemon is True:
+
+            async def on_pass_finished(crawl_pass: CrawlPass) -> None:
+                await finish_run(
+                    crawler,
+                    save_dataset_structure_json=save_dataset_structure_json,
+                    rebuild_dataset_structure_json=rebuild_dataset_structure_json,
+                    export_columnar=export_columnar,
+                    rebuild_columnar=rebuild_columnar,
+                    changed_files_list=changed_files_list,
+                    metrics_jsonl=metrics_jsonl,
+                    metrics_prom=(
+                        metrics_prom.with_name(f'{metrics_prom.stem}_{crawl_pass.name}{metrics_prom.suffix}')
+                        if metrics_prom is not None
+                        else None
+                    ),
                 )
 
-                # 指定された日付に一部でも放送されたニコニコ生放送番組を取得
-                ## NX-Jikkyo にはあるが本家ニコニコ実況に存在しない実況チャンネル (ex: jk141) では実行しない
-                if jikkyo_channel_id not in NDGRClient.JIKKYO_CHANNEL_ID_MAP:
-                    nicolive_program_ids = []
-                    print(
-                        f'Skipping retrieval of Nicolive comments as the channel {jikkyo_channel_id} does not exist on Nicolive.'
-                    )
-                else:
-                    nicolive_program_ids = await NDGRClient.getProgramIDsOnDate(jikkyo_channel_id, target_date)
-                    print(
-                        f'Retrieving Nicolive comments from {len(nicolive_program_ids)} programs.'
-                        + (f' ({", ".join(nicolive_program_ids)})' if len(nicolive_program_ids) > 0 else '')
-                    )
+            crawler_daemon = CrawlerDaemon(
+                crawler,
+                jikkyo_channel_ids,
+                poll_interval=poll_interval,
+                daily_times=daily_times,
+                sync_command=sync_command,
+                on_pass_finished=on_pass_finished,
+                tail=tail,
+            )
+            await crawler_daemon.run()
+            return
 
-                # 指定された日付に一部でも放送された NX-Jikkyo スレッドを取得
-                nx_thread_ids = await NXClient.getThreadIDsOnDate(jikkyo_channel_id, target_date)
+        comment_counts = await crawler.crawlDates(jikkyo_channel_ids, target_dates)
+
+    # 全チャンネルをダウンロードしたときは、各チャンネルごとの合計コメント数を表示
+    ## 保存されている過去ログのコメント数・文字数は、ファイルを読み込まずにマニフェストから取得する
+    ## 複数の日付を収集したときは、日付ごとに表示する
+    if channel_id == 'all':
+        for target_date, date_comment_counts in comment_counts.items():
+            if len(target_dates) > 1:
+                print(f'Download completed for all channels on {target_date.strftime("%Y/%m/%d")}.')
+            else:
+                print('Download completed for all channels.')
+            for jikkyo_channel_id, count in date_comment_counts.items():
+                entry = await crawler.manifest.getEntry(jikkyo_channel_id, target_date)
                 print(
-                    f'Retrieving NX-Jikkyo comments from {len(nx_thread_ids)} threads.'
-                    + (f' ({", ".join(map(str, nx_thread_ids))})' if len(nx_thread_ids) > 0 else '')
+                    f'{jikkyo_channel_id:>5}: {count:>5} comments'
+                    + (f' (saved: {entry.comment_count} comments, {entry.chars} chars)' if entry is not None else '')
                 )
-                print(Rule(characters='-', style=Style(color='#E33157')))
-
-                # ダウンロードしたコメントを格納するリスト
-                comments: list[XMLCompatibleComment] = []
-
-                # ニコニコ生放送番組 ID ごとに
-                for nicolive_program_id in nicolive_program_ids:
-                    # NDGRClient を初期化
-                    async with NDGRClient(nicolive_program_id, verbose=verbose, console_output=True) as ndgr_client:
-                        # ニコニコアカウントにログイン (タイムシフト再生に必要)
-                        ## すでにログイン済みの Cookie が cookies.json にあれば Cookie を再利用し、ない場合は新規ログインを行う
-                        cookies_json = anyio.Path(__file__).parent.parent / 'cookies.json'
-                        if await cookies_json.exists():
-                            async with await cookies_json.open(encoding='utf-8') as f:
-                                cookies_dict = json.loads(await f.read())
-                            cookies_dict = await ndgr_client.login(cookies=cookies_dict)
-                            # もし None が返る場合はログインセッションが切れた可能性が高いので、メールアドレスとパスワードを指定して再ログインを実行
-                            if cookies_dict is None:
-                                cookies_dict = await ndgr_client.login(mail=niconico_mail, password=niconico_password)
-                                if cookies_dict is None:
-                                    raise Exception('Failed to login to niconico.')
-                                async with await cookies_json.open('w', encoding='utf-8') as f:
-                                    await f.write(json.dumps(cookies_dict))
-                        else:
-                            # cookies.json が存在しない場合は新規ログインを実行
-                            cookies_dict = await ndgr_client.login(mail=niconico_mail, password=niconico_password)
-                            if cookies_dict is None:
-                                raise Exception('Failed to login to niconico.')
-                            async with await cookies_json.open('w', encoding='utf-8') as f:
-                                await f.write(json.dumps(cookies_dict))
-
-                        # コメントをダウンロードしてリストに追加
-                        comments.extend(
-                            [
-                                NDGRClient.convertToXMLCompatibleComment(comment)
-                                for comment in await ndgr_client.downloadBackwardComments()
-                            ]
-                        )
-
-                # NX-Jikkyo スレッドごとに
-                for nx_thread_id in nx_thread_ids:
-                    # NXClient を初期化
-                    async with NXClient(nx_thread_id, verbose=verbose, console_output=True) as nx_client:
-                        # コメントをダウンロードしてリストに追加
-                        comments.extend(await nx_client.downloadBackwardComments())
-
-                # 指定された日付以外に投稿されたコメントを除外
-                print(f'Total comments for {jikkyo_channel_id}: {len(comments)}')
-                comments = [
-                    comment
-                    for comment in comments
-                    if datetime.fromtimestamp(comment.date_with_usec).date() == target_date
-                ]
-                print(f'Excluding comments posted on dates other than {target_date.strftime("%Y/%m/%d")} ...')
-                print(f'Final comments for {jikkyo_channel_id}: {len(comments)}')
-                comment_counts[jikkyo_channel_id] = len(comments)
-
-                # コメント投稿日時昇順で並び替え
-                ## ニコニコ実況と NX-Jikkyo のコメントを時系列でマージするためにこの処理が必要
-                comments.sort(key=lambda comment: comment.date_with_usec)
-
-                # {kakolog_dir}/{jikkyo_channel_id}/{date.year}/{date.strftime('%Y%m%d')}.nicojk に保存
-                ## 取得できたコメントが1つもない場合は実行しない
-                if len(comments) > 0:
-                    output_dir = kakolog_dir / jikkyo_channel_id / str(target_date.year)
-                    await output_dir.mkdir(parents=True, exist_ok=True)
-                    output_file = output_dir / f'{target_date.strftime("%Y%m%d")}.nicojk'
-
-                    # コメントリストを XML 文字列に変換
-                    xml_content = NDGRClient.convertToXMLString(comments)
-
-                    # 既存の XML ファイルがあれば文字数を取得
-                    if await output_file.exists():
-                        async with await output_file.open(encoding='utf-8') as f:
-                            existing_length = len(await f.read())
-                    else:
-                        existing_length = 0
-
-                    # コメントが1件も取得できていない場合は過去ログを保存しない
-                    if len(xml_content) == 0:
-                        print(f'Skipping log save for {target_date.strftime("%Y/%m/%d")} as there are 0 comments.')
-
-                    # 既存のファイルの方が文字数が多い場合は過去ログを保存しない
-                    elif existing_length > len(xml_content) and not force:
-                        print(
-                            f'Skipping log save as the previously retrieved log has more characters. '
-                            f'(Previous: {existing_length} chars, Current: {len(xml_content)} chars)'
-                        )
-
-                    # 過去ログを保存
-                    else:
-                        # 既存のファイルの方が文字数が多いが、--force が指定されている場合は上書きする
-                        if existing_length > len(xml_content) and force:
-                            print(
-                                f'The previously retrieved log has more characters, but overwriting as --force is specified. '
-                                f'(Previous: {existing_length} chars, Current: {len(xml_content)} chars)'
-                            )
-                        # ファイルに書き込む
-                        async with await output_file.open('w', encoding='utf-8') as f:
-                            await f.write(xml_content)
-                        print(f'Log saved to {output_file}.')
-
-                # コメントが1件も取得できていない場合はスキップ
-                elif len(comments) == 0:
-                    print(
-                        f'No comments found for {jikkyo_channel_id} on {target_date.strftime("%Y/%m/%d")}. Skipping ...'
-                    )
-                print(Rule(characters='=', style=Style(color='#E33157')))
-
-                # 正常にダウンロードできたらループを抜ける
-                break
+            print(Rule(characters='=', style=Style(color='#E33157')))
+
+    await finish_run(
+        crawler,
+        save_dataset_structure_json=save_dataset_structure_json,
+        rebuild_dataset_structure_json=rebuild_dataset_structure_json,
+        export_columnar=export_columnar,
+        rebuild_columnar=rebuild_columnar,
+        changed_files_list=changed_files_list,
+        metrics_jsonl=metrics_jsonl,
+        metrics_prom=metrics_prom,
+    )
+
+
+async def finish_run(
+    crawler: Crawler,
+    save_dataset_structure_json: bool,
+    rebuild_dataset_structure_json: bool,
+    export_columnar: Path | None,
+    rebuild_columnar: bool,
+    changed_files_list: Path | None,
+    metrics_jsonl: Path | None,
+    metrics_prom: Path | None,
+) -> None:
+    """
+    コメントの収集が終わった後に、HTTP 接続の統計を表示し、指定されたオプションに応じて
+    dataset_structure.json・列指向のファイル・内容が変わったファイルの一覧・メトリクスを保存する
+
+    Args:
+        crawler (Crawler): コメントを収集した Crawler
+        save_dataset_structure_json (bool): dataset_structure.json を保存するかどうか
+        rebuild_dataset_structure_json (bool): フォルダ/ファイル構造を全て走査し直してから dataset_structure.json を保存するかどうか
+        export_columnar (Path | None): 過去ログを列指向のファイルに書き出すフォルダのパス
+        rebuild_columnar (bool): 過去ログフォルダ全体を走査し、書き出していない・変更された日を全て書き出すかどうか
+        changed_files_list (Path | None): 内容が変わったファイルの一覧を保存するファイルのパス
+        metrics_jsonl (Path | None): メトリクスを JSON Lines 形式で追記するファイルのパス
+        metrics_prom (Path | None): メトリクスを Prometheus の textfile collector 形式で出力するファイルのパス
+    """
+
+    kakolog_dir = crawler.kakolog_dir
+    cache_dir = crawler.cache_dir
+
+    # NX-Jikkyo への HTTP 接続を再利用できた回数を表示
+    http_pool = crawler.http_pool
+    print(
+        f'NX-Jikkyo HTTP connections: {http_pool.new_connections} new, {http_pool.reused_connections} reused '
+        f'({http_pool.request_count} requests)'
+    )
+    print(Rule(characters='=', style=Style(color='#E33157')))
 
-            except Exception:
-                if retry_count < 3:
-                    # エラー発生時は3回までリトライ
-                    print(
-                        f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}]\\[{jikkyo_channel_id}] '
-                        f'Unexpected error occurred. Retrying ({retry_count + 1}/3) after 3 seconds ...'
-                    )
-                    print(traceback.format_exc())
-                    await asyncio.sleep(3)
-                else:
-                    # リトライ失敗、このチャンネルはスキップして次の実況チャンネルへ
-                    print(
-                        f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}]\\[{jikkyo_channel_id}] '
-                        f'Unexpected error occurred. Retrying failed. Skipping ...'
-                    )
-                    print(traceback.format_exc())
-                print(Rule(characters='=', style=Style(color='#E33157')))
+    # 今回の実行で実際に内容が変わったファイル
+    ## 常駐モードで前回同期できなかったファイルを含めて同期できるよう、dataset_structure.json も Crawler 側に記録する
+    changed_files = crawler.changed_files
 
-    # 全チャンネルをダウンロードしたときは、各チャンネルごとの合計コメント数を表示
-    if channel_id == 'all':
-        print('Download completed for all channels.')
-        for jikkyo_channel_id, count in comment_counts.items():
-            print(f'{jikkyo_channel_id:>5}: {count:>5} comments')
+    # --save-dataset-structure-json が指定されているときは、データセットの構造を JSON ファイルに保存
+    ## 毎回ツリー全体を走査せず、キャッシュフォルダに保存したツリーのインデックスに今回書き込んだファイルだけを反映する
+    ## インデックスがない・実際のツリーと食い違っている場合や、--rebuild-dataset-structure-json が指定された場合はツリー全体を走査し直す
+    if save_dataset_structure_json is True or rebuild_dataset_structure_json is True:
+        with crawler.metrics.measure('dataset_structure'):
+            dataset_structure = DatasetStructure(kakolog_dir, cache_dir / 'dataset_structure_index.json')
+            if rebuild_dataset_structure_json is True or await dataset_structure.load() is False:
+                print('Scanning the whole dataset structure ...')
+                await dataset_structure.rescan()
+            else:
+                await dataset_structure.update(crawler.changed_files)
+                if await dataset_structure.isStale() is True:
+                    print('Rescanning the whole dataset structure as the index is out of date ...')
+                    await dataset_structure.rescan()
+            await dataset_structure.save()
+            if await dataset_structure.saveStructure() is True:
+                changed_files.add(dataset_structure.structure_path)
+                print(f'Dataset structure saved to {dataset_structure.structure_path}.')
+            else:
+                print(f'Dataset structure is up to date. ({dataset_structure.structure_path})')
         print(Rule(characters='=', style=Style(color='#E33157')))
 
-    # --save-dataset-structure-json が指定されているときは、データセットの構造を JSON ファイルに保存
-    if save_dataset_structure_json is True:
+    # --export-columnar が指定されているときは、過去ログを実況チャンネル/年/月ごとの列指向のファイルに書き出す
+    ## 毎回全ての過去ログを書き出し直さず、今回の実行で内容が変わった日だけを書き出す
+    ## --rebuild-columnar が指定された場合は過去ログフォルダ全体を走査し、まだ書き出していない・書き出した後に変更された日を書き出す
+    if export_columnar is not None:
+        with crawler.metrics.measure('columnar_export') as event:
+            columnar_archive = ColumnarArchive(anyio.Path(export_columnar))
+            if rebuild_columnar is True:
+                print('Scanning the whole dataset for columnar export ...')
+                exported_days = await columnar_archive.exportAll(kakolog_dir)
+            else:
+                exported_days = await columnar_archive.exportLogs(kakolog_dir, changed_files)
+            event['comments'] = columnar_archive.exported_comments
+            event['bytes'] = columnar_archive.exported_bytes
+        print(f'{exported_days} days ({columnar_archive.exported_comments} comments) exported to {export_columnar}.')
+        print(Rule(characters='=', style=Style(color='#E33157')))
 
-        async def get_directory_contents(
-            directory_path: anyio.Path, nest: bool = False
-        ) -> dict[str, dict[str, dict[str, None]]]:
-            if not await directory_path.exists():
-                raise FileNotFoundError(f'Directory "{directory_path}" does not exist.')
-            data = {}
-            # anyio.Path.iterdir() は非同期イテレータを返すため、リスト内包表記で収集してからソートする
-            items = sorted([item async for item in directory_path.iterdir()])
-            for item in items:
-                if await item.is_dir() and (item.name.startswith('jk') or nest is True):
-                    data[item.name] = await get_directory_contents(item, nest=True)
-                elif await item.is_file() and nest is True:
-                    data[item.name] = None
-            return data
+    # --changed-files-list が指定されているときは、内容が変わったファイルのパスの一覧を保存する
+    ## パスは過去ログフォルダからの相対パスで、1行に1つずつ書き込む (git add --pathspec-from-file にそのまま渡せる)
+    ## 変更されたファイルがない場合も空のファイルを書き込む
+    if changed_files_list is not None:
+        changed_file_paths = sorted(str(changed_file.relative_to(kakolog_dir)) for changed_file in changed_files)
+        changed_files_list_path = anyio.Path(changed_files_list)
+        await changed_files_list_path.parent.mkdir(parents=True, exist_ok=True)
+        await write_file_atomically(
+            changed_files_list_path,
+            ''.join(f'{changed_file_path}\n' for changed_file_path in changed_file_paths).encode('utf-8'),
+        )
+        print(f'{len(changed_file_paths)} changed files listed in {changed_files_list_path}.')
+        print(Rule(characters='=', style=Style(color='#E33157')))
 
-        dataset_structure = await get_directory_contents(kakolog_dir)
-        dataset_structure_file = kakolog_dir / 'dataset_structure.json'
-        async with await dataset_structure_file.open('w', encoding='utf-8') as f:
-            await f.write(json.dumps(dataset_structure, ensure_ascii=False, indent=4))
-        print(f'Dataset structure saved to {dataset_structure_file}.')
+    # --metrics-jsonl / --metrics-prom が指定されているときは、今回の実行のメトリクスを出力する
+    ## JSON Lines の実行ログは追記し、Prometheus の textfile collector 用のファイルは実行ごとに置き換える
+    if metrics_jsonl is not None or metrics_prom is not None:
+        crawler.metrics.set('http_new_connections', http_pool.new_connections)
+        crawler.metrics.set('http_reused_connections', http_pool.reused_connections)
+        crawler.metrics.set('http_requests', http_pool.request_count)
+        crawler.metrics.set('http_received_bytes', http_pool.received_bytes)
+        crawler.metrics.set('changed_files', len(changed_files))
+        crawler.metrics.set('niconico_logins', crawler.auth.login_count)
+        if metrics_jsonl is not None:
+            await crawler.metrics.writeJSONLines(anyio.Path(metrics_jsonl))
+            print(f'Metrics appended to {metrics_jsonl}.')
+        if metrics_prom is not None:
+            await crawler.metrics.writePrometheus(anyio.Path(metrics_prom))
+            print(f'Metrics saved to {metrics_prom}.')
         print(Rule(characters='=', style=Style(color='#E33157')))
 
 
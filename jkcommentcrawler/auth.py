@@ -0,0 +1,182 @@
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import Any
+
+import anyio
+from ndgr_client import NDGRClient
+
+from jkcommentcrawler.utils import write_file_atomically
+
+
+# ログインセッションが切れている・無効になっていることを示す HTTP ステータスコード
+AUTH_ERROR_STATUS_CODES = {401, 403}
+
+
+def is_auth_error(exception: BaseException) -> bool:
+    """
+    例外の原因が、ニコニコのログインセッションが切れている・無効になっていることによるものかどうかを返す
+
+    Args:
+        exception (BaseException): 失敗の原因になった例外
+
+    Returns:
+        bool: ログインし直せば成功する可能性がある例外なら True
+    """
+
+    response: Any = getattr(exception, 'response', None)
+    return getattr(response, 'status_code', None) in AUTH_ERROR_STATUS_CODES
+
+
+class NiconicoAuthManager:
+    """
+    クロール実行中のニコニコアカウントのログイン状態を管理するクラス
+    cookies.json の読み込み (必要ならメールアドレスとパスワードでの再ログイン) は実行ごとに最初の1回だけ行い、
+    以降に初期化された NDGRClient には、検証済みの Cookie を NDGRClient.login() で設定する
+    メールアドレスとパスワードでの再ログインは、ログインセッションが切れていた場合にだけ行う
+    """
+
+    def __init__(self, niconico_mail: str, niconico_password: str, cookies_json: anyio.Path) -> None:
+        """
+        NiconicoAuthManager のコンストラクタ
+
+        Args:
+            niconico_mail (str): ニコニコにログインするメールアドレス
+            niconico_password (str): ニコニコにログインするパスワード
+            cookies_json (anyio.Path): ログイン済みの Cookie を保存する cookies.json のパス
+        """
+
+        self.niconico_mail = niconico_mail
+        self.niconico_password = niconico_password
+        self.cookies_json = cookies_json
+
+        # 検証済みの Cookie (まだ検証していない場合は None)
+        self._cookies: dict[str, str] | None = None
+
+        # 検証済みの Cookie の世代 (ログインし直すたびに増える)
+        ## 同じ Cookie で失敗した複数のリクエストが、それぞれ再ログインしないようにするために使う
+        self._generation = 0
+
+        # ログイン処理と cookies.json の読み書きを直列化するためのロック
+        ## 複数の実況チャンネルを並列に処理している際に、同時にログインして cookies.json を書き換えないようにする
+        self._lock = asyncio.Lock()
+
+        # ニコニコへのログイン処理 (Cookie の検証・メールアドレスとパスワードでのログイン) を実行した回数
+        self.login_count = 0
+
+    async def login(self, ndgr_client: NDGRClient) -> int:
+        """
+        NDGRClient をニコニコアカウントにログインした状態にする (タイムシフト再生に必要)
+        最初の呼び出しでは cookies.json の Cookie を検証し、切れていればメールアドレスとパスワードで再ログインする
+        2回目以降の呼び出しでは、検証済みの Cookie を NDGRClient に設定するだけで、切れていない限り再ログインは行わない
+
+        Args:
+            ndgr_client (NDGRClient): ログインする NDGRClient のインスタンス
+
+        Returns:
+            int: NDGRClient に設定した Cookie の世代 (ログインセッションの期限切れで失敗した際に refresh() に渡す)
+
+        Raises:
+            Exception: ニコニコへのログインに失敗した場合
+        """
+
+        async with self._lock:
+            if self._cookies is None:
+                self._cookies = await self._validateOrLogin(ndgr_client)
+                self._generation += 1
+            elif await self._applyCookies(ndgr_client, self._cookies) is False:
+                self._cookies = await self._loginWithPassword(ndgr_client)
+                self._generation += 1
+            return self._generation
+
+    async def refresh(self, ndgr_client: NDGRClient, generation: int) -> int:
+        """
+        ログインセッションの期限切れでリクエストが失敗した際に、メールアドレスとパスワードで再ログインする
+        同じ世代の Cookie で失敗したリクエストが同時に呼び出しても、再ログインは1回だけ行い、
+        すでに他のリクエストが再ログインしていれば、その Cookie を NDGRClient に設定するだけにする
+
+        Args:
+            ndgr_client (NDGRClient): 再ログインする NDGRClient のインスタンス
+            generation (int): 失敗したリクエストで使った Cookie の世代 (login() の戻り値)
+
+        Returns:
+            int: NDGRClient に設定した Cookie の世代
+
+        Raises:
+            Exception: ニコニコへのログインに失敗した場合
+        """
+
+        async with self._lock:
+            if (
+                self._cookies is None
+                or generation == self._generation
+                or await self._applyCookies(ndgr_client, self._cookies) is False
+            ):
+                self._cookies = await self._loginWithPassword(ndgr_client)
+                self._generation += 1
+            return self._generation
+
+    async def _validateOrLogin(self, ndgr_client: NDGRClient) -> dict[str, str]:
+        """
+        cookies.json の Cookie でログインし、Cookie が切れているか cookies.json がない場合はメールアドレスとパスワードでログインする
+
+        Args:
+            ndgr_client (NDGRClient): ログインする NDGRClient のインスタンス
+
+        Returns:
+            dict[str, str]: 検証済みの Cookie
+
+        Raises:
+            Exception: ニコニコへのログインに失敗した場合
+        """
+
+        if await self.cookies_json.exists():
+            async with await self.cookies_json.open(encoding='utf-8') as f:
+                cookies_dict = json.loads(await f.read())
+            self.login_count += 1
+            cookies_dict = await ndgr_client.login(cookies=cookies_dict)
+            if cookies_dict is not None:
+                return cookies_dict
+
+        # もし None が返る場合はログインセッションが切れた可能性が高いので、メールアドレスとパスワードを指定して再ログインを実行
+        # cookies.json が存在しない場合も新規ログインを実行
+        return await self._loginWithPassword(ndgr_client)
+
+    async def _loginWithPassword(self, ndgr_client: NDGRClient) -> dict[str, str]:
+        """
+        メールアドレスとパスワードでログインし、取得した Cookie を cookies.json に保存する
+
+        Args:
+            ndgr_client (NDGRClient): ログインする NDGRClient のインスタンス
+
+        Returns:
+            dict[str, str]: ログインして取得した Cookie
+
+        Raises:
+            Exception: ニコニコへのログインに失敗した場合
+        """
+
+        self.login_count += 1
+        cookies_dict = await ndgr_client.login(mail=self.niconico_mail, password=self.niconico_password)
+        if cookies_dict is None:
+            raise Exception('Failed to login to niconico.')
+        await write_file_atomically(self.cookies_json, json.dumps(cookies_dict).encode('utf-8'))
+        return cookies_dict
+
+    async def _applyCookies(self, ndgr_client: NDGRClient, cookies: dict[str, str]) -> bool:
+        """
+        検証済みの Cookie を、NDGRClient の公開 API (NDGRClient.login()) で NDGRClient に設定する
+        NDGRClient 内部の HTTP クライアントには直接触れないため、NDGRClient の実装が変わっても、
+        Cookie が設定されないまま (ログインしていない状態で) リクエストが送られることはない
+
+        Args:
+            ndgr_client (NDGRClient): Cookie を設定する NDGRClient のインスタンス
+            cookies (dict[str, str]): 検証済みの Cookie
+
+        Returns:
+            bool: Cookie でログインできたなら True (ログインセッションが切れていた場合は False)
+        """
+
+        self.login_count += 1
+        return await ndgr_client.login(cookies=cookies) is not None
@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import json
+from datetime import date
+from typing import Any
+
+import anyio
+
+from jkcommentcrawler.utils import write_file_atomically
+
+
+class IncrementalCheckpoint:
+    """
+    差分モードで、実況チャンネル・日付ごとに前回保存した時点のコメントの状態を記録するチェックポイント
+    コメントの取得元 (ニコニコ生放送番組・NX-Jikkyo スレッド) ごとに、前回取得した最後のコメント番号とそれまでのコメント数を保持する
+    次回実行時にこれと突き合わせることで、新しく投稿されたコメントだけを既存の .nicojk ファイルに追記できるかを判定する
+    """
+
+    # チェックポイントファイルのフォーマットのバージョン
+    VERSION = 1
+
+    def __init__(
+        self,
+        checkpoint_path: anyio.Path,
+        file_size: int = 0,
+        comment_count: int = 0,
+        last_date_with_usec: float = 0.0,
+        sources: dict[str, tuple[int, int]] | None = None,
+    ) -> None:
+        """
+        IncrementalCheckpoint のコンストラクタ
+
+        Args:
+            checkpoint_path (anyio.Path): チェックポイントファイルのパス
+            file_size (int, default=0): 前回保存した時点の .nicojk ファイルのサイズ (バイト)
+            comment_count (int, default=0): 前回保存した時点の .nicojk ファイルに含まれるコメント数
+            last_date_with_usec (float, default=0.0): 前回保存した時点の .nicojk ファイルの最後のコメントの投稿日時
+            sources (dict[str, tuple[int, int]] | None, default=None): 取得元ごとの (最後のコメント番号, それまでのコメント数)
+        """
+
+        self.checkpoint_path = checkpoint_path
+        self.file_size = file_size
+        self.comment_count = comment_count
+        self.last_date_with_usec = last_date_with_usec
+        self.sources: dict[str, tuple[int, int]] = sources if sources is not None else {}
+
+    @staticmethod
+    def getCheckpointPath(checkpoint_dir: anyio.Path, jikkyo_channel_id: str, target_date: date) -> anyio.Path:
+        """
+        実況チャンネル・日付に対応するチェックポイントファイルのパスを返す
+
+        Args:
+            checkpoint_dir (anyio.Path): チェックポイントファイルを保存するフォルダのパス
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): 日付
+
+        Returns:
+            anyio.Path: チェックポイントファイルのパス
+        """
+
+        return checkpoint_dir / jikkyo_channel_id / f'{target_date.strftime("%Y%m%d")}.json'
+
+    @classmethod
+    async def load(cls, checkpoint_path: anyio.Path) -> IncrementalCheckpoint | None:
+        """
+        チェックポイントを読み込む
+
+        Args:
+            checkpoint_path (anyio.Path): チェックポイントファイルのパス
+
+        Returns:
+            IncrementalCheckpoint | None: 読み込んだチェックポイント (存在しないか壊れている場合は None)
+        """
+
+        try:
+            data: dict[str, Any] = json.loads(await checkpoint_path.read_bytes())
+            if data['version'] != cls.VERSION:
+                return None
+            return cls(
+                checkpoint_path,
+                file_size=int(data['file_size']),
+                comment_count=int(data['comment_count']),
+                last_date_with_usec=float(data['last_date_with_usec']),
+                sources={key: (int(value[0]), int(value[1])) for key, value in data['sources'].items()},
+            )
+        except (FileNotFoundError, ValueError, KeyError, IndexError, TypeError):
+            return None
+
+    async def save(self) -> None:
+        """
+        チェックポイントをアトミックに保存する
+        """
+
+        await self.checkpoint_path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            'version': self.VERSION,
+            'file_size': self.file_size,
+            'comment_count': self.comment_count,
+            'last_date_with_usec': self.last_date_with_usec,
+            'sources': {key: list(value) for key, value in self.sources.items()},
+        }
+        await write_file_atomically(self.checkpoint_path, json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+    async def delete(self) -> None:
+        """
+        チェックポイントを削除する (.nicojk ファイルの内容と対応しなくなった場合に使う)
+        """
+
+        await self.checkpoint_path.unlink(missing_ok=True)
+
+    def getAppendableSources(self, file_size: int, source_comment_nos: dict[str, list[int]]) -> dict[str, int] | None:
+        """
+        今回取得したコメントが、前回保存した .nicojk ファイルへの追記で済むかを判定する
+        前回取得した範囲のコメント数が変わっている (ニコニコ生放送でコメントが削除された) 場合や、
+        前回の取得元が消えている場合、.nicojk ファイルが前回保存した時点から変更されている場合は追記できない
+
+        Args:
+            file_size (int): 現在の .nicojk ファイルのサイズ (バイト)
+            source_comment_nos (dict[str, list[int]]): 今回取得したコメントの取得元ごとのコメント番号のリスト
+
+        Returns:
+            dict[str, int] | None: 追記できる場合は取得元ごとの前回取得した最後のコメント番号 (新しい取得元は 0)、追記できない場合は None
+        """
+
+        if file_size != self.file_size:
+            return None
+
+        last_nos: dict[str, int] = {}
+        for source, (last_no, count) in self.sources.items():
+            comment_nos = source_comment_nos.get(source)
+            if comment_nos is None:
+                return None
+            if sum(1 for comment_no in comment_nos if comment_no <= last_no) != count:
+                return None
+            last_nos[source] = last_no
+        for source in source_comment_nos:
+            last_nos.setdefault(source, 0)
+        return last_nos
+
+    @staticmethod
+    def summarizeSources(source_comment_nos: dict[str, list[int]]) -> dict[str, tuple[int, int]]:
+        """
+        取得元ごとのコメント番号のリストから、チェックポイントに記録する (最後のコメント番号, コメント数) を求める
+
+        Args:
+            source_comment_nos (dict[str, list[int]]): 取得元ごとのコメント番号のリスト
+
+        Returns:
+            dict[str, tuple[int, int]]: 取得元ごとの (最後のコメント番号, コメント数)
+        """
+
+        return {
+            source: (max(comment_nos, default=0), len(comment_nos))
+            for source, comment_nos in source_comment_nos.items()
+        }
@@ -0,0 +1,372 @@
+from __future__ import annotations
+
+import os
+import re
+import struct
+from collections.abc import AsyncIterator, Iterable
+from datetime import date
+from typing import NamedTuple
+
+import anyio
+
+from jkcommentcrawler.comment_batch import CommentBatch
+from jkcommentcrawler.utils import write_file_atomically
+
+
+class ColumnarSegment(NamedTuple):
+    """列指向アーカイブのパーティションファイルに記録された、1日分のコメントの列の情報"""
+
+    date_ordinal: int  # 日付 (date.toordinal() の値)
+    comment_count: int  # コメント数
+    offset: int  # パーティションファイルの先頭からの、列のバイト列の開始位置
+    length: int  # 列のバイト列の長さ
+    source_size: int  # 書き出した時点の .nicojk ファイルのサイズ (バイト)
+    source_mtime_ns: int  # 書き出した時点の .nicojk ファイルの最終更新日時 (ナノ秒単位の UNIX タイムスタンプ)
+
+
+class ColumnarArchive:
+    """
+    過去ログ (.nicojk ファイル) を、実況チャンネル/年/月ごとにパーティション分割した列指向のファイルに書き出し、読み込むクラス
+    何年分もの XML を1日ずつパースし直さずに、チャンネル・時間帯ごとのコメント数やユーザーごとの集計を行えるようにする
+
+    パーティションファイルは {export_dir}/{jikkyo_channel_id}/{YYYY}/{YYYYMM}.jkcol に保存し、以下の形式で書き込む
+        ヘッダー: マジック (4 バイト)・バージョン (2 バイト)・予約 (2 バイト)・日数 (4 バイト)
+        目次: 日付昇順の日ごとの ColumnarSegment
+        本体: 日ごとの CommentBatch.toBytes() のバイト列 (no / vpos / date などの数値は列ごとの配列、mail / user_id などは辞書エンコード)
+    日ごとに列を分けて目次に .nicojk ファイルのサイズ・最終更新日時を記録しておくことで、
+    書き出しでは内容が変わった日だけをパースし直し、読み込みでは目次から必要な日の列だけにシークできる
+    """
+
+    # パーティションファイルのマジックとフォーマットのバージョン
+    ## バージョン 2: CommentBatch.toBytes() に name / hash / deleted の列を追加し、premium / anonymity の値をそのまま保存する
+    ## 古いバージョンのパーティションファイルは、次の書き出し時に作り直す
+    MAGIC = b'JKCA'
+    VERSION = 2
+
+    # ヘッダー: マジック・バージョン・予約・日数
+    HEADER = struct.Struct('<4sHHI')
+    # 目次: 日付・コメント数・開始位置・長さ・.nicojk ファイルのサイズ・最終更新日時
+    SEGMENT = struct.Struct('<IIQQQq')
+
+    # 過去ログフォルダ内の .nicojk ファイルの相対パス ({jikkyo_channel_id}/{YYYY}/{YYYYMMDD}.nicojk)
+    LOG_PATH_PATTERN = re.compile(r'^(jk\d+)/(\d{4})/(\d{4})(\d{2})(\d{2})\.nicojk$')
+
+    def __init__(self, export_dir: anyio.Path) -> None:
+        """
+        ColumnarArchive のコンストラクタ
+
+        Args:
+            export_dir (anyio.Path): パーティションファイルを保存するフォルダのパス
+        """
+
+        self.export_dir = export_dir
+
+        # 書き出した日数・コメント数・パーティションファイルのバイト数
+        self.exported_days = 0
+        self.exported_comments = 0
+        self.exported_bytes = 0
+
+    def getPartitionPath(self, jikkyo_channel_id: str, year: int, month: int) -> anyio.Path:
+        """
+        実況チャンネル・年・月に対応するパーティションファイルのパスを返す
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            year (int): 年
+            month (int): 月
+
+        Returns:
+            anyio.Path: {export_dir}/{jikkyo_channel_id}/{YYYY}/{YYYYMM}.jkcol のパス
+        """
+
+        return self.export_dir / jikkyo_channel_id / f'{year:04d}' / f'{year:04d}{month:02d}.jkcol'
+
+    async def exportLogs(self, kakolog_dir: anyio.Path, nicojk_paths: Iterable[anyio.Path]) -> int:
+        """
+        指定された .nicojk ファイル (今回の実行で内容が変わったファイルなど) の日だけを、パーティションファイルに書き出し直す
+        .nicojk ファイル以外のパスは無視する
+        パーティションファイルがないか壊れている場合は、その月の .nicojk ファイルを全て書き出す
+
+        Args:
+            kakolog_dir (anyio.Path): 過去ログを保存するフォルダのパス
+            nicojk_paths (Iterable[anyio.Path]): 書き出す .nicojk ファイルのパス
+
+        Returns:
+            int: 書き出した日数
+        """
+
+        # パーティションごとに書き出す日付をまとめ、1回の実行で同じパーティションファイルを何度も書き換えないようにする
+        partitions: dict[tuple[str, int, int], set[date]] = {}
+        for nicojk_path in nicojk_paths:
+            try:
+                relative_path = nicojk_path.relative_to(kakolog_dir).as_posix()
+            except ValueError:
+                continue
+            match = self.LOG_PATH_PATTERN.match(relative_path)
+            if match is None:
+                continue
+            jikkyo_channel_id = match.group(1)
+            target_date = date(int(match.group(3)), int(match.group(4)), int(match.group(5)))
+            partitions.setdefault((jikkyo_channel_id, target_date.year, target_date.month), set()).add(target_date)
+
+        exported_days = 0
+        for (jikkyo_channel_id, year, month), target_dates in sorted(partitions.items()):
+            exported_days += await self._exportPartition(kakolog_dir, jikkyo_channel_id, year, month, target_dates)
+        return exported_days
+
+    async def exportAll(self, kakolog_dir: anyio.Path) -> int:
+        """
+        過去ログフォルダ内の全ての .nicojk ファイルを走査し、パーティションファイルに記録されたサイズ・最終更新日時と
+        一致しない (まだ書き出していない・書き出した後に変更された) 日だけを書き出す
+        .nicojk ファイルが削除された日は、パーティションファイルからも削除する
+
+        Args:
+            kakolog_dir (anyio.Path): 過去ログを保存するフォルダのパス
+
+        Returns:
+            int: 書き出した日数
+        """
+
+        def scan() -> set[tuple[str, int, int]]:
+            partitions: set[tuple[str, int, int]] = set()
+            for root_dir in (str(kakolog_dir), str(self.export_dir)):
+                if not os.path.isdir(root_dir):
+                    continue
+                for channel_entry in os.scandir(root_dir):
+                    if not channel_entry.is_dir() or re.fullmatch(r'jk\d+', channel_entry.name) is None:
+                        continue
+                    for year_entry in os.scandir(channel_entry.path):
+                        if not year_entry.is_dir() or re.fullmatch(r'\d{4}', year_entry.name) is None:
+                            continue
+                        for file_entry in os.scandir(year_entry.path):
+                            match = re.fullmatch(r'(\d{4})(\d{2})(?:\d{2}\.nicojk|\.jkcol)', file_entry.name)
+                            if match is not None:
+                                partitions.add((channel_entry.name, int(match.group(1)), int(match.group(2))))
+            return partitions
+
+        exported_days = 0
+        for jikkyo_channel_id, year, month in sorted(await anyio.to_thread.run_sync(scan)):
+            exported_days += await self._exportPartition(kakolog_dir, jikkyo_channel_id, year, month, None)
+        return exported_days
+
+    async def query(
+        self,
+        jikkyo_channel_ids: Iterable[str] | None = None,
+        start_date: date | None = None,
+        end_date: date | None = None,
+    ) -> AsyncIterator[tuple[str, date, CommentBatch]]:
+        """
+        指定された実況チャンネル・期間のコメントを、実況チャンネル・日付ごとの CommentBatch として順に返す
+        実況チャンネル・年・月で対象外のパーティションファイルは開かず、パーティションファイル内でも目次から対象の日の列だけを読み込む
+
+        Args:
+            jikkyo_channel_ids (Iterable[str] | None, default=None): 実況チャンネル ID (省略時は全ての実況チャンネル)
+            start_date (date | None, default=None): 期間の開始日 (省略時は最も古い日から)
+            end_date (date | None, default=None): 期間の終了日 (この日を含む・省略時は最も新しい日まで)
+
+        Yields:
+            tuple[str, date, CommentBatch]: 実況チャンネル ID・日付と、その日のコメント (.nicojk ファイルと同じ順序)
+        """
+
+        if jikkyo_channel_ids is None:
+            if not await self.export_dir.is_dir():
+                return
+            jikkyo_channel_ids = [
+                path.name async for path in self.export_dir.iterdir() if re.fullmatch(r'jk\d+', path.name) is not None
+            ]
+        # jk1, jk2, ..., jk10 の順に並べる
+        channel_ids = sorted(set(jikkyo_channel_ids), key=lambda channel_id: int(channel_id.removeprefix('jk')))
+        start_ordinal = start_date.toordinal() if start_date is not None else 0
+        end_ordinal = end_date.toordinal() if end_date is not None else date.max.toordinal()
+        start_month = (start_date.year, start_date.month) if start_date is not None else (0, 0)
+        end_month = (end_date.year, end_date.month) if end_date is not None else (9999, 12)
+
+        for jikkyo_channel_id in channel_ids:
+            channel_dir = self.export_dir / jikkyo_channel_id
+            if not await channel_dir.is_dir():
+                continue
+            partition_paths: list[tuple[tuple[int, int], anyio.Path]] = []
+            async for year_dir in channel_dir.iterdir():
+                if (
+                    re.fullmatch(r'\d{4}', year_dir.name) is None
+                    or not start_month[0] <= int(year_dir.name) <= end_month[0]
+                ):
+                    continue
+                async for partition_path in year_dir.iterdir():
+                    match = re.fullmatch(r'(\d{4})(\d{2})\.jkcol', partition_path.name)
+                    if match is None:
+                        continue
+                    month = (int(match.group(1)), int(match.group(2)))
+                    if start_month <= month <= end_month:
+                        partition_paths.append((month, partition_path))
+
+            for _, partition_path in sorted(partition_paths):
+                async with await partition_path.open('rb') as f:
+                    segments = await self._readTableOfContents(f)
+                    if segments is None:
+                        continue
+                    for segment in segments:
+                        if not start_ordinal <= segment.date_ordinal <= end_ordinal:
+                            continue
+                        await f.seek(segment.offset)
+                        data = await f.read(segment.length)
+                        batch = await anyio.to_thread.run_sync(CommentBatch.fromBytes, data, segment.comment_count)
+                        yield jikkyo_channel_id, date.fromordinal(segment.date_ordinal), batch
+
+    async def _exportPartition(
+        self,
+        kakolog_dir: anyio.Path,
+        jikkyo_channel_id: str,
+        year: int,
+        month: int,
+        target_dates: set[date] | None,
+    ) -> int:
+        """
+        1つのパーティションファイルを更新する
+        書き出し直さない日の列は、パースし直さずにバイト列のままコピーする
+
+        Args:
+            kakolog_dir (anyio.Path): 過去ログを保存するフォルダのパス
+            jikkyo_channel_id (str): 実況チャンネル ID
+            year (int): 年
+            month (int): 月
+            target_dates (set[date] | None): 書き出し直す日付 (None の場合はサイズ・最終更新日時が一致しない日を全て書き出す)
+
+        Returns:
+            int: 書き出した日数
+        """
+
+        partition_path = self.getPartitionPath(jikkyo_channel_id, year, month)
+        segments = await self._readPartition(partition_path)
+        if segments is None:
+            # パーティションファイルがないか壊れている場合は、その月の全ての日を書き出し直す
+            segments = {}
+            target_dates = None
+
+        # その月の .nicojk ファイルの一覧
+        log_dir = kakolog_dir / jikkyo_channel_id / f'{year:04d}'
+        log_paths: dict[int, anyio.Path] = {}
+        if await log_dir.is_dir():
+            async for log_path in log_dir.glob(f'{year:04d}{month:02d}??.nicojk'):
+                match = re.fullmatch(r'(\d{4})(\d{2})(\d{2})\.nicojk', log_path.name)
+                if match is not None:
+                    log_paths[date(year, month, int(match.group(3))).toordinal()] = log_path
+
+        changed = False
+        exported_days = 0
+        for date_ordinal in sorted(set(segments) | set(log_paths)):
+            if target_dates is not None and date.fromordinal(date_ordinal) not in target_dates:
+                continue
+            log_path = log_paths.get(date_ordinal)
+            # .nicojk ファイルが削除された日は、パーティションファイルからも削除する
+            if log_path is None:
+                del segments[date_ordinal]
+                changed = True
+                continue
+            stat = await log_path.stat()
+            existing = segments.get(date_ordinal)
+            if (
+                target_dates is None
+                and existing is not None
+                and existing[0].source_size == stat.st_size
+                and existing[0].source_mtime_ns == stat.st_mtime_ns
+            ):
+                continue
+            # 常駐モードの tail で追記中のファイルを読み込んだ場合に備え、最後の完全な <chat> 要素までを書き出す
+            ## 途中までしか書き出せなかった場合はサイズが一致しなくなるため、次回の書き出しで書き出し直される
+            data = await log_path.read_bytes()
+            data = data[: data.rfind(b'</chat>') + len(b'</chat>')] if b'</chat>' in data else b''
+            batch = await anyio.to_thread.run_sync(CommentBatch.fromXMLString, data)
+            body = await anyio.to_thread.run_sync(batch.toBytes)
+            segment = ColumnarSegment(date_ordinal, len(batch), 0, len(body), len(data), stat.st_mtime_ns)
+            segments[date_ordinal] = (segment, body)
+            changed = True
+            exported_days += 1
+            self.exported_days += 1
+            self.exported_comments += len(batch)
+
+        if changed is False:
+            return exported_days
+        if len(segments) == 0:
+            await partition_path.unlink(missing_ok=True)
+            return exported_days
+        content = self._buildPartition([segments[date_ordinal] for date_ordinal in sorted(segments)])
+        await partition_path.parent.mkdir(parents=True, exist_ok=True)
+        await write_file_atomically(partition_path, content)
+        self.exported_bytes += len(content)
+        return exported_days
+
+    async def _readPartition(self, partition_path: anyio.Path) -> dict[int, tuple[ColumnarSegment, bytes]] | None:
+        """
+        パーティションファイルを読み込み、日ごとの目次と列のバイト列を返す
+
+        Args:
+            partition_path (anyio.Path): パーティションファイルのパス
+
+        Returns:
+            dict[int, tuple[ColumnarSegment, bytes]] | None: 日付ごとの目次と列のバイト列 (存在しないか壊れている場合は None)
+        """
+
+        try:
+            data = await partition_path.read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            magic, version, _, segment_count = self.HEADER.unpack_from(data, 0)
+            if magic != self.MAGIC or version != self.VERSION:
+                return None
+            segments: dict[int, tuple[ColumnarSegment, bytes]] = {}
+            for segment_index in range(segment_count):
+                segment = ColumnarSegment._make(
+                    self.SEGMENT.unpack_from(data, self.HEADER.size + segment_index * self.SEGMENT.size)
+                )
+                if segment.offset + segment.length > len(data):
+                    return None
+                segments[segment.date_ordinal] = (segment, data[segment.offset : segment.offset + segment.length])
+            return segments
+        except struct.error:
+            return None
+
+    async def _readTableOfContents(self, f: anyio.AsyncFile[bytes]) -> list[ColumnarSegment] | None:
+        """
+        パーティションファイルのヘッダーと目次だけを読み込む (列のバイト列は読み込まない)
+
+        Args:
+            f (anyio.AsyncFile[bytes]): 先頭から読み込むパーティションファイル
+
+        Returns:
+            list[ColumnarSegment] | None: 日付昇順の目次 (ヘッダーが不正な場合は None)
+        """
+
+        header = await f.read(self.HEADER.size)
+        if len(header) != self.HEADER.size:
+            return None
+        magic, version, _, segment_count = self.HEADER.unpack(header)
+        if magic != self.MAGIC or version != self.VERSION:
+            return None
+        table = await f.read(segment_count * self.SEGMENT.size)
+        if len(table) != segment_count * self.SEGMENT.size:
+            return None
+        return [
+            ColumnarSegment._make(self.SEGMENT.unpack_from(table, segment_index * self.SEGMENT.size))
+            for segment_index in range(segment_count)
+        ]
+
+    def _buildPartition(self, segments: list[tuple[ColumnarSegment, bytes]]) -> bytes:
+        """
+        日付昇順の日ごとの目次と列のバイト列から、パーティションファイルの内容を作成する
+
+        Args:
+            segments (list[tuple[ColumnarSegment, bytes]]): 日付昇順の日ごとの目次と列のバイト列
+
+        Returns:
+            bytes: パーティションファイルの内容
+        """
+
+        header = self.HEADER.pack(self.MAGIC, self.VERSION, 0, len(segments))
+        offset = self.HEADER.size + len(segments) * self.SEGMENT.size
+        table = bytearray()
+        for segment, body in segments:
+            table += self.SEGMENT.pack(*segment._replace(offset=offset, length=len(body)))
+            offset += len(body)
+        return header + bytes(table) + b''.join(body for _, body in segments)
@@ -0,0 +1,607 @@
+from __future__ import annotations
+
+import json
+import struct
+import sys
+from array import array
+from collections.abc import Iterable, Iterator
+from datetime import datetime
+from itertools import pairwise
+from typing import Any, cast
+from xml.etree import ElementTree
+
+from ndgr_client import NDGRClient, XMLCompatibleComment
+from pydantic import TypeAdapter
+
+
+class CommentBatch:
+    """
+    ニコニコ XML 互換形式のコメントを、コメントごとのオブジェクトではなく列ごとの配列として保持するコンパクトなコメントの集合
+    no / vpos / date / date_usec は array で、thread / mail / user_id / name / hash は intern した文字列のリストで保持する
+    NX-Jikkyo から取得したコメントの変換・絞り込み・並び替えはこのまま行い、
+    XMLCompatibleComment (pydantic モデル) は呼び出し元が必要としたコメントの分だけ作成する
+    """
+
+    __slots__ = (
+        '_nicolive_user_ids',
+        'anonymity',
+        'content',
+        'date',
+        'date_usec',
+        'deleted',
+        'hash',
+        'mail',
+        'name',
+        'no',
+        'premium',
+        'thread',
+        'user_id',
+        'vpos',
+    )
+
+    # 日時文字列のパースに失敗した場合のフォールバック
+    _datetime_adapter = TypeAdapter(datetime)
+
+    def __init__(self) -> None:
+        """
+        CommentBatch のコンストラクタ (空のコメントの集合を作成する)
+        """
+
+        self.thread: list[str] = []
+        self.no = array('q')
+        self.vpos = array('q')
+        self.date = array('q')
+        self.date_usec = array('q')
+        # mail / name / hash は、属性がない場合は None を入れる
+        self.mail: list[str | None] = []
+        self.user_id: list[str] = []
+        self.name: list[str | None] = []
+        self.hash: list[str | None] = []
+        # premium / anonymity / deleted は小さな整数 (premium は 1: プレミアム会員 / 3: 運営・放送者 など) のため、
+        # 1 バイトずつ保持する (0 は属性がないことを示す)
+        self.premium = bytearray()
+        self.anonymity = bytearray()
+        self.deleted = bytearray()
+        self.content: list[str] = []
+
+        # user_id ごとの、ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントかどうかの判定結果
+        ## 同じ user_id のコメントは大量にあるため、文字列の判定は user_id ごとに1回だけ行う
+        self._nicolive_user_ids: dict[str, bool] = {}
+
+    def __len__(self) -> int:
+        return len(self.no)
+
+    def __getitem__(self, index: int) -> XMLCompatibleComment:
+        return self.getComment(index)
+
+    def __iter__(self) -> Iterator[XMLCompatibleComment]:
+        for index in range(len(self)):
+            yield self.getComment(index)
+
+    def __reduce__(self) -> tuple[Any, ...]:
+        # プロセスプールのワーカープロセスに渡す際は、列ごとのコンパクトなバイト列として pickle する
+        return (CommentBatch.fromBytes, (self.toBytes(), len(self)))
+
+    def append(
+        self,
+        thread: str,
+        no: int,
+        vpos: int,
+        date: int,
+        date_usec: int,
+        mail: str | None,
+        user_id: str,
+        premium: int,
+        anonymity: int,
+        content: str,
+        name: str | None = None,
+        hash: str | None = None,
+        deleted: int = 0,
+    ) -> None:
+        """
+        コメントを1つ追加する
+
+        Args:
+            thread (str): スレッド ID
+            no (int): コメント番号
+            vpos (int): スレッドの開始時刻からの相対的なコメント投稿時刻 (1/100 秒単位)
+            date (int): コメント投稿日時の UNIX タイムスタンプ (秒単位)
+            date_usec (int): コメント投稿日時の UNIX タイムスタンプの小数点以下 (マイクロ秒単位)
+            mail (str | None): コメントのコマンド (None なら属性を出力しない)
+            user_id (str): ユーザー ID
+            premium (int): プレミアム会員のコメントかどうか (True は 1 として扱い、0 なら属性を出力しない)
+            anonymity (int): 匿名 (184) コメントかどうか (True は 1 として扱い、0 なら属性を出力しない)
+            content (str): コメント本文
+            name (str | None, default=None): コメントの投稿者名
+            hash (str | None, default=None): コメントのハッシュ
+            deleted (int, default=0): コメントが削除されているかどうか (0 なら属性を出力しない)
+        """
+
+        self.thread.append(sys.intern(thread))
+        self.no.append(no)
+        self.vpos.append(vpos)
+        self.date.append(date)
+        self.date_usec.append(date_usec)
+        self.mail.append(sys.intern(mail) if mail is not None else None)
+        self.user_id.append(sys.intern(user_id))
+        self.name.append(sys.intern(name) if name is not None else None)
+        self.hash.append(sys.intern(hash) if hash is not None else None)
+        self.premium.append(int(premium))
+        self.anonymity.append(int(anonymity))
+        self.deleted.append(int(deleted))
+        self.content.append(content)
+
+    def appendNXJikkyoComment(self, raw_comment: dict[str, Any]) -> None:
+        """
+        NX-Jikkyo のスレッド取得 API が返すコメントを、ニコニコ XML 互換形式に変換して追加する
+        pydantic モデルを経由せず、必要な型チェックだけを行って直接列に追加する
+
+        Args:
+            raw_comment (dict[str, Any]): NX-Jikkyo のスレッド取得 API が返すコメント
+
+        Raises:
+            ValueError: コメントの形式が不正な場合
+        """
+
+        try:
+            date_string = raw_comment['date']
+            try:
+                timestamp = datetime.fromisoformat(date_string).timestamp()
+            except (TypeError, ValueError):
+                timestamp = self._datetime_adapter.validate_python(date_string).timestamp()
+            thread_id, no, vpos = raw_comment['thread_id'], raw_comment['no'], raw_comment['vpos']
+            mail, user_id, content = raw_comment['mail'], raw_comment['user_id'], raw_comment['content']
+            premium, anonymity = raw_comment['premium'], raw_comment['anonymity']
+        except KeyError as ex:
+            raise ValueError(f'Invalid comment: missing field {ex}.') from ex
+        if (
+            not isinstance(thread_id, int)
+            or not isinstance(no, int)
+            or not isinstance(vpos, int)
+            or not isinstance(mail, str)
+            or not isinstance(user_id, str)
+            or not isinstance(content, str)
+        ):
+            raise ValueError(f'Invalid comment: {raw_comment!r}')
+
+        self.append(
+            # スレッド ID は NX-Jikkyo のスレッド ID を文字列化したものをそのまま入れる
+            thread=str(thread_id),
+            no=no,
+            vpos=vpos,
+            date=int(timestamp),
+            date_usec=int((timestamp % 1) * 1000000),
+            mail=mail,
+            user_id=user_id,
+            premium=bool(premium),
+            anonymity=bool(anonymity),
+            content=content,
+        )
+
+    def appendChatMessage(self, chat: dict[str, Any]) -> None:
+        """
+        NX-Jikkyo のコメントサーバー (WebSocket) が送信する、2024/06/08 以前のニコニコ生放送互換の chat メッセージを追加する
+        chat メッセージはすでにニコニコ XML 互換形式のため、値を検証して列に追加するだけでよい
+        (mail・premium・anonymity は値がない場合は省略される)
+
+        Args:
+            chat (dict[str, Any]): chat メッセージの内容 ({"chat": {...}} の {...} の部分)
+
+        Raises:
+            ValueError: コメントの形式が不正な場合
+        """
+
+        try:
+            thread, no, vpos = chat['thread'], chat['no'], chat['vpos']
+            date, date_usec = chat['date'], chat.get('date_usec', 0)
+            user_id, content = chat['user_id'], chat['content']
+        except KeyError as ex:
+            raise ValueError(f'Invalid chat message: missing field {ex}.') from ex
+        mail = chat.get('mail', '')
+        if (
+            not isinstance(no, int)
+            or not isinstance(vpos, int)
+            or not isinstance(date, int)
+            or not isinstance(date_usec, int)
+            or not isinstance(mail, str)
+            or not isinstance(user_id, str)
+            or not isinstance(content, str)
+        ):
+            raise ValueError(f'Invalid chat message: {chat!r}')
+
+        self.append(
+            thread=str(thread),
+            no=no,
+            vpos=vpos,
+            date=date,
+            date_usec=date_usec,
+            mail=mail,
+            user_id=user_id,
+            premium=chat.get('premium') == 1,
+            anonymity=chat.get('anonymity') == 1,
+            content=content,
+        )
+
+    @classmethod
+    def fromXMLString(cls, xml_content: bytes) -> CommentBatch:
+        """
+        .nicojk ファイルの内容 (ニコニコ XML 互換形式の <chat> 要素の並び) からコメントを読み込む
+        ルート要素がないため、仮のルート要素で囲んでからまとめてパースする
+        XMLCompatibleComment の全ての属性を、属性の有無も含めて保持する (toXMLString() で元の XML に戻せる)
+
+        Args:
+            xml_content (bytes): .nicojk ファイルの内容
+
+        Returns:
+            CommentBatch: 読み込んだコメントの集合
+
+        Raises:
+            ValueError: XML の形式が不正な場合
+        """
+
+        try:
+            root = ElementTree.fromstring(b'<packet>' + xml_content + b'</packet>')
+        except ElementTree.ParseError as ex:
+            raise ValueError(f'Invalid XML: {ex}') from ex
+        batch = cls()
+        for element in root.iter('chat'):
+            attributes = element.attrib
+            try:
+                batch.append(
+                    thread=attributes['thread'],
+                    no=int(attributes['no']),
+                    vpos=int(attributes['vpos']),
+                    date=int(attributes['date']),
+                    date_usec=int(attributes.get('date_usec', 0)),
+                    mail=attributes.get('mail'),
+                    user_id=attributes['user_id'],
+                    premium=int(attributes.get('premium', 0)),
+                    anonymity=int(attributes.get('anonymity', 0)),
+                    content=element.text or '',
+                    name=attributes.get('name'),
+                    hash=attributes.get('hash'),
+                    deleted=int(attributes.get('deleted', 0)),
+                )
+            except KeyError as ex:
+                raise ValueError(f'Invalid chat element: missing attribute {ex}.') from ex
+            except ValueError as ex:
+                raise ValueError(f'Invalid chat element: {ex}') from ex
+        return batch
+
+    def extend(self, other: CommentBatch) -> None:
+        """
+        別の CommentBatch のコメントを全て末尾に追加する
+
+        Args:
+            other (CommentBatch): 追加するコメントの集合
+        """
+
+        self.thread.extend(other.thread)
+        self.no.extend(other.no)
+        self.vpos.extend(other.vpos)
+        self.date.extend(other.date)
+        self.date_usec.extend(other.date_usec)
+        self.mail.extend(other.mail)
+        self.user_id.extend(other.user_id)
+        self.name.extend(other.name)
+        self.hash.extend(other.hash)
+        self.premium.extend(other.premium)
+        self.anonymity.extend(other.anonymity)
+        self.deleted.extend(other.deleted)
+        self.content.extend(other.content)
+
+    def take(self, indices: Iterable[int]) -> CommentBatch:
+        """
+        指定されたインデックスのコメントだけを、指定された順に含む新しい CommentBatch を返す
+
+        Args:
+            indices (Iterable[int]): 取り出すコメントのインデックス
+
+        Returns:
+            CommentBatch: 取り出したコメントの集合
+        """
+
+        indices = list(indices)
+        batch = CommentBatch()
+        batch.thread = [self.thread[index] for index in indices]
+        batch.no = array('q', [self.no[index] for index in indices])
+        batch.vpos = array('q', [self.vpos[index] for index in indices])
+        batch.date = array('q', [self.date[index] for index in indices])
+        batch.date_usec = array('q', [self.date_usec[index] for index in indices])
+        batch.mail = [self.mail[index] for index in indices]
+        batch.user_id = [self.user_id[index] for index in indices]
+        batch.name = [self.name[index] for index in indices]
+        batch.hash = [self.hash[index] for index in indices]
+        batch.premium = bytearray(self.premium[index] for index in indices)
+        batch.anonymity = bytearray(self.anonymity[index] for index in indices)
+        batch.deleted = bytearray(self.deleted[index] for index in indices)
+        batch.content = [self.content[index] for index in indices]
+        batch._nicolive_user_ids = self._nicolive_user_ids
+        return batch
+
+    def getDatesWithUsec(self) -> list[float]:
+        """
+        全コメントの投稿日時 (マイクロ秒を含む UNIX タイムスタンプ) を返す
+        XMLCompatibleComment.date_with_usec と同じ値になる
+
+        Returns:
+            list[float]: コメントごとの投稿日時
+        """
+
+        return [date + date_usec / 1000000 for date, date_usec in zip(self.date, self.date_usec, strict=True)]
+
+    def getDateWithUsec(self, index: int) -> float:
+        """
+        指定されたインデックスのコメントの投稿日時 (マイクロ秒を含む UNIX タイムスタンプ) を返す
+        getDatesWithUsec() と異なり全コメント分のリストを作らないため、列を直接二分探索する場合に使う
+
+        Args:
+            index (int): コメントのインデックス
+
+        Returns:
+            float: コメントの投稿日時
+        """
+
+        return self.date[index] + self.date_usec[index] / 1000000
+
+    def sort(self) -> CommentBatch:
+        """
+        コメントを投稿日時昇順に並び替えた CommentBatch を返す (すでに並んでいる場合は自身をそのまま返す)
+        投稿日時が同じコメントの順序は保たれる
+
+        Returns:
+            CommentBatch: 投稿日時昇順に並んだコメントの集合
+        """
+
+        # すでに並んでいるかどうかは、投稿日時のリストを作らずに列を先頭から順に比較して確かめる
+        dates = (date + date_usec / 1000000 for date, date_usec in zip(self.date, self.date_usec, strict=True))
+        if all(previous <= current for previous, current in pairwise(dates)):
+            return self
+        dates_with_usec = self.getDatesWithUsec()
+        return self.take(sorted(range(len(dates_with_usec)), key=dates_with_usec.__getitem__))
+
+    def excludeNicoliveComments(self) -> CommentBatch:
+        """
+        ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外した CommentBatch を返す
+        (除外するコメントがない場合は自身をそのまま返す)
+
+        Returns:
+            CommentBatch: ニコニコ実況由来のコメントを除外したコメントの集合
+        """
+
+        mask = self.getNicoliveMask()
+        if not any(mask):
+            return self
+        return self.take(index for index, is_nicolive in enumerate(mask) if is_nicolive is False)
+
+    def getNicoliveMask(self) -> list[bool]:
+        """
+        コメントごとに、ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントかどうかを返す
+
+        Returns:
+            list[bool]: コメントごとの判定結果
+        """
+
+        nicolive_user_ids = self._nicolive_user_ids
+        mask: list[bool] = []
+        for user_id in self.user_id:
+            is_nicolive = nicolive_user_ids.get(user_id)
+            if is_nicolive is None:
+                is_nicolive = nicolive_user_ids[user_id] = user_id.startswith('nicolive:')
+            mask.append(is_nicolive)
+        return mask
+
+    def getComment(self, index: int) -> XMLCompatibleComment:
+        """
+        指定されたインデックスのコメントを XMLCompatibleComment として返す
+        各列の値は変換時に検証済みのため、検証なしで構築する
+
+        Args:
+            index (int): コメントのインデックス
+
+        Returns:
+            XMLCompatibleComment: コメント
+        """
+
+        return XMLCompatibleComment.model_construct(
+            thread=self.thread[index],
+            no=self.no[index],
+            vpos=self.vpos[index],
+            date=self.date[index],
+            date_usec=self.date_usec[index],
+            name=self.name[index],
+            hash=self.hash[index],
+            mail=self.mail[index],
+            user_id=self.user_id[index],
+            premium=self.premium[index] if self.premium[index] != 0 else None,
+            anonymity=self.anonymity[index] if self.anonymity[index] != 0 else None,
+            deleted=self.deleted[index] if self.deleted[index] != 0 else None,
+            content=self.content[index],
+        )
+
+    def toComments(self) -> list[XMLCompatibleComment]:
+        """
+        全コメントを XMLCompatibleComment のリストとして返す
+
+        Returns:
+            list[XMLCompatibleComment]: コメントのリスト
+        """
+
+        return [self.getComment(index) for index in range(len(self))]
+
+    def toXMLString(self, chunk_size: int = 10000) -> str:
+        """
+        全コメントをニコニコ XML 互換形式の文字列に変換する
+        XML の書式は NDGRClient.convertToXMLString() に合わせるため変換自体は委ねるが、
+        XMLCompatibleComment を一度に全コメント分作らないよう、chunk_size 件ずつ変換して連結する
+
+        Args:
+            chunk_size (int, default=10000): 一度に XMLCompatibleComment に変換するコメント数
+
+        Returns:
+            str: ニコニコ XML 互換形式の文字列 (コメントがない場合は空文字列)
+        """
+
+        xml_chunks: list[str] = []
+        for start in range(0, len(self), chunk_size):
+            xml_chunk = NDGRClient.convertToXMLString(
+                [self.getComment(index) for index in range(start, min(start + chunk_size, len(self)))]
+            )
+            # 全コメントを一度に変換した場合と同じ内容になるよう、<chat> 要素の間に改行を補う
+            if len(xml_chunks) > 0 and xml_chunks[-1].endswith('\n') is False:
+                xml_chunks.append('\n')
+            xml_chunks.append(xml_chunk)
+        return ''.join(xml_chunks)
+
+    def toBytes(self) -> bytes:
+        """
+        全コメントをコンパクトなバイナリ形式にエンコードする
+        数値は列ごとに配列として、thread / mail / user_id / name / hash は辞書エンコードして保存する
+        キャッシュを別のアーキテクチャのマシンで読み込んでも同じ値になるよう、数値はリトルエンディアンで保存する
+
+        Returns:
+            bytes: エンコードされたバイト列
+        """
+
+        body = bytearray()
+        # 数値の列
+        for column in (self.no, self.vpos, self.date, self.date_usec):
+            body += self._packArray(column)
+        body += self.premium
+        body += self.anonymity
+        body += self.deleted
+        # 重複の多い文字列の列は辞書エンコードする
+        for strings in (self.thread, self.mail, self.user_id, self.name, self.hash):
+            body += self._encodeDictionary(strings)
+        # コメント本文は長さの配列と UTF-8 文字列の連結として保存する
+        contents = [content.encode('utf-8') for content in self.content]
+        body += self._packArray(array('I', [len(content) for content in contents]))
+        body += b''.join(contents)
+        return bytes(body)
+
+    @classmethod
+    def fromBytes(cls, data: bytes | memoryview, count: int) -> CommentBatch:
+        """
+        toBytes() でエンコードしたバイト列からコメントをデコードする
+
+        Args:
+            data (bytes | memoryview): エンコードされたバイト列
+            count (int): コメント数
+
+        Returns:
+            CommentBatch: デコードしたコメントの集合
+
+        Raises:
+            ValueError: バイト列の形式が不正な場合
+        """
+
+        body = memoryview(data)
+        batch = cls()
+        offset = 0
+        for field in ('no', 'vpos', 'date', 'date_usec'):
+            column = cls._unpackArray('q', body[offset : offset + count * 8])
+            setattr(batch, field, column)
+            offset += count * 8
+        batch.premium = bytearray(body[offset : offset + count])
+        offset += count
+        batch.anonymity = bytearray(body[offset : offset + count])
+        offset += count
+        batch.deleted = bytearray(body[offset : offset + count])
+        offset += count
+        thread, offset = cls._decodeDictionary(body, offset, count)
+        batch.mail, offset = cls._decodeDictionary(body, offset, count)
+        user_id, offset = cls._decodeDictionary(body, offset, count)
+        batch.name, offset = cls._decodeDictionary(body, offset, count)
+        batch.hash, offset = cls._decodeDictionary(body, offset, count)
+        if None in thread or None in user_id:
+            raise ValueError('Invalid comment batch data.')
+        batch.thread = cast(list[str], thread)
+        batch.user_id = cast(list[str], user_id)
+        content_lengths = cls._unpackArray('I', body[offset : offset + count * 4])
+        offset += count * 4
+        if len(content_lengths) != count or len(batch.deleted) != count:
+            raise ValueError('Invalid comment batch data.')
+        for content_length in content_lengths:
+            batch.content.append(str(body[offset : offset + content_length], 'utf-8'))
+            offset += content_length
+        return batch
+
+    @staticmethod
+    def _encodeDictionary(values: list[str] | list[str | None]) -> bytes:
+        """
+        文字列の列を、重複を除いた文字列の辞書とインデックスの配列にエンコードする
+        属性がないことを示す None も、辞書には null として含める
+
+        Args:
+            values (list[str] | list[str | None]): エンコードする文字列のリスト
+
+        Returns:
+            bytes: エンコードされたバイト列
+        """
+
+        dictionary: dict[str | None, int] = {}
+        indices = array('I', [dictionary.setdefault(value, len(dictionary)) for value in values])
+        encoded_dictionary = json.dumps(list(dictionary), ensure_ascii=False).encode('utf-8')
+        return struct.pack('<I', len(encoded_dictionary)) + encoded_dictionary + CommentBatch._packArray(indices)
+
+    @staticmethod
+    def _decodeDictionary(body: memoryview, offset: int, count: int) -> tuple[list[str | None], int]:
+        """
+        辞書エンコードされた文字列の列をデコードする
+
+        Args:
+            body (memoryview): バイト列
+            offset (int): 列の開始位置
+            count (int): コメント数
+
+        Returns:
+            tuple[list[str | None], int]: デコードした文字列のリストと、次の列の開始位置
+        """
+
+        (dictionary_length,) = struct.unpack_from('<I', body, offset)
+        offset += 4
+        # 同じ文字列を共有できるよう intern しておく
+        dictionary = [
+            sys.intern(value) if value is not None else None
+            for value in json.loads(bytes(body[offset : offset + dictionary_length]))
+        ]
+        offset += dictionary_length
+        indices = CommentBatch._unpackArray('I', body[offset : offset + count * 4])
+        offset += count * 4
+        return [dictionary[index] for index in indices], offset
+
+    @staticmethod
+    def _packArray(column: array[int]) -> bytes:
+        """
+        数値の配列をリトルエンディアンのバイト列に変換する
+
+        Args:
+            column (array[int]): 変換する配列
+
+        Returns:
+            bytes: リトルエンディアンのバイト列
+        """
+
+        if sys.byteorder == 'big':
+            column = array(column.typecode, column)
+            column.byteswap()
+        return column.tobytes()
+
+    @staticmethod
+    def _unpackArray(typecode: str, data: bytes | memoryview) -> array[int]:
+        """
+        _packArray() で変換したリトルエンディアンのバイト列を数値の配列に戻す
+
+        Args:
+            typecode (str): 配列の型コード ('q' または 'I')
+            data (bytes | memoryview): リトルエンディアンのバイト列
+
+        Returns:
+            array[int]: 数値の配列
+        """
+
+        column = array(typecode)
+        column.frombytes(data)
+        if sys.byteorder == 'big':
+            column.byteswap()
+        return column
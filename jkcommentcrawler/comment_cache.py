@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import json
+import os
+import struct
+import zlib
+from datetime import datetime
+from typing import Any, NamedTuple
+
+import anyio
+
+from jkcommentcrawler.comment_batch import CommentBatch
+from jkcommentcrawler.utils import write_file_atomically
+
+
+class CachedThread(NamedTuple):
+    """コメントキャッシュから読み込んだ NX-Jikkyo スレッド"""
+
+    id: int
+    title: str
+    status: str
+    start_at: datetime
+    end_at: datetime
+    comments: CommentBatch  # ニコニコ実況由来のコメントも含む、変換済みの全コメント (投稿日時昇順)
+
+
+class CommentCache:
+    """
+    放送が終了した (PAST の) NX-Jikkyo スレッドの変換済みコメントを、スレッド ID ごとに保存する永続キャッシュ
+    PAST のスレッドのコメントは二度と変化しないため、一度保存すれば以降はネットワークリクエストも pydantic による検証もなしに読み込める
+    キャッシュの合計サイズが上限を超えた場合は、最後に使われた日時が古いものから削除する (LRU)
+    """
+
+    # キャッシュファイルのマジックナンバーとフォーマットのバージョン
+    ## バージョン 2: CommentBatch.toBytes() に name / hash / deleted の列を追加
+    MAGIC = b'JKCC'
+    VERSION = 2
+
+    # キャッシュファイルのヘッダー (マジックナンバー・バージョン・メタデータの長さ)
+    HEADER = struct.Struct('<4sHI')
+
+    def __init__(self, cache_dir: anyio.Path, max_size: int = 1024 * 1024 * 1024) -> None:
+        """
+        CommentCache のコンストラクタ
+
+        Args:
+            cache_dir (anyio.Path): キャッシュファイルを保存するフォルダのパス
+            max_size (int, default=1GiB): キャッシュの合計サイズの上限 (バイト)
+        """
+
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def _getCachePath(self, thread_id: int) -> anyio.Path:
+        return self.cache_dir / f'{thread_id}.bin'
+
+    async def get(self, thread_id: int) -> CachedThread | None:
+        """
+        キャッシュからスレッドのコメントを読み込む
+        読み込んだキャッシュファイルは最終使用日時を更新し、削除の優先順位を下げる
+
+        Args:
+            thread_id (int): NX-Jikkyo のスレッド ID
+
+        Returns:
+            CachedThread | None: キャッシュされたスレッド (キャッシュが存在しないか壊れている場合は None)
+        """
+
+        cache_path = self._getCachePath(thread_id)
+        try:
+            data = await cache_path.read_bytes()
+        except FileNotFoundError:
+            return None
+
+        try:
+            cached_thread = self.decode(data)
+        except (ValueError, KeyError, struct.error, zlib.error, UnicodeDecodeError):
+            # 壊れたキャッシュファイルは削除してスレッドを取得し直す
+            await cache_path.unlink(missing_ok=True)
+            return None
+
+        # LRU で削除する際の基準となる最終使用日時を更新する
+        await cache_path.touch(exist_ok=True)
+        return cached_thread
+
+    async def put(
+        self,
+        thread_id: int,
+        title: str,
+        status: str,
+        start_at: datetime,
+        end_at: datetime,
+        comments: CommentBatch,
+    ) -> None:
+        """
+        スレッドのコメントをキャッシュに保存し、合計サイズが上限を超えた場合は古いキャッシュから削除する
+
+        Args:
+            thread_id (int): NX-Jikkyo のスレッド ID
+            title (str): スレッドのタイトル
+            status (str): スレッドのステータス (通常は PAST)
+            start_at (datetime): スレッドの放送開始日時
+            end_at (datetime): スレッドの放送終了日時
+            comments (CommentBatch): ニコニコ実況由来のコメントも含む、変換済みの全コメント (投稿日時昇順)
+        """
+
+        await self.cache_dir.mkdir(parents=True, exist_ok=True)
+        data = self.encode(CachedThread(thread_id, title, status, start_at, end_at, comments))
+        await write_file_atomically(self._getCachePath(thread_id), data)
+        await self.evict()
+
+    async def evict(self) -> None:
+        """
+        キャッシュの合計サイズが上限以下になるまで、最終使用日時が古いキャッシュファイルから削除する
+        """
+
+        def evict() -> None:
+            entries: list[tuple[float, int, str]] = []
+            total_size = 0
+            with os.scandir(self.cache_dir) as it:
+                for entry in it:
+                    if entry.is_file() and entry.name.endswith('.bin'):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+                        total_size += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                total_size -= size
+
+        await anyio.to_thread.run_sync(evict)
+
+    @classmethod
+    def encode(cls, thread: CachedThread) -> bytes:
+        """
+        スレッドのコメントをコンパクトなバイナリ形式にエンコードする
+        コメントは CommentBatch.toBytes() で列ごとにエンコードし、全体を zlib で圧縮して保存する
+
+        Args:
+            thread (CachedThread): エンコードするスレッド
+
+        Returns:
+            bytes: エンコードされたバイト列
+        """
+
+        comments = thread.comments
+        metadata = json.dumps(
+            {
+                'id': thread.id,
+                'title': thread.title,
+                'status': thread.status,
+                'start_at': thread.start_at.isoformat(),
+                'end_at': thread.end_at.isoformat(),
+                'count': len(comments),
+            },
+            ensure_ascii=False,
+        ).encode('utf-8')
+
+        return cls.HEADER.pack(cls.MAGIC, cls.VERSION, len(metadata)) + metadata + zlib.compress(comments.toBytes(), 6)
+
+    @classmethod
+    def decode(cls, data: bytes) -> CachedThread:
+        """
+        バイナリ形式からスレッドのコメントをデコードする
+        コメントは CommentBatch のまま読み込み、XMLCompatibleComment は必要になるまで作成しない
+
+        Args:
+            data (bytes): エンコードされたバイト列
+
+        Returns:
+            CachedThread: デコードしたスレッド
+
+        Raises:
+            ValueError: キャッシュファイルの形式が不正な場合
+        """
+
+        magic, version, metadata_length = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            raise ValueError('Invalid comment cache file.')
+        offset = cls.HEADER.size
+        metadata: dict[str, Any] = json.loads(data[offset : offset + metadata_length])
+        comments = CommentBatch.fromBytes(zlib.decompress(data[offset + metadata_length :]), metadata['count'])
+
+        return CachedThread(
+            id=metadata['id'],
+            title=metadata['title'],
+            status=metadata['status'],
+            start_at=datetime.fromisoformat(metadata['start_at']),
+            end_at=datetime.fromisoformat(metadata['end_at']),
+            comments=comments,
+        )
@@ -0,0 +1,1100 @@
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import traceback
+import weakref
+from collections.abc import Awaitable, Callable
+from datetime import date, datetime
+from functools import partial
+from pathlib import Path
+from typing import Any, NamedTuple, TypeVar
+from urllib.parse import urlsplit
+
+import anyio
+from ndgr_client import NDGRClient
+from rich import print
+from rich.rule import Rule
+from rich.style import Style
+
+from jkcommentcrawler.auth import NiconicoAuthManager, is_auth_error
+from jkcommentcrawler.checkpoint import IncrementalCheckpoint
+from jkcommentcrawler.comment_batch import CommentBatch
+from jkcommentcrawler.comment_cache import CommentCache
+from jkcommentcrawler.http_pool import HTTPConnectionPool
+from jkcommentcrawler.manifest import KakologManifest
+from jkcommentcrawler.metrics import RunMetrics
+from jkcommentcrawler.nicojk import NicojkIndex, append_xml_content, truncate_xml_content
+from jkcommentcrawler.nx_client import NXClient
+from jkcommentcrawler.retry import RetryPolicy, retry_async
+from jkcommentcrawler.serializer import CommentSerializer, SerializedLog
+from jkcommentcrawler.source_cache import SourceCache
+from jkcommentcrawler.utils import get_temp_path, remove_temp_files, replace_file, write_file_atomically
+
+
+T = TypeVar('T')
+
+
+class CrawlPlan(NamedTuple):
+    """1つの実況チャンネル・1日分のコメントの収集で、コメントをダウンロードする取得元"""
+
+    jikkyo_channel_id: str  # 実況チャンネル ID
+    target_date: date  # コメントを収集する日付
+    nicolive_program_ids: list[str]  # 指定された日付に一部でも放送されたニコニコ生放送番組の ID のリスト
+    nx_thread_ids: list[int]  # 指定された日付に一部でも放送された NX-Jikkyo スレッドの ID のリスト
+
+    def getSources(self) -> list[str]:
+        """
+        コメントをダウンロードする取得元の名前のリストを返す
+
+        Returns:
+            list[str]: 取得元の名前 (nicolive:{番組 ID} または nx-jikkyo:{スレッド ID}) のリスト
+        """
+
+        return [f'nicolive:{program_id}' for program_id in self.nicolive_program_ids] + [
+            f'nx-jikkyo:{thread_id}' for thread_id in self.nx_thread_ids
+        ]
+
+
+class Crawler:
+    """
+    ニコニコ実況・NX-Jikkyo の過去ログを実況チャンネルごとに収集し、日付ごとの .nicojk ファイルに保存するクローラー
+    複数の実況チャンネルを同時に収集できるよう、同時に処理する実況チャンネル数とホストごとの同時リクエスト数を制限しながら動作する
+    """
+
+    # tail で受信したコメントをまとめて過去ログに追記する間隔 (秒) と、まとめるコメント数の上限
+    ## 追記のたびに fsync するため、コメントを受信するたびに追記せず、ある程度まとめてから追記する
+    TAIL_APPEND_INTERVAL = 10.0
+    TAIL_APPEND_MAX_COMMENTS = 1000
+
+    def __init__(
+        self,
+        kakolog_dir: anyio.Path,
+        cache_dir: anyio.Path,
+        niconico_mail: str,
+        niconico_password: str,
+        force: bool = False,
+        verbose: bool = False,
+        concurrency: int = 1,
+        incremental: bool = False,
+        nicolive_limit: int = 2,
+        nx_jikkyo_limit: int = 4,
+        comment_cache_max_size: int = 1024 * 1024 * 1024,
+        retry_policy: RetryPolicy | None = None,
+        workers: int = 0,
+    ) -> None:
+        """
+        Crawler のコンストラクタ
+
+        Args:
+            kakolog_dir (anyio.Path): 過去ログを保存するフォルダのパス
+            cache_dir (anyio.Path): スレッドインデックスなどのキャッシュを保存するフォルダのパス
+            niconico_mail (str): ニコニコにログインするメールアドレス
+            niconico_password (str): ニコニコにログインするパスワード
+            force (bool, default=False): 以前取得したログの方が文字数が多い場合でも上書きするかどうか
+            verbose (bool, default=False): 詳細な動作ログを出力するかどうか
+            concurrency (int, default=1): 同時にコメントを収集する実況チャンネル・日付の数 (1 なら従来通り順番に収集する)
+            incremental (bool, default=False): 前回保存したコメントからの差分だけを既存の .nicojk ファイルに追記するかどうか
+            nicolive_limit (int, default=2): ニコニコ生放送への同時リクエスト数の上限
+            nx_jikkyo_limit (int, default=4): NX-Jikkyo への同時リクエスト数の上限
+            comment_cache_max_size (int, default=1GiB): 放送が終了した NX-Jikkyo スレッドのコメントキャッシュの合計サイズの上限 (バイト)
+            retry_policy (RetryPolicy | None, default=None): 番組・スレッドの検索やダウンロードなど、個々のリクエストのリトライの設定
+            workers (int, default=0): コメントの変換・マージ・XML への変換を行うワーカープロセスの数 (0 ならイベントループで順番に行う)
+        """
+
+        if concurrency < 1 or nicolive_limit < 1 or nx_jikkyo_limit < 1:
+            raise ValueError('concurrency, nicolive_limit and nx_jikkyo_limit must be 1 or greater.')
+
+        self.kakolog_dir = kakolog_dir
+        self.cache_dir = cache_dir
+        self.niconico_mail = niconico_mail
+        self.niconico_password = niconico_password
+        self.force = force
+        self.verbose = verbose
+        self.concurrency = concurrency
+        self.incremental = incremental
+
+        # 同時に処理する実況チャンネル数を制限するセマフォ
+        self._channel_semaphore = asyncio.Semaphore(concurrency)
+
+        # ニコニコ生放送への同時リクエスト数を制限するセマフォ
+        ## 並列実行時にニコニコ生放送のサーバーへ過剰な負荷を掛けないようにするために使用する
+        ## NDGRClient は内部で独自に HTTP クライアントを持つため、NDGRClient の呼び出し単位で制限する
+        self._nicolive_semaphore = asyncio.Semaphore(nicolive_limit)
+
+        # クロール実行全体で共有する NX-Jikkyo 向けの HTTP コネクションプール
+        ## 全実況チャンネル・全スレッドで keep-alive 接続を再利用し、同時リクエスト数もここで制限する
+        self.http_pool = HTTPConnectionPool(
+            user_agent=NXClient.USER_AGENT,
+            host_limits={urlsplit(NXClient.API_BASE_URL).hostname or '': nx_jikkyo_limit},
+        )
+
+        # 保存した .nicojk ファイルの文字数・コメント数などを記録するマニフェスト
+        self.manifest = KakologManifest(cache_dir / 'manifests', kakolog_dir)
+
+        # 放送が終了した NX-Jikkyo スレッドの変換済みコメントを保存するキャッシュ
+        self.comment_cache = CommentCache(cache_dir / 'comments', max_size=comment_cache_max_size)
+
+        # 日付をまたいで放送された取得元のコメントを、複数の日付の収集で共有するキャッシュ
+        self.source_cache = SourceCache()
+
+        # 段階ごとの所要時間・バイト数・コメント数とリトライ回数を記録するメトリクス
+        self.metrics = RunMetrics()
+
+        # 個々のリクエストのリトライの設定
+        ## 実況チャンネル全体をやり直すのではなく、失敗したリクエストだけを指数バックオフ + ジッターで待機してからリトライする
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+
+        # コメントの変換・マージ・XML への変換を行うプロセスプール
+        ## 巨大な実況チャンネルのコメントを変換している間も、イベントループで他の実況チャンネルの通信を進められるようにする
+        self.serializer = CommentSerializer(workers)
+
+        # 実況チャンネル・日付ごとに取得したニコニコ生放送番組 ID のリスト
+        ## 実況チャンネルの処理をやり直す際に、取得済みの日付の番組一覧を取得し直さないようにする
+        self._nicolive_program_ids: dict[tuple[str, date], list[str]] = {}
+
+        # 今回の実行で実際に内容が変わった .nicojk ファイル (とその索引ファイル) のパス
+        ## dataset_structure.json の差分更新や、Git で変更されたファイルだけをステージングするために使う
+        self.changed_files: set[anyio.Path] = set()
+
+        # 今回ダウンロードした NX-Jikkyo スレッドのステータス
+        self._nx_thread_statuses: dict[int, str | None] = {}
+
+        # ニコニコ生放送番組がなく、ACTIVE な NX-Jikkyo スレッドのコメントだけで過去ログが構成される実況チャンネルの、そのスレッドの ID
+        ## 常駐モードでは、これらの実況チャンネルは定期的な差分収集の代わりに tailThread() で新しいコメントを受信し続けられる
+        self.active_nx_threads: dict[str, int] = {}
+
+        # 実況チャンネル・日付ごとの過去ログへの書き込みを直列化するためのロック
+        ## 常駐モードで tailThread() がコメントを追記している過去ログを、1日ごとの収集が同時に上書きしないようにする
+        ## 常駐モードでは日付が変わるたびにロックが増えるため、取得・待機しているタスクがなくなったロックは自動的に破棄する
+        self._log_locks: weakref.WeakValueDictionary[tuple[str, date], asyncio.Lock] = weakref.WeakValueDictionary()
+
+        # ニコニコアカウントのログイン状態
+        ## Cookie の検証は実行ごとに1回だけ行い、全ての NDGRClient で同じ Cookie を使い回す
+        self.auth = NiconicoAuthManager(
+            niconico_mail,
+            niconico_password,
+            anyio.Path(__file__).parent.parent / 'cookies.json',
+        )
+
+    async def __aenter__(self) -> Crawler:
+        """
+        非同期コンテキストマネージャーのエントリポイント。
+        Crawler インスタンス自身を返す。
+
+        Returns:
+            Crawler: Crawler インスタンス自身
+        """
+
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: Any,
+    ) -> None:
+        """
+        非同期コンテキストマネージャーの終了処理。
+        共有している HTTP コネクションプールのリソースを解放する。
+        """
+
+        await self.close()
+
+    def startRun(self, force: bool, incremental: bool) -> None:
+        """
+        常駐モードで同じ Crawler を使い回して繰り返し収集する際に、1回分の収集の状態を初期化する
+        HTTP コネクションプールの接続・ログイン状態・スレッドインデックスなどは次の収集でも使い回し、
+        メトリクス・内容が変わったファイル・番組一覧などの収集ごとの状態だけを初期化する
+
+        Args:
+            force (bool): 以前取得したログの方が文字数が多い場合でも上書きするかどうか
+            incremental (bool): 前回保存したコメントからの差分だけを既存の .nicojk ファイルに追記するかどうか
+        """
+
+        self.force = force
+        self.incremental = incremental
+        self.metrics = RunMetrics()
+        self.changed_files = set()
+
+        # ニコニコ生放送番組の一覧は放送予定の変更で変わりうるため、収集ごとに取得し直す
+        self._nicolive_program_ids.clear()
+        self._nx_thread_statuses.clear()
+        self.active_nx_threads = {}
+
+        # メトリクスに出力する HTTP コネクションプールとログインの統計も、収集ごとの値にする
+        self.http_pool.new_connections = 0
+        self.http_pool.reused_connections = 0
+        self.http_pool.request_count = 0
+        self.http_pool.received_bytes = 0
+        self.auth.login_count = 0
+
+    async def crawlChannels(self, jikkyo_channel_ids: list[str], target_date: date) -> dict[str, int]:
+        """
+        指定された実況チャンネルのコメントを、同時実行数の上限を守りながら収集・保存する
+
+        Args:
+            jikkyo_channel_ids (list[str]): コメントを収集する実況チャンネル ID のリスト
+            target_date (date): コメントを収集する日付
+
+        Returns:
+            dict[str, int]: 実況チャンネル ID ごとの最終的なコメント数 (引数で渡された実況チャンネルの順序を保つ)
+        """
+
+        return (await self.crawlDates(jikkyo_channel_ids, [target_date]))[target_date]
+
+    async def crawlDates(self, jikkyo_channel_ids: list[str], target_dates: list[date]) -> dict[date, dict[str, int]]:
+        """
+        指定された実況チャンネル・日付のコメントを、同時実行数の上限を守りながら収集・保存する
+        実況チャンネルごとに、全ての日付のニコニコ生放送番組・NX-Jikkyo スレッドを先にまとめて取得してから、日付ごとの収集を行う
+        日付をまたいで放送された番組・スレッドのコメントは1回だけダウンロードし、それを使う全ての日付の収集で共有する
+
+        Args:
+            jikkyo_channel_ids (list[str]): コメントを収集する実況チャンネル ID のリスト
+            target_dates (list[date]): コメントを収集する日付のリスト
+
+        Returns:
+            dict[date, dict[str, int]]: 日付ごとの、実況チャンネル ID ごとの最終的なコメント数
+                (引数で渡された日付・実況チャンネルの順序を保つ)
+        """
+
+        target_dates = sorted(set(target_dates))
+
+        async def plan(jikkyo_channel_id: str) -> list[CrawlPlan] | None:
+            async with self._channel_semaphore:
+                return await self._retry(jikkyo_channel_id, lambda: self._planChannel(jikkyo_channel_id, target_dates))
+
+        # 番組・スレッドを取得できなかった実況チャンネルはスキップする
+        channel_plans = await asyncio.gather(*[plan(jikkyo_channel_id) for jikkyo_channel_id in jikkyo_channel_ids])
+        plans = [day_plan for day_plans in channel_plans if day_plans is not None for day_plan in day_plans]
+
+        # 日付が早い順に、同じ日付の中では引数で渡された実況チャンネルの順に収集する
+        ## 日付をまたいで放送された取得元のコメントが早めに不要になり、メモリから解放されるようにするため
+        plans.sort(key=lambda day_plan: day_plan.target_date)
+
+        # 取得元ごとに、その取得元を使う日付の数だけ参照を登録する
+        for day_plan in plans:
+            for source in day_plan.getSources():
+                self.source_cache.retain(source)
+
+        async def crawl(day_plan: CrawlPlan) -> int | None:
+            async with self._channel_semaphore:
+                try:
+                    return await self.crawlChannel(day_plan)
+                finally:
+                    for source in day_plan.getSources():
+                        self.source_cache.release(source)
+
+        results = await asyncio.gather(*[crawl(day_plan) for day_plan in plans])
+
+        # リトライしても取得できなかった実況チャンネル・日付は結果に含めない
+        comment_counts: dict[date, dict[str, int]] = {target_date: {} for target_date in target_dates}
+        for day_plan, count in zip(plans, results, strict=True):
+            if count is not None:
+                comment_counts[day_plan.target_date][day_plan.jikkyo_channel_id] = count
+        return comment_counts
+
+    async def crawlChannel(self, plan: CrawlPlan) -> int | None:
+        """
+        指定された実況チャンネル・日付のコメントを収集・保存する
+        個々のリクエストのリトライでも取得できなかった場合は1回だけやり直し、それでも失敗した場合はスキップする
+
+        Args:
+            plan (CrawlPlan): コメントを収集する実況チャンネル・日付と、コメントをダウンロードする取得元
+
+        Returns:
+            int | None: 指定された日付の最終的なコメント数 (リトライしても取得できなかった場合は None)
+        """
+
+        with self.metrics.measure('crawl', channel=plan.jikkyo_channel_id, date=plan.target_date) as event:
+            async with self._getLogLock(plan.jikkyo_channel_id, plan.target_date):
+                count = await self._retry(plan.jikkyo_channel_id, lambda: self._crawlChannel(plan))
+            if count is None:
+                event['status'] = 'failed'
+            else:
+                event['comments'] = count
+                print(Rule(characters='=', style=Style(color='#E33157')))
+        return count
+
+    async def _retry(self, jikkyo_channel_id: str, func: Callable[[], Awaitable[T]]) -> T | None:
+        """
+        実況チャンネルの処理を実行し、失敗した場合は1回だけやり直す
+        個々のリクエストはそれぞれリトライ済みのため、ここでは失敗した取得元から処理を再開するためにやり直す
+        (ダウンロード済みの取得元のコメントや、取得済みの番組一覧は使い回す)
+        作成直後のスレッドで一時的に 403 / 404 が返されることもあるため、4xx で失敗した場合も含めて必ず1回はやり直す
+        やり直しても失敗した場合は None を返す
+
+        Args:
+            jikkyo_channel_id (str): 処理する実況チャンネル ID
+            func (Callable[[], Awaitable[T]]): 実行する処理
+
+        Returns:
+            T | None: 処理の結果 (やり直しても失敗した場合は None)
+        """
+
+        policy = RetryPolicy(
+            max_retries=1, base_delay=self.retry_policy.base_delay * 3, max_delay=self.retry_policy.max_delay
+        )
+
+        def on_retry(retry_count: int, exception: Exception, delay: float) -> None:
+            self.metrics.increment('retries', channel=jikkyo_channel_id)
+            print(
+                f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}]\\[{jikkyo_channel_id}] '
+                f'Unexpected error occurred. Retrying ({retry_count}/{policy.max_retries}) after {delay:.1f} seconds ...'
+            )
+            print(traceback.format_exc())
+            print(Rule(characters='=', style=Style(color='#E33157')))
+
+        try:
+            return await retry_async(func, policy, on_retry, should_retry=lambda exception: True)
+        except Exception:
+            # リトライ失敗、このチャンネルはスキップして次の実況チャンネルへ
+            self.metrics.increment('failures', channel=jikkyo_channel_id)
+            print(
+                f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}]\\[{jikkyo_channel_id}] '
+                f'Unexpected error occurred. Retrying failed. Skipping ...'
+            )
+            print(traceback.format_exc())
+            print(Rule(characters='=', style=Style(color='#E33157')))
+            return None
+
+    async def _retryRequest(self, jikkyo_channel_id: str, description: str, func: Callable[[], Awaitable[T]]) -> T:
+        """
+        番組・スレッドの検索やダウンロードなど、個々のリクエストを実行し、失敗した場合はリトライの設定に従ってリトライする
+
+        Args:
+            jikkyo_channel_id (str): 処理する実況チャンネル ID
+            description (str): ログに表示するリクエストの説明 (ex: download NX-Jikkyo thread 1234)
+            func (Callable[[], Awaitable[T]]): 実行するリクエスト (リトライごとに呼び出し直す)
+
+        Returns:
+            T: リクエストの結果
+
+        Raises:
+            Exception: リトライしても失敗した場合や、リトライしても結果が変わらない例外の場合
+        """
+
+        def on_retry(retry_count: int, exception: Exception, delay: float) -> None:
+            self.metrics.increment('request_retries', channel=jikkyo_channel_id)
+            print(
+                f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}]\\[{jikkyo_channel_id}] '
+                f'Failed to {description} ({exception!r}). '
+                f'Retrying ({retry_count}/{self.retry_policy.max_retries}) after {delay:.1f} seconds ...'
+            )
+
+        return await retry_async(func, self.retry_policy, on_retry)
+
+    async def _planChannel(self, jikkyo_channel_id: str, target_dates: list[date]) -> list[CrawlPlan]:
+        """
+        指定された実況チャンネルで、各日付に一部でも放送されたニコニコ生放送番組・NX-Jikkyo スレッドを取得する
+        NX-Jikkyo のスレッド一覧は、日付の数によらず最大1回しか取得しない
+
+        Args:
+            jikkyo_channel_id (str): コメントを収集する実況チャンネル ID
+            target_dates (list[date]): コメントを収集する日付のリスト
+
+        Returns:
+            list[CrawlPlan]: 日付ごとの、コメントをダウンロードする取得元
+        """
+
+        # 指定された日付に一部でも放送されたニコニコ生放送番組を取得
+        ## NX-Jikkyo にはあるが本家ニコニコ実況に存在しない実況チャンネル (ex: jk141) では実行しない
+        ## NDGRClient には日付ごとに番組を取得する API しかないため、日付ごとに取得する
+        ## 実況チャンネルの処理をやり直す場合は、前回取得できた日付の番組一覧を使い回す
+        async def get_program_ids(target_date: date) -> list[str]:
+            async with self._nicolive_semaphore:
+                with self.metrics.measure('program_lookup', channel=jikkyo_channel_id, date=target_date):
+                    return await NDGRClient.getProgramIDsOnDate(jikkyo_channel_id, target_date)
+
+        nicolive_program_ids: dict[date, list[str]] = {target_date: [] for target_date in target_dates}
+        if jikkyo_channel_id in NDGRClient.JIKKYO_CHANNEL_ID_MAP:
+            for target_date in target_dates:
+                key = (jikkyo_channel_id, target_date)
+                if key not in self._nicolive_program_ids:
+                    self._nicolive_program_ids[key] = await self._retryRequest(
+                        jikkyo_channel_id,
+                        f'retrieve Nicolive programs on {target_date.strftime("%Y/%m/%d")}',
+                        lambda: get_program_ids(target_date),
+                    )
+                nicolive_program_ids[target_date] = self._nicolive_program_ids[key]
+
+        # 指定された日付に一部でも放送された NX-Jikkyo スレッドを取得
+        ## 毎回全スレッドの一覧を取得しなくて済むよう、スレッドインデックスをキャッシュフォルダに保存する
+        async def get_thread_ids() -> dict[date, list[int]]:
+            with self.metrics.measure('thread_lookup', channel=jikkyo_channel_id):
+                return await NXClient.getThreadIDsOnDates(
+                    jikkyo_channel_id,
+                    target_dates,
+                    http_pool=self.http_pool,
+                    thread_index_dir=self.cache_dir / 'thread_index',
+                )
+
+        nx_thread_ids = await self._retryRequest(jikkyo_channel_id, 'retrieve NX-Jikkyo threads', get_thread_ids)
+
+        return [
+            CrawlPlan(jikkyo_channel_id, target_date, nicolive_program_ids[target_date], nx_thread_ids[target_date])
+            for target_date in target_dates
+        ]
+
+    async def _crawlChannel(self, plan: CrawlPlan) -> int:
+        """
+        指定された実況チャンネル・日付のコメントを1回だけ収集・保存する (リトライは呼び出し元で行う)
+        他の日付の収集ですでにダウンロードした取得元のコメントは、ダウンロードし直さずに使い回す
+
+        Args:
+            plan (CrawlPlan): コメントを収集する実況チャンネル・日付と、コメントをダウンロードする取得元
+
+        Returns:
+            int: 指定された日付の最終的なコメント数
+        """
+
+        jikkyo_channel_id, target_date, nicolive_program_ids, nx_thread_ids = plan
+
+        print(
+            f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}]\\[{jikkyo_channel_id}] '
+            f'Retrieve comments broadcast during {target_date.strftime("%Y/%m/%d")}.'
+        )
+        if jikkyo_channel_id not in NDGRClient.JIKKYO_CHANNEL_ID_MAP:
+            print(
+                f'Skipping retrieval of Nicolive comments as the channel {jikkyo_channel_id} does not exist on Nicolive.'
+            )
+        else:
+            print(
+                f'Retrieving Nicolive comments from {len(nicolive_program_ids)} programs.'
+                + (f' ({", ".join(nicolive_program_ids)})' if len(nicolive_program_ids) > 0 else '')
+            )
+        print(
+            f'Retrieving NX-Jikkyo comments from {len(nx_thread_ids)} threads.'
+            + (f' ({", ".join(map(str, nx_thread_ids))})' if len(nx_thread_ids) > 0 else '')
+        )
+        print(Rule(characters='-', style=Style(color='#E33157')))
+
+        async def download_nicolive_comments(nicolive_program_id: str) -> list[Any]:
+            # NDGRClient を初期化
+            async with NDGRClient(nicolive_program_id, verbose=self.verbose, console_output=True) as ndgr_client:
+                async with self._nicolive_semaphore:
+                    # ニコニコアカウントにログイン (タイムシフト再生に必要)
+                    ## 2回目以降は、実行の最初に検証した Cookie を設定するだけ
+                    generation = await self.auth.login(ndgr_client)
+
+                    # コメントをダウンロード
+                    with self.metrics.measure(
+                        'nicolive_download', channel=jikkyo_channel_id, source=f'nicolive:{nicolive_program_id}'
+                    ) as event:
+                        try:
+                            comments = list(await ndgr_client.downloadBackwardComments())
+                        except Exception as ex:
+                            # ログインセッションが切れていた場合のみ、再ログインしてからダウンロードし直す
+                            if is_auth_error(ex) is False:
+                                raise
+                            await self.auth.refresh(ndgr_client, generation)
+                            comments = list(await ndgr_client.downloadBackwardComments())
+                        event['comments'] = len(comments)
+                    return comments
+
+        async def download_nx_comments(nx_thread_id: int) -> CommentBatch:
+            # NXClient を初期化
+            ## 共有の HTTP コネクションプールを渡し、スレッドごとに新しい接続を確立しないようにする
+            async with NXClient(
+                nx_thread_id,
+                verbose=self.verbose,
+                console_output=True,
+                http_pool=self.http_pool,
+                comment_cache=self.comment_cache,
+            ) as nx_client:
+                # コメントをダウンロード
+                with self.metrics.measure(
+                    'nx_download', channel=jikkyo_channel_id, source=f'nx-jikkyo:{nx_thread_id}'
+                ) as event:
+                    batch = await nx_client.downloadBackwardCommentBatch()
+                    event['bytes'] = nx_client.received_bytes
+                    event['comments'] = len(batch)
+                    event['cached'] = nx_client.loaded_from_cache
+                self._nx_thread_statuses[nx_thread_id] = nx_client.thread_status
+                return batch
+
+        # ダウンロードしたコメントを取得元 (ニコニコ生放送番組・NX-Jikkyo スレッド) ごとに格納する辞書
+        ## ニコニコ生放送のコメントは、差分モードで新しいコメントだけを変換できるよう、変換前の状態で保持する
+        nicolive_sources: dict[str, list[Any]] = {}
+        ## NX-Jikkyo のコメントは、XMLCompatibleComment をコメントごとに作らずに済むよう、列ごとの CommentBatch で保持する
+        nx_sources: dict[str, CommentBatch] = {}
+
+        # ニコニコ生放送番組 ID ごとに
+        ## 日付をまたいで放送された番組は、前日か翌日の収集ですでにダウンロードしたコメントを使う
+        ## ダウンロードに失敗した場合は、その番組のダウンロードだけをリトライする
+        ## 実況チャンネルの処理をやり直す場合も、ダウンロード済みの番組のコメントはキャッシュに残っているため使い回す
+        for nicolive_program_id in nicolive_program_ids:
+            source = f'nicolive:{nicolive_program_id}'
+            nicolive_sources[source] = await self.source_cache.get(
+                source,
+                lambda: self._retryRequest(
+                    jikkyo_channel_id,
+                    f'download Nicolive program {nicolive_program_id}',
+                    lambda: download_nicolive_comments(nicolive_program_id),
+                ),
+            )
+
+        # NX-Jikkyo スレッドごとに
+        ## 日付をまたいで放送されたスレッド (通常毎日 04:00 ~ 翌日 04:00) は、前日か翌日の収集ですでにダウンロードしたコメントを使う
+        for nx_thread_id in nx_thread_ids:
+            source = f'nx-jikkyo:{nx_thread_id}'
+            nx_sources[source] = await self.source_cache.get(
+                source,
+                lambda: self._retryRequest(
+                    jikkyo_channel_id,
+                    f'download NX-Jikkyo thread {nx_thread_id}',
+                    lambda: download_nx_comments(nx_thread_id),
+                ),
+            )
+
+        # ニコニコ生放送番組がない実況チャンネルで ACTIVE なスレッドがあれば、WebSocket で新しいコメントを受信し続けられる
+        ## ニコニコ生放送番組のコメントはコメントサーバーから受信できないため、番組がある実況チャンネルは対象外
+        if len(nicolive_program_ids) == 0:
+            for nx_thread_id in nx_thread_ids:
+                if self._nx_thread_statuses.get(nx_thread_id) == 'ACTIVE':
+                    self.active_nx_threads[jikkyo_channel_id] = nx_thread_id
+
+        # 取得元ごとのコメント番号のリスト (差分モードのチェックポイントとの突き合わせに使う)
+        source_comment_nos: dict[str, list[int]] = {
+            source: [comment.no for comment in source_comments] for source, source_comments in nicolive_sources.items()
+        }
+        source_comment_nos.update({source: list(batch.no) for source, batch in nx_sources.items()})
+
+        output_file = self.manifest.getLogPath(jikkyo_channel_id, target_date)
+        checkpoint_path = IncrementalCheckpoint.getCheckpointPath(
+            self.cache_dir / 'checkpoints', jikkyo_channel_id, target_date
+        )
+
+        # 差分モードでは、前回保存したコメントからの差分だけを既存の .nicojk ファイルに追記できないか試みる
+        ## 追記できない (ニコニコ生放送でコメントが削除された、など) 場合は、通常通りファイル全体を作り直す
+        if self.incremental is True:
+            appended_count = await self._appendNewComments(
+                jikkyo_channel_id,
+                target_date,
+                output_file,
+                checkpoint_path,
+                nicolive_sources,
+                nx_sources,
+                source_comment_nos,
+            )
+            if appended_count is not None:
+                return appended_count
+
+        # ダウンロードしたコメントを取得元ごとに変換し、指定された日付以外に投稿されたコメントを除外しつつ、コメント投稿日時昇順でマージする
+        ## ニコニコ実況と NX-Jikkyo のコメントを時系列でマージするためにこの処理が必要
+        ## 取得元ごとのコメントはすでに投稿日時昇順のため、全体をソートし直さずに k-way マージする
+        ## マージしたコメントは、少しずつ XML 文字列に変換しながら、過去ログフォルダの外の一時ファイルに書き込む
+        ## (--workers が指定された場合はワーカープロセスで行う)
+        sources: dict[str, list[Any] | CommentBatch] = {**nicolive_sources, **nx_sources}
+        print(f'Total comments for {jikkyo_channel_id}: {sum(len(comments) for comments in sources.values())}')
+        await self._removeTempFiles(output_file)
+        serialized = await self._serializeComments(
+            jikkyo_channel_id, target_date, sources, self._getStagingPath(output_file)
+        )
+        print(f'Excluding comments posted on dates other than {target_date.strftime("%Y/%m/%d")} ...')
+        print(f'Final comments for {jikkyo_channel_id}: {serialized.comment_count}')
+
+        # {kakolog_dir}/{jikkyo_channel_id}/{date.year}/{date.strftime('%Y%m%d')}.nicojk に保存
+        ## 取得できたコメントが1つもない場合は実行しない
+        ## 置き換えた後にチェックポイントを記録する前に強制終了すると、置き換え前のファイルのチェックポイントが残ってしまうため、
+        ## 置き換える前に削除しておく (残っていると、次回の追記で置き換えたファイルをチェックポイントのサイズまで切り詰めてしまう)
+        await checkpoint_path.unlink(missing_ok=True)
+        saved = False
+        if serialized.comment_count > 0:
+            saved = await self._saveComments(jikkyo_channel_id, target_date, serialized)
+
+        # コメントが1件も取得できていない場合はスキップ
+        else:
+            print(f'No comments found for {jikkyo_channel_id} on {target_date.strftime("%Y/%m/%d")}. Skipping ...')
+
+        # 保存した .nicojk ファイルの内容に対応するチェックポイントを記録する
+        ## 保存しなかった場合は、既存のファイルの内容とチェックポイントが対応しなくなるため記録しない
+        if saved is True:
+            await IncrementalCheckpoint(
+                checkpoint_path,
+                file_size=(await output_file.stat()).st_size,
+                comment_count=serialized.comment_count,
+                last_date_with_usec=serialized.last_date_with_usec or 0.0,
+                sources=IncrementalCheckpoint.summarizeSources(source_comment_nos),
+            ).save()
+
+        return serialized.comment_count
+
+    async def _serializeComments(
+        self,
+        jikkyo_channel_id: str,
+        target_date: date,
+        sources: dict[str, list[Any] | CommentBatch],
+        temp_path: anyio.Path | None = None,
+    ) -> SerializedLog:
+        """
+        取得元ごとのコメントを変換・マージして XML 文字列に変換し、マージ・XML への変換の所要時間をメトリクスに記録する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): コメントを収集する日付
+            sources (dict[str, list[Any] | CommentBatch]): 取得元ごとのコメント
+                (ニコニコ生放送のコメントは変換前のリスト、NX-Jikkyo のコメントは CommentBatch)
+            temp_path (anyio.Path | None, default=None): XML 文字列を書き込む一時ファイルのパス (None ならバイト列として返す)
+
+        Returns:
+            SerializedLog: マージ・変換した結果
+        """
+
+        serialized = await self.serializer.serialize(
+            sources,
+            target_date,
+            NDGRClient.convertToXMLCompatibleComment,
+            str(temp_path) if temp_path is not None else None,
+        )
+        self.metrics.record(
+            'merge',
+            serialized.merge_duration,
+            comment_count=serialized.comment_count,
+            channel=jikkyo_channel_id,
+            date=target_date,
+        )
+        self.metrics.record(
+            'serialize',
+            serialized.serialize_duration,
+            byte_count=serialized.size,
+            comment_count=serialized.comment_count,
+            channel=jikkyo_channel_id,
+            date=target_date,
+        )
+        return serialized
+
+    async def _appendNewComments(
+        self,
+        jikkyo_channel_id: str,
+        target_date: date,
+        output_file: anyio.Path,
+        checkpoint_path: anyio.Path,
+        nicolive_sources: dict[str, list[Any]],
+        nx_sources: dict[str, CommentBatch],
+        source_comment_nos: dict[str, list[int]],
+    ) -> int | None:
+        """
+        前回保存した時点からの差分のコメントだけを変換し、既存の .nicojk ファイルに追記する
+        チェックポイントがない場合や、チェックポイントと今回取得したコメントが矛盾する場合は何もせずに None を返す
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): コメントを収集する日付
+            output_file (anyio.Path): 追記する .nicojk ファイルのパス
+            checkpoint_path (anyio.Path): チェックポイントファイルのパス
+            nicolive_sources (dict[str, list[Any]]): ニコニコ生放送番組ごとの変換前のコメントのリスト
+            nx_sources (dict[str, CommentBatch]): NX-Jikkyo スレッドごとのコメントの集合
+            source_comment_nos (dict[str, list[int]]): 取得元ごとのコメント番号のリスト
+
+        Returns:
+            int | None: 追記後の .nicojk ファイルに含まれるコメント数 (追記できなかった場合は None)
+        """
+
+        checkpoint = await IncrementalCheckpoint.load(checkpoint_path)
+        if checkpoint is None or not await output_file.exists():
+            return None
+        await self._truncateAppendedLog(output_file, checkpoint)
+
+        # チェックポイントと今回取得したコメントを突き合わせ、追記で済むかを判定する
+        last_nos = checkpoint.getAppendableSources((await output_file.stat()).st_size, source_comment_nos)
+        if last_nos is None:
+            print('Rebuilding the log as the comments retrieved previously have changed.')
+            return None
+
+        # 前回取得した最後のコメントより後に投稿されたコメントだけを変換する
+        new_sources: dict[str, list[Any] | CommentBatch] = {
+            source: [comment for comment in source_comments if comment.no > last_nos[source]]
+            for source, source_comments in nicolive_sources.items()
+        }
+        new_sources.update(
+            {
+                source: batch.take(index for index, comment_no in enumerate(batch.no) if comment_no > last_nos[source])
+                for source, batch in nx_sources.items()
+            }
+        )
+
+        # 指定された日付以外に投稿されたコメントを除外しつつ、コメント投稿日時昇順でマージし、新しいコメントだけを XML 文字列に変換する
+        serialized = await self._serializeComments(jikkyo_channel_id, target_date, new_sources)
+
+        # 新しいコメントが既存のファイルの最後のコメントより前に投稿されている場合は、追記すると時系列順が崩れるため作り直す
+        if (
+            serialized.first_date_with_usec is not None
+            and serialized.first_date_with_usec <= checkpoint.last_date_with_usec
+        ):
+            print('Rebuilding the log as some new comments were posted before the last saved comment.')
+            return None
+
+        comment_count = checkpoint.comment_count + serialized.comment_count
+        print(f'New comments for {jikkyo_channel_id}: {serialized.comment_count}')
+        print(f'Final comments for {jikkyo_channel_id}: {comment_count}')
+
+        # 新しいコメントの XML 文字列を既存のファイルに追記する
+        if serialized.comment_count > 0:
+            await self._appendToLog(jikkyo_channel_id, target_date, output_file, checkpoint, serialized)
+        else:
+            print(f'No new comments for {jikkyo_channel_id} on {target_date.strftime("%Y/%m/%d")}.')
+
+        # 今回取得したコメントの状態をチェックポイントに記録する
+        checkpoint.sources = IncrementalCheckpoint.summarizeSources(source_comment_nos)
+        await checkpoint.save()
+
+        return comment_count
+
+    async def tailThread(self, jikkyo_channel_id: str, nx_thread_id: int) -> bool:
+        """
+        ACTIVE な NX-Jikkyo スレッドのコメントサーバー (WebSocket) に接続し、新しく投稿されたコメントをその都度過去ログに追記する
+        定期的にスレッド全体をダウンロードし直す代わりに、新しく投稿されたコメントの分だけの通信量と処理量で過去ログを最新に保つ
+        過去ログ・マニフェスト・チェックポイントは差分モードで追記した場合と同じ状態に保つため、終了後は差分モードでの収集に戻れる
+        スレッドの放送が終了した場合と、追記では整合性が取れなくなった場合 (日付が変わった、など) に終了する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            nx_thread_id (int): 新しいコメントを受信する ACTIVE な NX-Jikkyo スレッドの ID
+
+        Returns:
+            bool: スレッドの放送が終了したなら True、追記できなくなったなら False
+
+        Raises:
+            Exception: コメントサーバーとの通信が再接続しても失敗した場合
+        """
+
+        source = f'nx-jikkyo:{nx_thread_id}'
+
+        # 当日分の過去ログに追記済みのコメントは、最初の再同期でも受け取らないようにする
+        checkpoint = await IncrementalCheckpoint.load(
+            IncrementalCheckpoint.getCheckpointPath(
+                self.cache_dir / 'checkpoints', jikkyo_channel_id, datetime.now().date()
+            )
+        )
+        last_no, _ = checkpoint.sources.get(source, (0, 0)) if checkpoint is not None else (0, 0)
+
+        print(
+            f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}]\\[{jikkyo_channel_id}] '
+            f'Streaming new comments of NX-Jikkyo thread {nx_thread_id} ...'
+        )
+        async with NXClient(
+            nx_thread_id,
+            verbose=self.verbose,
+            console_output=self.verbose,
+            http_pool=self.http_pool,
+        ) as nx_client:
+            async for batch in nx_client.streamCommentBatches(
+                jikkyo_channel_id,
+                after_no=last_no,
+                batch_interval=self.TAIL_APPEND_INTERVAL,
+                batch_size=self.TAIL_APPEND_MAX_COMMENTS,
+            ):
+                # 追記の途中で中断されると過去ログとチェックポイントが対応しなくなるため、追記は中断されても最後まで行う
+                append_task = asyncio.ensure_future(self._appendStreamedComments(jikkyo_channel_id, source, batch))
+                try:
+                    appended = await asyncio.shield(append_task)
+                except asyncio.CancelledError:
+                    await append_task
+                    raise
+                if appended is False:
+                    print(
+                        f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}]\\[{jikkyo_channel_id}] '
+                        f'Stopped streaming as the new comments cannot be appended to the log.'
+                    )
+                    return False
+        return True
+
+    async def _appendStreamedComments(self, jikkyo_channel_id: str, source: str, batch: CommentBatch) -> bool:
+        """
+        コメントサーバーから受信した新しいコメントを、投稿された日付の過去ログに追記する
+        対象の全ての日付の過去ログに追記できる場合のみ追記し、1つでも追記できない場合は何もせずに False を返す
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            source (str): コメントの取得元の名前 (ex: nx-jikkyo:1234)
+            batch (CommentBatch): 受信した新しいコメントの集合 (投稿日時昇順)
+
+        Returns:
+            bool: 追記できた (追記するコメントがなかった場合を含む) なら True
+        """
+
+        with self.metrics.measure('stream_append', channel=jikkyo_channel_id, source=source) as event:
+            event['comments'] = len(batch)
+            target_dates = sorted({datetime.fromtimestamp(comment_date).date() for comment_date in batch.date})
+            async with contextlib.AsyncExitStack() as stack:
+                # 収集と同時に書き込まないよう、対象の全ての日付の過去ログのロックを日付順に取得する
+                for target_date in target_dates:
+                    await stack.enter_async_context(self._getLogLock(jikkyo_channel_id, target_date))
+                return await self._appendStreamedCommentsLocked(jikkyo_channel_id, source, batch, target_dates)
+
+    async def _appendStreamedCommentsLocked(
+        self, jikkyo_channel_id: str, source: str, batch: CommentBatch, target_dates: list[date]
+    ) -> bool:
+        """
+        _appendStreamedComments() の本体 (対象の全ての日付の過去ログのロックを取得した状態で呼び出す)
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            source (str): コメントの取得元の名前 (ex: nx-jikkyo:1234)
+            batch (CommentBatch): 受信した新しいコメントの集合 (投稿日時昇順)
+            target_dates (list[date]): コメントが投稿された日付のリスト (昇順)
+
+        Returns:
+            bool: 追記できた (追記するコメントがなかった場合を含む) なら True
+        """
+
+        # 追記する前に、コメントが投稿された全ての日付の過去ログに追記できるかを確かめる
+        ## 差分モードと同様に、チェックポイントと過去ログが対応していて、ニコニコ生放送番組のコメントを含まず、
+        ## 新しいコメントが過去ログの最後のコメントより後に投稿されている場合のみ追記できる
+        appends: list[tuple[date, anyio.Path, IncrementalCheckpoint, SerializedLog]] = []
+        for target_date in target_dates:
+            output_file = self.manifest.getLogPath(jikkyo_channel_id, target_date)
+            checkpoint = await IncrementalCheckpoint.load(
+                IncrementalCheckpoint.getCheckpointPath(self.cache_dir / 'checkpoints', jikkyo_channel_id, target_date)
+            )
+            if checkpoint is None or not await output_file.exists():
+                return False
+            await self._truncateAppendedLog(output_file, checkpoint)
+            if (await output_file.stat()).st_size != checkpoint.file_size:
+                return False
+            if any(checkpoint_source.startswith('nicolive:') for checkpoint_source in checkpoint.sources):
+                return False
+            last_no, _ = checkpoint.sources.get(source, (0, 0))
+            new_batch = batch.take(index for index, comment_no in enumerate(batch.no) if comment_no > last_no)
+            serialized = await self._serializeComments(jikkyo_channel_id, target_date, {source: new_batch})
+            if (
+                serialized.first_date_with_usec is not None
+                and serialized.first_date_with_usec <= checkpoint.last_date_with_usec
+            ):
+                return False
+            appends.append((target_date, output_file, checkpoint, serialized))
+
+        # 日付ごとに追記し、チェックポイントの取得元の状態を進める
+        ## 取得元のコメント数は、差分モードと同様に日付によらず取得元の全コメントを数える
+        for target_date, output_file, checkpoint, serialized in appends:
+            last_no, count = checkpoint.sources.get(source, (0, 0))
+            new_nos = [comment_no for comment_no in batch.no if comment_no > last_no]
+            if serialized.comment_count > 0:
+                await self._appendToLog(jikkyo_channel_id, target_date, output_file, checkpoint, serialized)
+            if len(new_nos) > 0:
+                checkpoint.sources[source] = (max(new_nos), count + len(new_nos))
+            await checkpoint.save()
+
+        return True
+
+    async def _appendToLog(
+        self,
+        jikkyo_channel_id: str,
+        target_date: date,
+        output_file: anyio.Path,
+        checkpoint: IncrementalCheckpoint,
+        serialized: SerializedLog,
+    ) -> None:
+        """
+        新しいコメントの XML 文字列を既存の .nicojk ファイルに追記し、マニフェストとチェックポイントに反映する
+        チェックポイントの取得元ごとの状態は呼び出し元で更新し、保存する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): コメントを収集する日付
+            output_file (anyio.Path): 追記する .nicojk ファイルのパス
+            checkpoint (IncrementalCheckpoint): 追記前のファイルに対応するチェックポイント
+            serialized (SerializedLog): 追記するコメントをマージ・変換した結果 (1件以上のコメントを含むこと)
+        """
+
+        # 追記前のファイルの情報をマニフェストから取得する
+        entry = await self.manifest.getEntry(jikkyo_channel_id, target_date)
+        with self.metrics.measure('write', channel=jikkyo_channel_id, date=target_date) as event:
+            previous_file_size = checkpoint.file_size
+            checkpoint.file_size = await append_xml_content(output_file, serialized.xml_bytes)
+            event['bytes'] = checkpoint.file_size - entry.size if entry is not None else 0
+        checkpoint.comment_count += serialized.comment_count
+
+        # 追記した内容だけを索引に反映する (索引が追記前のファイルと対応していない場合は、ファイル全体から作り直す)
+        with self.metrics.measure('index', channel=jikkyo_channel_id, date=target_date) as event:
+            index_path = NicojkIndex.getIndexPath(output_file)
+            index = await NicojkIndex.load(index_path)
+            if index is not None and index.file_size == previous_file_size:
+                async with await output_file.open('rb') as f:
+                    await f.seek(previous_file_size)
+                    index.extend(await f.read(), previous_file_size)
+            else:
+                index = NicojkIndex.build(target_date, await output_file.read_bytes())
+            await index.save(index_path)
+            event['comments'] = serialized.comment_count
+        self.changed_files.add(index_path)
+
+        # 追記した内容をマニフェストに反映する
+        ## 区切りの改行が補われた場合は、その分 (1 バイト = 1 文字) だけ追記したサイズが増える
+        ## ファイル全体のハッシュは追記では求められないため、必要になった時点で再計算する
+        if entry is not None:
+            appended_chars = serialized.chars + (checkpoint.file_size - entry.size - serialized.size)
+            sources = entry.sources.copy()
+            for source, count in serialized.source_counts.items():
+                sources[source] = sources.get(source, 0) + count
+            await self.manifest.updateEntry(
+                jikkyo_channel_id,
+                target_date,
+                chars=entry.chars + appended_chars,
+                comment_count=entry.comment_count + serialized.comment_count,
+                sha256=None,
+                sources=sources,
+            )
+        checkpoint.last_date_with_usec = serialized.last_date_with_usec or checkpoint.last_date_with_usec
+        self.changed_files.add(output_file)
+        print(f'{serialized.comment_count} comments appended to {output_file}.')
+
+    async def _saveComments(
+        self,
+        jikkyo_channel_id: str,
+        target_date: date,
+        serialized: SerializedLog,
+    ) -> bool:
+        """
+        XML 文字列に変換したコメントを {kakolog_dir}/{jikkyo_channel_id}/{date.year}/{date.strftime('%Y%m%d')}.nicojk に保存する
+        既存のファイルの方が文字数が多い場合は、--force が指定されていない限り保存しない
+        既存のファイルの文字数は、ファイルを読み込まずにマニフェストから取得する
+        XML 文字列を書き込んだ一時ファイルは、fsync してからリネームして既存のファイルを置き換え、保存しない場合は削除する
+        書き込み途中で強制終了しても、過去ログフォルダに書き込み途中の .nicojk ファイルが残ることはない
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): コメントを収集した日付
+            serialized (SerializedLog): 保存するコメントをマージ・変換した結果 (取得元ごとのコメント数はマニフェストに記録する)
+
+        Returns:
+            bool: 過去ログが今回のコメントの内容になっているかどうか (保存した場合と、既存のファイルと内容が同一だった場合は True)
+        """
+
+        output_file = self.manifest.getLogPath(jikkyo_channel_id, target_date)
+        temp_path = Path(serialized.temp_path) if serialized.temp_path is not None else None
+        try:
+            # 既存の XML ファイルがあれば、マニフェストから文字数を取得
+            existing_entry = await self.manifest.getEntry(jikkyo_channel_id, target_date)
+            existing_length = existing_entry.chars if existing_entry is not None else 0
+
+            # コメントが1件も取得できていない場合は過去ログを保存しない
+            if serialized.chars == 0:
+                print(f'Skipping log save for {target_date.strftime("%Y/%m/%d")} as there are 0 comments.')
+                return False
+
+            # 既存のファイルの方が文字数が多い場合は過去ログを保存しない
+            elif existing_length > serialized.chars and not self.force:
+                print(
+                    f'Skipping log save as the previously retrieved log has more characters. '
+                    f'(Previous: {existing_length} chars, Current: {serialized.chars} chars)'
+                )
+                return False
+
+            # 過去ログを保存
+            else:
+                # 既存のファイルの方が文字数が多いが、--force が指定されている場合は上書きする
+                if existing_length > serialized.chars and self.force:
+                    print(
+                        f'The previously retrieved log has more characters, but overwriting as --force is specified. '
+                        f'(Previous: {existing_length} chars, Current: {serialized.chars} chars)'
+                    )
+                xml_hash = serialized.sha256
+
+                # 既存のファイルと内容が同一の場合は、ファイルの最終更新日時も含めて変更しないよう書き込まない
+                ## ファイルサイズが一致する場合に限り、マニフェストに記録されたハッシュ (未計算なら再計算する) と比較する
+                if existing_entry is not None and existing_entry.size == serialized.size:
+                    existing_entry = await self.manifest.getEntry(jikkyo_channel_id, target_date, require_hash=True)
+                written = False
+                if existing_entry is not None and existing_entry.sha256 == xml_hash:
+                    print(f'Skipping log save as the log is unchanged. ({output_file})')
+
+                # 一時ファイルを fsync してからリネームし、既存のファイルをアトミックに置き換える
+                ## 電源断などで OS ごと停止しても、置き換え前か置き換え後のどちらかの内容が完全な状態で残る
+                else:
+                    with self.metrics.measure('write', channel=jikkyo_channel_id, date=target_date) as event:
+                        await output_file.parent.mkdir(parents=True, exist_ok=True)
+                        if temp_path is not None:
+                            await anyio.to_thread.run_sync(
+                                partial(replace_file, temp_path, Path(output_file), fsync=True)
+                            )
+                        else:
+                            await write_file_atomically(output_file, serialized.xml_bytes, fsync=True)
+                        event['bytes'] = serialized.size
+                    self.changed_files.add(output_file)
+                    written = True
+                    print(f'Log saved to {output_file}.')
+
+                # 1分ごとのコメントの位置の索引を保存する
+                ## 内容が同一で書き込まなかった場合も、索引がない・ファイルと対応していない場合は作り直す
+                ## 一時ファイルに書き込んだ場合は、書き込みながら作成した索引をそのまま保存する
+                index_path = NicojkIndex.getIndexPath(output_file)
+                if written is True or await NicojkIndex.readFileSize(index_path) != serialized.size:
+                    with self.metrics.measure('index', channel=jikkyo_channel_id, date=target_date) as event:
+                        if serialized.index_bytes is not None:
+                            await write_file_atomically(index_path, serialized.index_bytes)
+                        else:
+                            await NicojkIndex.build(target_date, serialized.xml_bytes).save(index_path)
+                        event['comments'] = serialized.comment_count
+                    self.changed_files.add(index_path)
+
+                # 保存した内容をマニフェストに記録する
+                await self.manifest.updateEntry(
+                    jikkyo_channel_id,
+                    target_date,
+                    chars=serialized.chars,
+                    comment_count=serialized.comment_count,
+                    sha256=xml_hash,
+                    sources=serialized.source_counts,
+                )
+                return True
+        finally:
+            # 保存しなかった場合や、保存に失敗した場合は一時ファイルを削除する (リネームした場合はすでに存在しない)
+            if temp_path is not None:
+                await anyio.Path(temp_path).unlink(missing_ok=True)
+
+    async def _truncateAppendedLog(self, output_file: anyio.Path, checkpoint: IncrementalCheckpoint) -> None:
+        """
+        前回の追記が途中で強制終了していた場合に、.nicojk ファイルをチェックポイントに記録した最後に追記を終えた時点まで切り詰める
+        切り詰めた分のコメントは、チェックポイントの取得元ごとの状態が進んでいないため、次の追記で改めて追記される
+        過去ログのロックを取得した状態で呼び出す
+
+        Args:
+            output_file (anyio.Path): 追記する .nicojk ファイルのパス
+            checkpoint (IncrementalCheckpoint): .nicojk ファイルに対応するチェックポイント
+        """
+
+        if await truncate_xml_content(output_file, checkpoint.file_size) is True:
+            print(f'Truncated the partially appended content of {output_file}.')
+            self.changed_files.add(output_file)
+
+    def _getStagingPath(self, output_file: anyio.Path) -> anyio.Path:
+        """
+        .nicojk ファイルを置き換えるための一時ファイルのパスを返す
+        強制終了した場合に書き込み途中の一時ファイルが過去ログフォルダに残ってコミットされないよう、
+        一時ファイルはキャッシュフォルダ内に、過去ログフォルダと同じフォルダ構造で作成する
+
+        Args:
+            output_file (anyio.Path): 置き換える .nicojk ファイルのパス
+
+        Returns:
+            anyio.Path: 一時ファイルのパス
+        """
+
+        return anyio.Path(get_temp_path(Path(self.cache_dir / 'staging' / output_file.relative_to(self.kakolog_dir))))
+
+    async def _removeTempFiles(self, output_file: anyio.Path) -> None:
+        """
+        前回の実行が書き込み途中で強制終了していた場合に残っている、.nicojk ファイルとその索引ファイルの一時ファイルを削除する
+        過去ログのロックを取得した状態で呼び出す
+
+        Args:
+            output_file (anyio.Path): 書き込む .nicojk ファイルのパス
+        """
+
+        await remove_temp_files(self.cache_dir / 'staging' / output_file.relative_to(self.kakolog_dir))
+        await remove_temp_files(output_file)
+        await remove_temp_files(NicojkIndex.getIndexPath(output_file))
+
+    def _getLogLock(self, jikkyo_channel_id: str, target_date: date) -> asyncio.Lock:
+        return self._log_locks.setdefault((jikkyo_channel_id, target_date), asyncio.Lock())
+
+    async def close(self) -> None:
+        """
+        Crawler が保持する HTTP コネクションプールとプロセスプールのリソースを解放する。
+        このメソッドは冪等であり、複数回呼び出しても安全に動作する。
+        """
+
+        await self.http_pool.close()
+        await self.serializer.close()
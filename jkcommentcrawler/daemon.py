@@ -0,0 +1,340 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+import traceback
+from collections.abc import Awaitable, Callable
+from datetime import date, datetime, time, timedelta
+from typing import NamedTuple
+
+import anyio
+from rich import print
+from rich.rule import Rule
+from rich.style import Style
+
+from jkcommentcrawler.crawler import Crawler
+
+
+class CrawlPass(NamedTuple):
+    """常駐モードで1回に実行する収集の種類と対象"""
+
+    name: str  # 収集の種類 (minutes: 定期的な差分収集 / daily: 前日分を --force で収集し直す1日ごとの収集)
+    target_dates: list[date]  # コメントを収集する日付のリスト
+    force: bool  # 以前取得したログの方が文字数が多い場合でも上書きするかどうか
+    incremental: bool  # 前回保存したコメントからの差分だけを既存のログに追記するかどうか
+
+
+class CrawlerDaemon:
+    """
+    1つのプロセスに常駐し、内部のスケジューラーで繰り返しコメントを収集するクラス
+    Cron から毎回プロセスを起動する場合と異なり、HTTP コネクションプールの接続・ログイン状態・スレッドインデックスなどを
+    収集をまたいで使い回す
+    指定された間隔で当日分のコメントを差分収集し、指定された時刻には前日分のコメントを --force で収集し直す
+    SIGTERM / SIGINT を受け取ったら実行中の収集が終わるのを待って終了し、もう一度受け取ったら実行中の収集を中断して終了する
+    tail を有効にした場合、ACTIVE な NX-Jikkyo スレッドのコメントだけで過去ログが構成される実況チャンネルは、
+    差分収集の代わりにコメントサーバーから新しいコメントを受信し続けて追記する
+    """
+
+    def __init__(
+        self,
+        crawler: Crawler,
+        jikkyo_channel_ids: list[str],
+        poll_interval: float = 300,
+        daily_times: list[time] | None = None,
+        sync_command: str | None = None,
+        on_pass_finished: Callable[[CrawlPass], Awaitable[None]] | None = None,
+        tail: bool = False,
+    ) -> None:
+        """
+        CrawlerDaemon のコンストラクタ
+
+        Args:
+            crawler (Crawler): 収集に使う Crawler (全ての収集で使い回す)
+            jikkyo_channel_ids (list[str]): コメントを収集する実況チャンネル ID のリスト
+            poll_interval (float, default=300): 当日分のコメントを差分収集する間隔 (秒)
+            daily_times (list[time] | None, default=None): 前日分のコメントを --force で収集し直す時刻のリスト
+            sync_command (str | None, default=None): 収集が終わるたびに実行するコマンド (Git への commit & push など)
+            on_pass_finished (Callable[[CrawlPass], Awaitable[None]] | None, default=None): 収集が終わるたびに、
+                同期コマンドの実行前に呼び出される関数 (dataset_structure.json や変更されたファイルの一覧の保存など)
+            tail (bool, default=False): ACTIVE な NX-Jikkyo スレッドの新しいコメントを、コメントサーバーから受信し続けて追記するかどうか
+        """
+
+        if poll_interval <= 0:
+            raise ValueError('poll_interval must be greater than 0.')
+
+        self.crawler = crawler
+        self.jikkyo_channel_ids = jikkyo_channel_ids
+        self.poll_interval = poll_interval
+        self.daily_times = sorted(daily_times if daily_times is not None else [time(0, 1), time(12, 1)])
+        self.sync_command = sync_command
+        self.on_pass_finished = on_pass_finished
+        self.tail = tail
+
+        # 終了が要求されたかどうか
+        self._stopping = asyncio.Event()
+
+        # 実行中の収集のタスク (2回目の SIGTERM / SIGINT で中断するために保持する)
+        self._current_task: asyncio.Task[dict[date, dict[str, int]]] | None = None
+
+        # まだ同期コマンドで同期できていない、内容が変わったファイルのパス
+        ## 同期コマンドが失敗した場合や実行できなかった場合は、次の収集で変更されたファイルと一緒に同期する
+        self._unsynced_files: set[anyio.Path] = set()
+
+        # 実況チャンネル ID ごとの、ACTIVE な NX-Jikkyo スレッドの新しいコメントを受信し続けているタスク
+        ## これらの実況チャンネルは、タスクが終了するまで差分収集の対象から外す
+        self._tail_tasks: dict[str, asyncio.Task[bool]] = {}
+
+    def stop(self) -> None:
+        """
+        常駐を終了する
+        1回目の呼び出しでは実行中の収集が終わるのを待ってから終了し、2回目の呼び出しでは実行中の収集を中断して終了する
+        """
+
+        if self._stopping.is_set():
+            if self._current_task is not None:
+                print(f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}] Interrupting the running pass ...')
+                self._current_task.cancel()
+            return
+        print(
+            f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}] '
+            'Shutting down after the running pass finishes. Send the signal again to interrupt it.'
+        )
+        self._stopping.set()
+
+    def getNextDailyRun(self, now: datetime) -> datetime:
+        """
+        指定された日時より後で、最初に1日ごとの収集を実行する日時を返す
+
+        Args:
+            now (datetime): 基準となる日時
+
+        Returns:
+            datetime: 次に1日ごとの収集を実行する日時
+        """
+
+        for days in range(2):
+            for daily_time in self.daily_times:
+                run_at = datetime.combine(now.date() + timedelta(days=days), daily_time)
+                if run_at > now:
+                    return run_at
+        # 1日ごとの収集を実行する時刻が指定されていない場合は実行しない
+        return datetime.max
+
+    async def run(self) -> None:
+        """
+        SIGTERM / SIGINT を受け取るまで、スケジュールに従って繰り返しコメントを収集する
+        """
+
+        loop = asyncio.get_running_loop()
+        for signal_number in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(signal_number, self.stop)
+            except NotImplementedError:
+                # Windows ではシグナルハンドラーを登録できないため、Ctrl+C で即座に終了する
+                pass
+
+        try:
+            now = datetime.now()
+            next_minutes_run = now
+            next_daily_run = self.getNextDailyRun(now)
+            while self._stopping.is_set() is False:
+                now = datetime.now()
+
+                # 1日ごとの収集の時刻になったら、前日分のコメントを --force で収集し直す
+                ## ニコ生の実況番組の放送終了後にスパム判定されたコメントがごっそり削除されることがあるため、
+                ## 以前取得したログより文字数が少なくても強制的に保存する
+                if now >= next_daily_run:
+                    crawl_pass = CrawlPass(
+                        name='daily',
+                        target_dates=[next_daily_run.date() - timedelta(days=1)],
+                        force=True,
+                        incremental=False,
+                    )
+                    next_daily_run = self.getNextDailyRun(now)
+
+                # 差分収集の時刻になったら、当日分のコメントのうち前回から増えたコメントだけを追記する
+                elif now >= next_minutes_run:
+                    crawl_pass = CrawlPass(name='minutes', target_dates=[now.date()], force=False, incremental=True)
+                    next_minutes_run = now + timedelta(seconds=self.poll_interval)
+
+                # どちらの時刻でもなければ、次の収集の時刻か終了が要求されるまで待つ
+                else:
+                    timeout = (min(next_minutes_run, next_daily_run) - now).total_seconds()
+                    try:
+                        await asyncio.wait_for(self._stopping.wait(), timeout=timeout)
+                    except TimeoutError:
+                        pass
+                    continue
+
+                await self._runPass(crawl_pass)
+        finally:
+            await self._stopTails()
+            for signal_number in (signal.SIGTERM, signal.SIGINT):
+                try:
+                    loop.remove_signal_handler(signal_number)
+                except NotImplementedError:
+                    pass
+
+        print(f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}] Daemon stopped.')
+        print(Rule(characters='=', style=Style(color='#E33157')))
+
+    async def _runPass(self, crawl_pass: CrawlPass) -> None:
+        """
+        1回分の収集を実行し、収集後の処理と同期コマンドを実行する
+        収集中に予期しないエラーが発生しても、常駐は続ける
+
+        Args:
+            crawl_pass (CrawlPass): 実行する収集
+        """
+
+        print(
+            f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}] Starting {crawl_pass.name} pass for '
+            f'{", ".join(target_date.strftime("%Y/%m/%d") for target_date in crawl_pass.target_dates)} ...'
+        )
+        print(Rule(characters='=', style=Style(color='#E33157')))
+
+        # 前回の収集の後に tail で追記されたファイルは、収集ごとの状態を初期化する前に同期するファイルに加える
+        self._unsynced_files |= self.crawler.changed_files
+
+        # 差分収集では、tail で新しいコメントを受信し続けている実況チャンネルを対象から外す
+        jikkyo_channel_ids = self.jikkyo_channel_ids
+        if crawl_pass.name == 'minutes':
+            jikkyo_channel_ids = [
+                jikkyo_channel_id
+                for jikkyo_channel_id in self.jikkyo_channel_ids
+                if jikkyo_channel_id not in self._tail_tasks
+            ]
+
+        self.crawler.startRun(force=crawl_pass.force, incremental=crawl_pass.incremental)
+        self._current_task = asyncio.create_task(self.crawler.crawlDates(jikkyo_channel_ids, crawl_pass.target_dates))
+        interrupted = False
+        try:
+            await self._current_task
+        except asyncio.CancelledError:
+            # 常駐自体が中断された場合以外は、2回目の SIGTERM / SIGINT による中断として扱う
+            current_task = asyncio.current_task()
+            if current_task is not None and current_task.cancelling() > 0:
+                raise
+            interrupted = True
+        except Exception:
+            print(f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}] Unexpected error occurred in the pass.')
+            print(traceback.format_exc())
+            print(Rule(characters='=', style=Style(color='#E33157')))
+        finally:
+            self._current_task = None
+
+        # 前回の同期で同期できなかったファイルも、今回内容が変わったファイルとして扱う
+        ## 書き込みはアトミックに行っているため、中断された収集で書き込まれたファイルも同期してよい
+        self.crawler.changed_files |= self._unsynced_files
+
+        # dataset_structure.json・変更されたファイルの一覧・メトリクスなどを保存する
+        if self.on_pass_finished is not None:
+            try:
+                await self.on_pass_finished(crawl_pass)
+            except Exception:
+                print(f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}] Failed to save the results of the pass.')
+                print(traceback.format_exc())
+                print(Rule(characters='=', style=Style(color='#E33157')))
+
+        # 以降に tail で追記されたファイルは、次の収集で変更されたファイルとして扱うよう新しい集合に記録する
+        changed_files = self.crawler.changed_files
+        self.crawler.changed_files = set()
+
+        # 差分収集で ACTIVE な NX-Jikkyo スレッドが見つかった実況チャンネルは、以降は tail で新しいコメントを受信し続ける
+        if self.tail is True and crawl_pass.name == 'minutes' and interrupted is False:
+            self._startTails()
+
+        # 同期コマンドを実行する
+        ## 中断して終了する場合は、すぐに終了できるよう同期しない (次回起動後の最初の収集で同期する)
+        if self.sync_command is None:
+            self._unsynced_files.clear()
+            return
+        if interrupted is True:
+            self._unsynced_files = changed_files
+            return
+        if await self._runSyncCommand(crawl_pass) is True:
+            self._unsynced_files.clear()
+        else:
+            self._unsynced_files = changed_files
+
+    async def _runSyncCommand(self, crawl_pass: CrawlPass) -> bool:
+        """
+        同期コマンドを実行する
+        実行した収集の種類は、環境変数 JKCOMMENTCRAWLER_PASS (minutes / daily) で同期コマンドに渡す
+
+        Args:
+            crawl_pass (CrawlPass): 実行した収集
+
+        Returns:
+            bool: 同期コマンドが正常終了したなら True
+        """
+
+        assert self.sync_command is not None
+        print(f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}] Running sync command: {self.sync_command}')
+        try:
+            process = await asyncio.create_subprocess_shell(
+                self.sync_command,
+                env={**os.environ, 'JKCOMMENTCRAWLER_PASS': crawl_pass.name},
+            )
+            # 同期コマンドの実行中に終了が要求されても、同期が中途半端な状態で終わらないよう最後まで待つ
+            return_code = await process.wait()
+        except OSError:
+            print(f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}] Failed to run sync command.')
+            print(traceback.format_exc())
+            return_code = None
+        if return_code != 0:
+            print(
+                f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}] Sync command failed (exit code: {return_code}). '
+                'Changed files will be synced after the next pass.'
+            )
+        print(Rule(characters='=', style=Style(color='#E33157')))
+        return return_code == 0
+
+    def _startTails(self) -> None:
+        """
+        直前の差分収集で ACTIVE な NX-Jikkyo スレッドが見つかった実況チャンネルのうち、
+        まだ新しいコメントを受信していない実況チャンネルについて、受信を開始する
+        """
+
+        for jikkyo_channel_id, nx_thread_id in self.crawler.active_nx_threads.items():
+            if jikkyo_channel_id in self._tail_tasks or self._stopping.is_set():
+                continue
+            task = asyncio.create_task(self.crawler.tailThread(jikkyo_channel_id, nx_thread_id))
+            self._tail_tasks[jikkyo_channel_id] = task
+            task.add_done_callback(
+                lambda task, jikkyo_channel_id=jikkyo_channel_id: self._onTailDone(jikkyo_channel_id, task)
+            )
+
+    def _onTailDone(self, jikkyo_channel_id: str, task: asyncio.Task[bool]) -> None:
+        """
+        新しいコメントの受信が終了した際に呼び出され、次の差分収集からその実況チャンネルを対象に戻す
+
+        Args:
+            jikkyo_channel_id (str): 受信が終了した実況チャンネル ID
+            task (asyncio.Task[bool]): 終了したタスク
+        """
+
+        if self._tail_tasks.get(jikkyo_channel_id) is task:
+            del self._tail_tasks[jikkyo_channel_id]
+        if task.cancelled():
+            return
+        exception = task.exception()
+        if exception is not None:
+            print(
+                f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}]\\[{jikkyo_channel_id}] '
+                'Stopped streaming due to an unexpected error. Falling back to polling.'
+            )
+            print(''.join(traceback.format_exception(exception)))
+            print(Rule(characters='=', style=Style(color='#E33157')))
+
+    async def _stopTails(self) -> None:
+        """
+        新しいコメントを受信し続けている全てのタスクを中断し、終了するまで待つ
+        (受信したコメントの追記中であれば、追記が終わるのを待ってから中断される)
+        """
+
+        tasks = list(self._tail_tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
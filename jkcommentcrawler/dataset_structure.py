@@ -0,0 +1,210 @@
+from __future__ import annotations
+
+import json
+import os
+from collections.abc import Iterable
+from typing import Any
+
+import anyio
+
+from jkcommentcrawler.utils import write_file_atomically
+
+
+class DatasetStructure:
+    """
+    過去ログフォルダのフォルダ/ファイル構造を示す dataset_structure.json を管理するクラス
+    過去ログフォルダのツリーをインデックスとしてキャッシュフォルダに保存しておき、今回の実行で書き込んだファイルだけを反映して更新する
+    ツリー全体の再スキャンは、明示的に指定された場合か、インデックスがない・インデックスが実際のツリーと食い違っている場合にのみ行う
+    """
+
+    # インデックスファイルのフォーマットのバージョン
+    VERSION = 1
+
+    def __init__(self, kakolog_dir: anyio.Path, index_path: anyio.Path) -> None:
+        """
+        DatasetStructure のコンストラクタ
+
+        Args:
+            kakolog_dir (anyio.Path): 過去ログを保存するフォルダのパス
+            index_path (anyio.Path): ツリーのインデックスを保存するファイルのパス
+        """
+
+        self.kakolog_dir = kakolog_dir
+        self.index_path = index_path
+        self.structure_path = kakolog_dir / 'dataset_structure.json'
+
+        # 過去ログフォルダからの相対パス (/ 区切り) ごとのフォルダの情報
+        ## mtime_ns: スキャンした時点のフォルダの最終更新日時
+        ## children: フォルダ直下のエントリ名ごとの、フォルダかどうか
+        self.directories: dict[str, dict[str, Any]] = {}
+
+    async def load(self) -> bool:
+        """
+        インデックスを読み込む
+
+        Returns:
+            bool: インデックスを読み込めたかどうか (存在しないか壊れている場合は False)
+        """
+
+        try:
+            data: dict[str, Any] = json.loads(await self.index_path.read_bytes())
+            if data['version'] != self.VERSION or data['kakolog_dir'] != str(self.kakolog_dir):
+                return False
+            self.directories = {
+                path: {'mtime_ns': int(directory['mtime_ns']), 'children': dict(directory['children'])}
+                for path, directory in data['directories'].items()
+            }
+            return True
+        except (FileNotFoundError, ValueError, KeyError, TypeError, AttributeError):
+            return False
+
+    async def save(self) -> None:
+        """
+        インデックスをアトミックに保存する
+        """
+
+        await self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        data = {'version': self.VERSION, 'kakolog_dir': str(self.kakolog_dir), 'directories': self.directories}
+        await write_file_atomically(self.index_path, json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+    async def rescan(self) -> None:
+        """
+        過去ログフォルダのツリー全体をスキャンし直してインデックスを作り直す
+        エントリごとに await せず、os.scandir() でまとめてスキャンする処理をワーカースレッドで実行する
+        """
+
+        def rescan() -> dict[str, dict[str, Any]]:
+            if not os.path.isdir(self.kakolog_dir):
+                raise FileNotFoundError(f'Directory "{self.kakolog_dir}" does not exist.')
+            directories: dict[str, dict[str, Any]] = {}
+            pending = ['']
+            while len(pending) > 0:
+                relative_path = pending.pop()
+                directory = self._scanDirectory(relative_path)
+                directories[relative_path] = directory
+                for name, is_dir in directory['children'].items():
+                    if is_dir is True:
+                        pending.append(f'{relative_path}/{name}' if relative_path != '' else name)
+            return directories
+
+        self.directories = await anyio.to_thread.run_sync(rescan)
+
+    async def isStale(self) -> bool:
+        """
+        インデックスが実際のツリーと食い違っていないかを、フォルダの stat だけで確認する
+        実況チャンネルのフォルダ・年ごとのフォルダは最終更新日時で、過去ログフォルダ直下は実況チャンネルのフォルダの一覧で比較する
+        (過去ログフォルダ直下は dataset_structure.json や Git の管理ファイルの書き込みで最終更新日時が頻繁に変わるため)
+
+        Returns:
+            bool: インデックスが古くなっている場合は True
+        """
+
+        def is_stale() -> bool:
+            root = self.directories.get('')
+            if root is None:
+                return True
+            if self._scanDirectory('')['children'] != root['children']:
+                return True
+            for relative_path, directory in self.directories.items():
+                if relative_path == '':
+                    continue
+                try:
+                    if os.stat(os.path.join(self.kakolog_dir, relative_path)).st_mtime_ns != directory['mtime_ns']:
+                        return True
+                except FileNotFoundError:
+                    return True
+            return False
+
+        return await anyio.to_thread.run_sync(is_stale)
+
+    async def update(self, written_files: Iterable[anyio.Path]) -> None:
+        """
+        今回の実行で書き込んだファイルをインデックスに反映する
+        書き込んだファイルを含むフォルダは、反映後の最終更新日時を記録し直す
+
+        Args:
+            written_files (Iterable[anyio.Path]): 今回の実行で書き込んだファイルのパスのリスト
+        """
+
+        def update() -> None:
+            touched_directories: set[str] = set()
+            for written_file in written_files:
+                parts = os.path.relpath(written_file, self.kakolog_dir).split(os.sep)
+                if len(parts) < 2 or parts[0].startswith('jk') is False:
+                    continue
+                # 書き込んだファイルまでのフォルダを順にインデックスに追加する
+                parent = ''
+                for index, name in enumerate(parts):
+                    directory = self.directories.setdefault(parent, {'mtime_ns': 0, 'children': {}})
+                    directory['children'][name] = index < len(parts) - 1
+                    touched_directories.add(parent)
+                    parent = f'{parent}/{name}' if parent != '' else name
+            for relative_path in touched_directories:
+                if relative_path != '':
+                    stat = os.stat(os.path.join(self.kakolog_dir, relative_path))
+                    self.directories[relative_path]['mtime_ns'] = stat.st_mtime_ns
+
+        await anyio.to_thread.run_sync(update)
+
+    def getStructure(self) -> dict[str, Any]:
+        """
+        インデックスから dataset_structure.json に出力するフォルダ/ファイル構造を構築する
+        過去ログフォルダ直下は jk から始まるフォルダのみ、それより下は全てのフォルダとファイルを含める (ファイルの値は None)
+
+        Returns:
+            dict[str, Any]: 過去ログフォルダのフォルダ/ファイル構造
+        """
+
+        def get_directory_contents(relative_path: str) -> dict[str, Any]:
+            data: dict[str, Any] = {}
+            children = self.directories.get(relative_path, {'children': {}})['children']
+            for name in sorted(children):
+                child_path = f'{relative_path}/{name}' if relative_path != '' else name
+                if children[name] is True and (name.startswith('jk') or relative_path != ''):
+                    data[name] = get_directory_contents(child_path)
+                elif children[name] is False and relative_path != '':
+                    data[name] = None
+            return data
+
+        return get_directory_contents('')
+
+    async def saveStructure(self) -> bool:
+        """
+        dataset_structure.json を保存する (内容が変わっていない場合は書き込まない)
+
+        Returns:
+            bool: dataset_structure.json を書き込んだかどうか
+        """
+
+        content = json.dumps(self.getStructure(), ensure_ascii=False, indent=4).encode('utf-8')
+        try:
+            if await self.structure_path.read_bytes() == content:
+                return False
+        except FileNotFoundError:
+            pass
+        await write_file_atomically(self.structure_path, content)
+        return True
+
+    def _scanDirectory(self, relative_path: str) -> dict[str, Any]:
+        """
+        フォルダ直下のエントリをスキャンする (ワーカースレッドから呼び出す)
+
+        Args:
+            relative_path (str): 過去ログフォルダからの相対パス
+
+        Returns:
+            dict[str, Any]: フォルダの最終更新日時と、直下のエントリ名ごとのフォルダかどうか
+        """
+
+        path = os.path.join(self.kakolog_dir, relative_path) if relative_path != '' else str(self.kakolog_dir)
+        children: dict[str, bool] = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                # 過去ログフォルダ直下は jk から始まる実況チャンネルのフォルダだけを対象にする
+                if relative_path == '' and (entry.name.startswith('jk') is False or entry.is_dir() is False):
+                    continue
+                if entry.is_dir():
+                    children[entry.name] = True
+                elif entry.is_file():
+                    children[entry.name] = False
+        return {'mtime_ns': os.stat(path).st_mtime_ns, 'children': children}
@@ -0,0 +1,192 @@
+from __future__ import annotations
+
+import asyncio
+import warnings
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any
+from urllib.parse import urlsplit
+
+import curl_cffi.requests as requests
+from curl_cffi import CurlInfo
+
+
+class HTTPConnectionPool:
+    """
+    クロール実行全体で共有する HTTP コネクションプール
+    curl-cffi の AsyncSession を1つだけ保持し、複数の NXClient やクラスメソッドから使い回すことで、
+    実況チャンネルやスレッドごとに TLS ハンドシェイクをやり直すことなく keep-alive 接続を再利用する
+    """
+
+    def __init__(
+        self,
+        user_agent: str,
+        host_limits: dict[str, int] | None = None,
+        max_clients: int = 10,
+    ) -> None:
+        """
+        HTTPConnectionPool のコンストラクタ
+
+        Args:
+            user_agent (str): リクエスト時に送信する User-Agent
+            host_limits (dict[str, int] | None, default=None): ホスト名ごとの同時リクエスト数の上限 (指定されていないホストは無制限)
+            max_clients (int, default=10): 内部で保持する curl ハンドルの最大数
+        """
+
+        # curl-cffi の非同期 HTTP クライアントのインスタンスを作成
+        ## CURLINFO_NUM_CONNECTS を取得し、各リクエストで新規接続したか既存の接続を再利用したかを記録する
+        self.session = requests.AsyncSession(
+            headers={'User-Agent': user_agent},
+            max_clients=max_clients,
+            curl_infos=[CurlInfo.NUM_CONNECTS],
+        )
+
+        # ホスト名ごとの同時リクエスト数を制限するセマフォ
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {
+            host: asyncio.Semaphore(limit) for host, limit in (host_limits or {}).items()
+        }
+
+        # 新規に確立した接続数・再利用した接続数・リクエスト数・受信したレスポンスボディのバイト数
+        ## stream() で受信したレスポンスボディのバイト数は、読み出した側で加算する
+        self.new_connections: int = 0
+        self.reused_connections: int = 0
+        self.request_count: int = 0
+        self.received_bytes: int = 0
+
+        # close() が呼び出されたかどうかを追跡するフラグ
+        ## 複数回 close() が呼び出されても安全に動作するようにするために使用する
+        self._is_closed: bool = False
+
+    async def __aenter__(self) -> HTTPConnectionPool:
+        """
+        非同期コンテキストマネージャーのエントリポイント。
+        HTTPConnectionPool インスタンス自身を返す。
+
+        Returns:
+            HTTPConnectionPool: HTTPConnectionPool インスタンス自身
+        """
+
+        return self
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_val: BaseException | None,
+        exc_tb: Any,
+    ) -> None:
+        """
+        非同期コンテキストマネージャーの終了処理。
+        内部の HTTP クライアントのリソースを解放する。
+        """
+
+        await self.close()
+
+    async def get(self, url: str, **kwargs: Any) -> requests.Response:
+        """
+        共有セッションを使って GET リクエストを送信する
+
+        Args:
+            url (str): リクエスト先の URL
+            **kwargs: curl-cffi の AsyncSession.get() にそのまま渡す引数
+
+        Returns:
+            requests.Response: レスポンス
+        """
+
+        return await self.request('GET', url, **kwargs)
+
+    async def request(self, method: str, url: str, **kwargs: Any) -> requests.Response:
+        """
+        共有セッションを使って HTTP リクエストを送信する
+        リクエスト先のホストに同時リクエスト数の上限が設定されている場合は、上限を超えないよう待機してから送信する
+
+        Args:
+            method (str): HTTP メソッド
+            url (str): リクエスト先の URL
+            **kwargs: curl-cffi の AsyncSession.request() にそのまま渡す引数
+
+        Returns:
+            requests.Response: レスポンス
+        """
+
+        async with self._limitHost(url):
+            response = await self.session.request(method, url, **kwargs)  # type: ignore
+        self._recordConnection(response)
+        self.received_bytes += len(response.content)
+        return response
+
+    @asynccontextmanager
+    async def stream(self, method: str, url: str, **kwargs: Any) -> AsyncIterator[requests.Response]:
+        """
+        共有セッションを使って HTTP リクエストを送信し、レスポンスボディを受信しながら少しずつ読み出せるレスポンスを返す
+        レスポンスボディを読み終えるまで、リクエスト先のホストの同時リクエスト数の枠を確保し続ける
+
+        Args:
+            method (str): HTTP メソッド
+            url (str): リクエスト先の URL
+            **kwargs: curl-cffi の AsyncSession.stream() にそのまま渡す引数
+
+        Yields:
+            requests.Response: レスポンス (aiter_content() でレスポンスボディを少しずつ読み出せる)
+        """
+
+        async with self._limitHost(url):
+            async with self.session.stream(method, url, **kwargs) as response:  # type: ignore
+                self._recordConnection(response)
+                yield response
+
+    def _limitHost(self, url: str) -> asyncio.Semaphore | nullcontext[None]:
+        """
+        リクエスト先のホストの同時リクエスト数を制限するための非同期コンテキストマネージャーを返す
+
+        Args:
+            url (str): リクエスト先の URL
+
+        Returns:
+            asyncio.Semaphore | nullcontext[None]: ホストのセマフォ (上限が設定されていないホストでは何もしないコンテキストマネージャー)
+        """
+
+        semaphore = self._host_semaphores.get(urlsplit(url).hostname or '')
+        return semaphore if semaphore is not None else nullcontext()
+
+    def _recordConnection(self, response: requests.Response) -> None:
+        """
+        レスポンスの CURLINFO_NUM_CONNECTS から、新規接続したか既存の接続を再利用したかを記録する
+
+        Args:
+            response (requests.Response): 記録するレスポンス
+        """
+
+        self.request_count += 1
+        new_connections = int(response.infos.get(CurlInfo.NUM_CONNECTS, 0) or 0)
+        if new_connections > 0:
+            self.new_connections += new_connections
+        else:
+            self.reused_connections += 1
+
+    async def close(self) -> None:
+        """
+        HTTPConnectionPool が保持する HTTP クライアントのリソースを解放する。
+        このメソッドは冪等であり、複数回呼び出しても安全に動作する。
+        """
+
+        # 既にクローズ済みの場合は何もしない (冪等性の保証)
+        if self._is_closed is True:
+            return
+
+        # curl-cffi の AsyncSession.close() を呼び出して HTTP クライアントのリソースを解放する
+        await self.session.close()
+        self._is_closed = True
+
+    def __del__(self) -> None:
+        """
+        close() を呼ばずに GC されたインスタンスに対して ResourceWarning を発行するセーフティネット。
+        実際のリソース解放は行わない（__del__() 内で async メソッドを呼べないため）。
+        """
+
+        if getattr(self, '_is_closed', True) is not True:
+            warnings.warn(
+                f'Unclosed {self!r}. Call "await pool.close()" to release resources.',
+                ResourceWarning,
+                source=self,
+            )
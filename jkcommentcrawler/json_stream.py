@@ -0,0 +1,196 @@
+from __future__ import annotations
+
+import codecs
+import json
+import re
+from typing import Any, Literal
+
+
+# 空白文字にマッチする正規表現
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class StreamingJSONObjectDecoder:
+    """
+    JSON オブジェクトを受信したチャンクごとに少しずつデコードするデコーダー
+    指定したキーの配列の要素は、配列全体の受信を待たずに1つずつ取り出せる
+    それ以外のキーの値は小さいことを前提に、値ごとにデコードして fields に格納する
+    バッファに保持するのは未処理の部分だけのため、メモリ使用量はレスポンス全体ではなくチャンクと配列の要素1つ分の大きさで抑えられる
+    """
+
+    # 処理済みの部分をバッファから切り詰める閾値 (文字数)
+    COMPACT_THRESHOLD = 64 * 1024
+
+    def __init__(self, array_key: str) -> None:
+        """
+        StreamingJSONObjectDecoder のコンストラクタ
+
+        Args:
+            array_key (str): 要素を1つずつ取り出す配列のキー
+        """
+
+        self.array_key = array_key
+
+        # 配列以外のキーの値
+        self.fields: dict[str, Any] = {}
+
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json_decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._position = 0
+        self._state: Literal['start', 'key', 'colon', 'value', 'after_value', 'item', 'after_item', 'end'] = 'start'
+        self._key = ''
+
+    def feed(self, chunk: bytes) -> list[Any]:
+        """
+        受信したチャンクをデコーダーに追加し、新たにデコードできた配列の要素を返す
+
+        Args:
+            chunk (bytes): 受信したチャンク
+
+        Returns:
+            list[Any]: 新たにデコードできた配列の要素のリスト
+
+        Raises:
+            ValueError: JSON の構造が不正な場合
+        """
+
+        self._buffer += self._text_decoder.decode(chunk)
+        items = self._parse(final=False)
+
+        # 処理済みの部分をバッファから取り除き、バッファが際限なく大きくならないようにする
+        if self._position > self.COMPACT_THRESHOLD:
+            self._buffer = self._buffer[self._position :]
+            self._position = 0
+        return items
+
+    def close(self) -> list[Any]:
+        """
+        全てのチャンクを受信し終えたことをデコーダーに伝え、残りの配列の要素を返す
+
+        Returns:
+            list[Any]: 新たにデコードできた配列の要素のリスト
+
+        Raises:
+            ValueError: JSON が途中で終わっている、または JSON の構造が不正な場合
+        """
+
+        self._buffer += self._text_decoder.decode(b'', final=True)
+        items = self._parse(final=True)
+        if self._state != 'end' or self._skipWhitespace() < len(self._buffer):
+            raise ValueError('Incomplete or invalid JSON document.')
+        return items
+
+    def _skipWhitespace(self) -> int:
+        self._position = WHITESPACE.match(self._buffer, self._position).end()  # type: ignore
+        return self._position
+
+    def _decodeValue(self, final: bool) -> tuple[bool, Any]:
+        """
+        バッファの現在位置から JSON の値を1つデコードする
+
+        Args:
+            final (bool): 全てのチャンクを受信し終えているかどうか
+
+        Returns:
+            tuple[bool, Any]: 値をデコードできたかどうかと、デコードした値
+        """
+
+        try:
+            value, end = self._json_decoder.raw_decode(self._buffer, self._position)
+        except json.JSONDecodeError:
+            # 値の途中でチャンクが途切れている可能性があるため、続きを受信するまで待つ
+            if final is True:
+                raise
+            return False, None
+        # 数値はバッファの末尾で途切れていても正常にデコードできてしまうため、続きの文字を受信するまで確定しない
+        if end >= len(self._buffer) and final is False:
+            return False, None
+        self._position = end
+        return True, value
+
+    def _parse(self, final: bool) -> list[Any]:
+        """
+        バッファに溜まっている JSON を、デコードできるところまでデコードする
+
+        Args:
+            final (bool): 全てのチャンクを受信し終えているかどうか
+
+        Returns:
+            list[Any]: 新たにデコードできた配列の要素のリスト
+        """
+
+        items: list[Any] = []
+        while self._skipWhitespace() < len(self._buffer):
+            character = self._buffer[self._position]
+
+            if self._state == 'start':
+                if character != '{':
+                    raise ValueError(f'Expected "{{" at position {self._position}.')
+                self._position += 1
+                self._state = 'key'
+
+            elif self._state == 'key':
+                if character == '}':
+                    self._position += 1
+                    self._state = 'end'
+                    continue
+                decoded, key = self._decodeValue(final)
+                if decoded is False:
+                    break
+                if not isinstance(key, str):
+                    raise ValueError('Object keys must be strings.')
+                self._key = key
+                self._state = 'colon'
+
+            elif self._state == 'colon':
+                if character != ':':
+                    raise ValueError(f'Expected ":" at position {self._position}.')
+                self._position += 1
+                self._state = 'value'
+
+            elif self._state == 'value':
+                # 取り出し対象の配列に入ったら、要素を1つずつデコードする
+                if self._key == self.array_key and character == '[':
+                    self._position += 1
+                    self._state = 'item'
+                    continue
+                decoded, value = self._decodeValue(final)
+                if decoded is False:
+                    break
+                self.fields[self._key] = value
+                self._state = 'after_value'
+
+            elif self._state == 'after_value':
+                self._position += 1
+                if character == ',':
+                    self._state = 'key'
+                elif character == '}':
+                    self._state = 'end'
+                else:
+                    raise ValueError(f'Expected "," or "}}" at position {self._position - 1}.')
+
+            elif self._state == 'item':
+                if character == ']':
+                    self._position += 1
+                    self._state = 'after_value'
+                    continue
+                decoded, item = self._decodeValue(final)
+                if decoded is False:
+                    break
+                items.append(item)
+                self._state = 'after_item'
+
+            elif self._state == 'after_item':
+                self._position += 1
+                if character == ',':
+                    self._state = 'item'
+                elif character == ']':
+                    self._state = 'after_value'
+                else:
+                    raise ValueError(f'Expected "," or "]" at position {self._position - 1}.')
+
+            else:
+                raise ValueError(f'Unexpected data after the end of the JSON document at position {self._position}.')
+
+        return items
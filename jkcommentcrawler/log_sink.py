@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import time
+import warnings
+
+import anyio
+
+
+class BufferedLogSink:
+    """
+    動作ログをファイルに書き込むためのバッファ付きのシンク
+    ログファイルのハンドルを1つだけ開いたまま保持し、書き込みをバッファにまとめてから書き出すことで、
+    ログを1行出力するたびにファイルを開閉する (anyio のワーカースレッドを経由したシステムコールが大量に発生する) のを避ける
+    バッファは、溜まった文字数が max_buffer_size を超えたとき・前回書き出してから flush_interval 秒以上経過したとき・close() 時に書き出す
+    """
+
+    def __init__(
+        self,
+        log_path: anyio.Path,
+        max_buffer_size: int = 64 * 1024,
+        flush_interval: float = 1.0,
+    ) -> None:
+        """
+        BufferedLogSink のコンストラクタ
+
+        Args:
+            log_path (anyio.Path): 動作ログを追記するファイルのパス
+            max_buffer_size (int, default=64KiB): バッファに溜める最大の文字数
+            flush_interval (float, default=1.0): バッファを書き出す最大の間隔 (秒)
+        """
+
+        self.log_path = log_path
+        self.max_buffer_size = max_buffer_size
+        self.flush_interval = flush_interval
+
+        self._file: anyio.AsyncFile[str] | None = None
+        self._buffer: list[str] = []
+        self._buffer_size = 0
+        self._last_flushed_at = time.monotonic()
+
+        # close() が呼び出されたかどうかを追跡するフラグ
+        ## 複数回 close() が呼び出されても安全に動作するようにするために使用する
+        self._is_closed: bool = False
+
+    async def write(self, text: str) -> None:
+        """
+        文字列をバッファに追加し、閾値を超えていればファイルに書き出す
+
+        Args:
+            text (str): 書き込む文字列
+        """
+
+        if self._is_closed is True:
+            raise RuntimeError('Cannot write to a closed log sink.')
+
+        self._buffer.append(text)
+        self._buffer_size += len(text)
+        if self._buffer_size >= self.max_buffer_size or time.monotonic() - self._last_flushed_at >= self.flush_interval:
+            await self.flush()
+
+    async def flush(self) -> None:
+        """
+        バッファに溜まっている文字列をファイルに書き出す
+        ログファイルは最初に書き出す時点で開き、close() まで開いたままにする
+        """
+
+        self._last_flushed_at = time.monotonic()
+        if len(self._buffer) == 0:
+            return
+
+        if self._file is None:
+            self._file = await self.log_path.open('a', encoding='utf-8')
+        text = ''.join(self._buffer)
+        self._buffer.clear()
+        self._buffer_size = 0
+        await self._file.write(text)
+        await self._file.flush()
+
+    async def close(self) -> None:
+        """
+        バッファに残っている文字列を書き出し、ログファイルを閉じる。
+        このメソッドは冪等であり、複数回呼び出しても安全に動作する。
+        """
+
+        # 既にクローズ済みの場合は何もしない (冪等性の保証)
+        if self._is_closed is True:
+            return
+
+        try:
+            await self.flush()
+        finally:
+            if self._file is not None:
+                await self._file.aclose()
+                self._file = None
+            self._is_closed = True
+
+    def __del__(self) -> None:
+        """
+        close() を呼ばずに GC されたインスタンスに対して ResourceWarning を発行するセーフティネット。
+        実際のリソース解放は行わない（__del__() 内で async メソッドを呼べないため）。
+        """
+
+        if getattr(self, '_is_closed', True) is not True and (self._file is not None or len(self._buffer) > 0):
+            warnings.warn(
+                f'Unclosed {self!r}. Call "await sink.close()" to flush logs and release resources.',
+                ResourceWarning,
+                source=self,
+            )
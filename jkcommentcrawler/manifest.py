@@ -0,0 +1,253 @@
+from __future__ import annotations
+
+import asyncio
+import codecs
+import hashlib
+import json
+import os
+from datetime import date
+from typing import Any, NamedTuple
+
+import anyio
+
+from jkcommentcrawler.utils import write_file_atomically
+
+
+class ManifestEntry(NamedTuple):
+    """マニフェストに記録された、1日分の .nicojk ファイルの情報"""
+
+    size: int  # ファイルサイズ (バイト)
+    mtime_ns: int  # ファイルの最終更新日時 (ナノ秒単位の UNIX タイムスタンプ)
+    chars: int  # ファイルの文字数
+    comment_count: int  # ファイルに含まれるコメント数
+    sha256: str | None  # ファイルの内容の SHA-256 ハッシュ (差分モードで追記した場合など、未計算の場合は None)
+    sources: dict[
+        str, int
+    ]  # 取得元 (ニコニコ生放送番組・NX-Jikkyo スレッド) ごとのコメント数 (スキャンで再構築した場合は空)
+
+
+class KakologManifest:
+    """
+    実況チャンネルごとに、保存した .nicojk ファイルの文字数・コメント数・取得元ごとのコメント数・ハッシュを記録するマニフェスト
+    上書きするかどうかの判定や実行結果の表示のために、既存の .nicojk ファイルを毎回全て読み込まずに済むようにする
+    マニフェストは過去ログフォルダ (Hugging Face に公開される) を汚さないよう、キャッシュフォルダに保存する
+    記録されたファイルサイズ・最終更新日時が実際のファイルと一致しない場合や、マニフェストがない場合は、ファイルを少しずつ読み込んで再構築する
+    """
+
+    # マニフェストファイルのフォーマットのバージョン
+    VERSION = 1
+
+    # .nicojk ファイルをスキャンする際に一度に読み込むサイズ (バイト)
+    SCAN_CHUNK_SIZE = 1024 * 1024
+
+    def __init__(self, manifest_dir: anyio.Path, kakolog_dir: anyio.Path) -> None:
+        """
+        KakologManifest のコンストラクタ
+
+        Args:
+            manifest_dir (anyio.Path): マニフェストファイルを保存するフォルダのパス
+            kakolog_dir (anyio.Path): 過去ログを保存するフォルダのパス
+        """
+
+        self.manifest_dir = manifest_dir
+        self.kakolog_dir = kakolog_dir
+
+        # 読み込み済みの実況チャンネルごとのマニフェスト (キーは YYYYMMDD 形式の日付)
+        self._manifests: dict[str, dict[str, ManifestEntry]] = {}
+
+        # 実況チャンネルごとのマニフェストの読み書きを直列化するためのロック
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    def getLogPath(self, jikkyo_channel_id: str, target_date: date) -> anyio.Path:
+        """
+        実況チャンネル・日付に対応する .nicojk ファイルのパスを返す
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): 日付
+
+        Returns:
+            anyio.Path: {kakolog_dir}/{jikkyo_channel_id}/{date.year}/{date.strftime('%Y%m%d')}.nicojk のパス
+        """
+
+        return self.kakolog_dir / jikkyo_channel_id / str(target_date.year) / f'{target_date.strftime("%Y%m%d")}.nicojk'
+
+    async def getEntry(
+        self, jikkyo_channel_id: str, target_date: date, require_hash: bool = False
+    ) -> ManifestEntry | None:
+        """
+        実況チャンネル・日付に対応する .nicojk ファイルの情報を返す
+        マニフェストの記録が実際のファイルと一致しない場合 (require_hash が指定され、ハッシュが未計算の場合を含む) は、
+        ファイルをスキャンしてマニフェストを更新する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): 日付
+            require_hash (bool, default=False): ファイルの内容のハッシュが必要かどうか
+
+        Returns:
+            ManifestEntry | None: .nicojk ファイルの情報 (ファイルが存在しない場合は None)
+        """
+
+        key = target_date.strftime('%Y%m%d')
+        log_path = self.getLogPath(jikkyo_channel_id, target_date)
+
+        async with self._getLock(jikkyo_channel_id):
+            manifest = await self._load(jikkyo_channel_id)
+            entry = manifest.get(key)
+            try:
+                stat = await log_path.stat()
+            except FileNotFoundError:
+                if entry is not None:
+                    del manifest[key]
+                    await self._save(jikkyo_channel_id)
+                return None
+
+            # 記録されたファイルサイズ・最終更新日時が一致していれば、記録をそのまま信頼する
+            is_fresh = entry is not None and entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns
+            if entry is not None and is_fresh is True and (require_hash is False or entry.sha256 is not None):
+                return entry
+
+            # マニフェストにない・ファイルが外部から変更された・ハッシュが未計算の場合は、ファイルをスキャンして再構築する
+            ## 取得元ごとのコメント数はファイルからは分からないため、ファイルが変更されていない場合だけ引き継ぐ
+            size, mtime_ns, chars, comment_count, sha256 = await self.scanLog(log_path)
+            manifest[key] = ManifestEntry(
+                size=size,
+                mtime_ns=mtime_ns,
+                chars=chars,
+                comment_count=comment_count,
+                sha256=sha256,
+                sources=entry.sources if entry is not None and is_fresh is True else {},
+            )
+            await self._save(jikkyo_channel_id)
+            return manifest[key]
+
+    async def updateEntry(
+        self,
+        jikkyo_channel_id: str,
+        target_date: date,
+        chars: int,
+        comment_count: int,
+        sha256: str | None,
+        sources: dict[str, int],
+    ) -> ManifestEntry:
+        """
+        .nicojk ファイルを保存した直後に、その内容をマニフェストに記録してアトミックに保存する
+        ファイルサイズ・最終更新日時は保存後のファイルから取得する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+            target_date (date): 日付
+            chars (int): ファイルの文字数
+            comment_count (int): ファイルに含まれるコメント数
+            sha256 (str | None): ファイルの内容の SHA-256 ハッシュ (未計算の場合は None)
+            sources (dict[str, int]): 取得元ごとのコメント数
+
+        Returns:
+            ManifestEntry: 記録した .nicojk ファイルの情報
+        """
+
+        stat = await self.getLogPath(jikkyo_channel_id, target_date).stat()
+        async with self._getLock(jikkyo_channel_id):
+            manifest = await self._load(jikkyo_channel_id)
+            entry = ManifestEntry(
+                size=stat.st_size,
+                mtime_ns=stat.st_mtime_ns,
+                chars=chars,
+                comment_count=comment_count,
+                sha256=sha256,
+                sources=sources,
+            )
+            manifest[target_date.strftime('%Y%m%d')] = entry
+            await self._save(jikkyo_channel_id)
+            return entry
+
+    @classmethod
+    async def scanLog(cls, log_path: anyio.Path) -> tuple[int, int, int, int, str]:
+        """
+        .nicojk ファイルを少しずつ読み込み、ファイルサイズ・最終更新日時・文字数・コメント数・SHA-256 ハッシュを求める
+        ファイル全体をメモリに読み込まないため、巨大なファイルでもメモリ使用量は読み込むチャンクの大きさで抑えられる
+
+        Args:
+            log_path (anyio.Path): .nicojk ファイルのパス
+
+        Returns:
+            tuple[int, int, int, int, str]: ファイルサイズ・最終更新日時 (ナノ秒)・文字数・コメント数・SHA-256 ハッシュ
+        """
+
+        def scan() -> tuple[int, int, int, int, str]:
+            hasher = hashlib.sha256()
+            decoder = codecs.getincrementaldecoder('utf-8')()
+            chars = 0
+            comment_count = 0
+            # チャンクの境界をまたいだ '<chat' も数えられるよう、前のチャンクの末尾を持ち越す
+            tail = ''
+            with open(log_path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                while chunk := f.read(cls.SCAN_CHUNK_SIZE):
+                    hasher.update(chunk)
+                    text = tail + decoder.decode(chunk)
+                    chars += len(text) - len(tail)
+                    comment_count += text.count('<chat')
+                    tail = text[-4:]
+            chars += len(decoder.decode(b'', final=True))
+            return stat.st_size, stat.st_mtime_ns, chars, comment_count, hasher.hexdigest()
+
+        return await anyio.to_thread.run_sync(scan)
+
+    def _getLock(self, jikkyo_channel_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(jikkyo_channel_id, asyncio.Lock())
+
+    async def _load(self, jikkyo_channel_id: str) -> dict[str, ManifestEntry]:
+        """
+        実況チャンネルのマニフェストを読み込む (読み込み済みの場合はそれを返す)
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+
+        Returns:
+            dict[str, ManifestEntry]: YYYYMMDD 形式の日付ごとの .nicojk ファイルの情報 (存在しないか壊れている場合は空)
+        """
+
+        if jikkyo_channel_id in self._manifests:
+            return self._manifests[jikkyo_channel_id]
+
+        manifest: dict[str, ManifestEntry] = {}
+        try:
+            data: dict[str, Any] = json.loads(await (self.manifest_dir / f'{jikkyo_channel_id}.json').read_bytes())
+            if data['version'] == self.VERSION:
+                for key, value in data['entries'].items():
+                    manifest[key] = ManifestEntry(
+                        size=int(value['size']),
+                        mtime_ns=int(value['mtime_ns']),
+                        chars=int(value['chars']),
+                        comment_count=int(value['comment_count']),
+                        sha256=value['sha256'],
+                        sources={source: int(count) for source, count in value['sources'].items()},
+                    )
+        except (FileNotFoundError, ValueError, KeyError, TypeError, AttributeError):
+            # 壊れたマニフェストは空として扱い、必要になったエントリから再構築する
+            manifest = {}
+
+        self._manifests[jikkyo_channel_id] = manifest
+        return manifest
+
+    async def _save(self, jikkyo_channel_id: str) -> None:
+        """
+        実況チャンネルのマニフェストをアトミックに保存する
+
+        Args:
+            jikkyo_channel_id (str): 実況チャンネル ID
+        """
+
+        await self.manifest_dir.mkdir(parents=True, exist_ok=True)
+        data = {
+            'version': self.VERSION,
+            'entries': {
+                key: entry._asdict() for key, entry in sorted(self._manifests.get(jikkyo_channel_id, {}).items())
+            },
+        }
+        await write_file_atomically(
+            self.manifest_dir / f'{jikkyo_channel_id}.json',
+            json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8'),
+        )
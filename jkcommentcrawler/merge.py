@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import heapq
+import math
+from bisect import bisect_left
+from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
+from datetime import date, datetime, time, timedelta
+from operator import itemgetter
+from typing import Any
+
+from ndgr_client import XMLCompatibleComment
+
+from jkcommentcrawler.comment_batch import CommentBatch
+
+
+def get_date_bounds(target_date: date) -> tuple[float, float]:
+    """
+    指定された日付 (ローカルタイムゾーン) の開始・終了の UNIX タイムスタンプを返す
+    datetime.fromtimestamp(timestamp).date() == target_date は start <= timestamp < end と同じ意味になる
+
+    Args:
+        target_date (date): 日付
+
+    Returns:
+        tuple[float, float]: 日付の開始時刻と、翌日の開始時刻の UNIX タイムスタンプ
+    """
+
+    start = datetime.combine(target_date, time.min).timestamp()
+    end = datetime.combine(target_date + timedelta(days=1), time.min).timestamp()
+    return start, end
+
+
+def merge_comments(
+    sources: Iterable[Sequence[XMLCompatibleComment] | CommentBatch],
+    target_date: date,
+) -> list[XMLCompatibleComment]:
+    """
+    取得元 (ニコニコ生放送番組・NX-Jikkyo スレッド) ごとのコメントのリストを、指定された日付に投稿されたコメントだけに絞り込みつつ、
+    投稿日時昇順の1つのリストにマージする
+    各取得元のコメントは通常すでに投稿日時昇順になっているため、全体をソートし直さずに k-way マージする
+    日付での絞り込みも、コメントごとに datetime を作らずに、事前に求めた日付の境界の UNIX タイムスタンプで二分探索して行う
+    投稿日時が同じコメントは、先に渡された取得元のコメントが先になる (全体を連結して安定ソートした場合と同じ順序になる)
+    CommentBatch の取得元は列のまま絞り込み、指定された日付に投稿されたコメントだけを XMLCompatibleComment に変換する
+
+    Args:
+        sources (Iterable[Sequence[XMLCompatibleComment] | CommentBatch]): 取得元ごとのコメントのリスト
+        target_date (date): 絞り込む日付
+
+    Returns:
+        list[XMLCompatibleComment]: 指定された日付に投稿されたコメントのリスト (投稿日時昇順)
+    """
+
+    start, end = get_date_bounds(target_date)
+    streams = [_slice_source(source, start, end) for source in sources]
+    return list(_merge_streams([stream for count, stream in streams if count > 0]))
+
+
+def merge_comment_sources(
+    sources: Mapping[str, Sequence[XMLCompatibleComment] | CommentBatch],
+    target_date: date,
+) -> tuple[list[XMLCompatibleComment], dict[str, int]]:
+    """
+    merge_comments() と同様に取得元ごとのコメントをマージし、あわせて取得元ごとのマージしたコメント数を返す
+
+    Args:
+        sources (Mapping[str, Sequence[XMLCompatibleComment] | CommentBatch]): 取得元の名前ごとのコメントのリスト
+        target_date (date): 絞り込む日付
+
+    Returns:
+        tuple[list[XMLCompatibleComment], dict[str, int]]: 指定された日付に投稿されたコメントのリスト (投稿日時昇順) と、
+            取得元の名前ごとの指定された日付に投稿されたコメント数
+    """
+
+    start, end = get_date_bounds(target_date)
+    streams = {name: _slice_source(source, start, end) for name, source in sources.items()}
+    comments = list(_merge_streams([stream for count, stream in streams.values() if count > 0]))
+    return comments, {name: count for name, (count, _) in streams.items()}
+
+
+class UnsortedSourceError(ValueError):
+    """iter_merged_comment_sources() で変換しながらマージした取得元のコメントが、投稿日時昇順に並んでいなかったことを示す例外"""
+
+
+def iter_merged_comment_sources(
+    sources: Mapping[str, Sequence[Any] | CommentBatch],
+    target_date: date,
+    converter: Callable[[Any], XMLCompatibleComment] | None = None,
+) -> tuple[Iterator[XMLCompatibleComment], dict[str, int]]:
+    """
+    merge_comment_sources() と同様に取得元ごとのコメントをマージするが、マージしたコメントをリストにせず、投稿日時昇順に1つずつ返す
+    1日分のコメントを XMLCompatibleComment のリストとして一度に持たずに済むため、少しずつファイルに書き出す場合に使う
+    CommentBatch の取得元は列の投稿日時を直接二分探索し、範囲内のコメントだけを取り出された時点で XMLCompatibleComment に変換する
+    converter が指定された場合、CommentBatch 以外の取得元は変換前のコメントのリストとして扱い、取り出しながら1件ずつ変換する
+    取得元ごとのコメント数は、返したイテレーターを最後まで取り出した時点で確定する
+
+    Args:
+        sources (Mapping[str, Sequence[Any] | CommentBatch]): 取得元の名前ごとのコメントのリスト
+        target_date (date): 絞り込む日付
+        converter (Callable[[Any], XMLCompatibleComment] | None, default=None): 変換前のコメントを XMLCompatibleComment に変換する関数
+            (None なら CommentBatch 以外の取得元は XMLCompatibleComment のリストとして扱う)
+
+    Returns:
+        tuple[Iterator[XMLCompatibleComment], dict[str, int]]: 指定された日付に投稿されたコメントのイテレーター (投稿日時昇順) と、
+            取得元の名前ごとの指定された日付に投稿されたコメント数
+
+    Raises:
+        UnsortedSourceError: converter で変換しながらマージした取得元のコメントが、投稿日時昇順に並んでいなかった場合
+            (イテレーターから取り出す途中で送出される)
+    """
+
+    start, end = get_date_bounds(target_date)
+    source_counts = dict.fromkeys(sources, 0)
+    streams: list[Iterable[tuple[float, XMLCompatibleComment]]] = []
+    for name, source in sources.items():
+        if isinstance(source, CommentBatch) or converter is None:
+            count, stream = _slice_source(source, start, end)
+            source_counts[name] = count
+            if count > 0:
+                streams.append(stream)
+        else:
+            streams.append(_iter_converted_source(name, source, converter, start, end, source_counts))
+    return _merge_streams(streams), source_counts
+
+
+def _slice_source(
+    source: Sequence[XMLCompatibleComment] | CommentBatch,
+    start: float,
+    end: float,
+) -> tuple[int, Iterable[tuple[float, XMLCompatibleComment]]]:
+    """
+    取得元のコメントのうち、start 以上 end 未満に投稿されたコメントを (投稿日時, コメント) の並びとして投稿日時昇順で返す
+
+    Args:
+        source (Sequence[XMLCompatibleComment] | CommentBatch): 取得元のコメントのリスト
+        start (float): 範囲の開始時刻の UNIX タイムスタンプ
+        end (float): 範囲の終了時刻の UNIX タイムスタンプ
+
+    Returns:
+        tuple[int, Iterable[tuple[float, XMLCompatibleComment]]]: 範囲内に投稿されたコメントの数と、その並び
+            (CommentBatch の取得元は、取り出された時点で XMLCompatibleComment に変換するイテレーター)
+    """
+
+    if isinstance(source, CommentBatch):
+        # 投稿日時昇順に並べた上で、範囲内に投稿されたコメントだけを XMLCompatibleComment に変換する
+        ## 投稿日時のリストを作らずに、列の投稿日時をコメントのインデックスで直接二分探索する
+        batch = source.sort()
+        get_date_with_usec = batch.getDateWithUsec
+        lower = bisect_left(range(len(batch)), start, key=get_date_with_usec)
+        upper = bisect_left(range(len(batch)), end, lo=lower, key=get_date_with_usec)
+        return upper - lower, ((get_date_with_usec(index), batch.getComment(index)) for index in range(lower, upper))
+
+    entries = [(comment.date_with_usec, comment) for comment in source]
+
+    # 万が一投稿日時昇順になっていない取得元があれば、その取得元だけを安定ソートする
+    if any(entries[index][0] > entries[index + 1][0] for index in range(len(entries) - 1)):
+        entries.sort(key=itemgetter(0))
+
+    # 範囲内に投稿されたコメントを二分探索で求める
+    lower = bisect_left(entries, start, key=itemgetter(0))
+    upper = bisect_left(entries, end, lo=lower, key=itemgetter(0))
+    return upper - lower, entries[lower:upper]
+
+
+def _iter_converted_source(
+    name: str,
+    source: Sequence[Any],
+    converter: Callable[[Any], XMLCompatibleComment],
+    start: float,
+    end: float,
+    source_counts: dict[str, int],
+) -> Iterator[tuple[float, XMLCompatibleComment]]:
+    """
+    変換前のコメントを1件ずつ XMLCompatibleComment に変換し、start 以上 end 未満に投稿されたコメントを (投稿日時, コメント) として返す
+    変換したコメントを全てリストに保持しないため、取得元のコメントは投稿日時昇順に並んでいる必要がある
+
+    Args:
+        name (str): 取得元の名前
+        source (Sequence[Any]): 変換前のコメントのリスト
+        converter (Callable[[Any], XMLCompatibleComment]): 変換前のコメントを XMLCompatibleComment に変換する関数
+        start (float): 範囲の開始時刻の UNIX タイムスタンプ
+        end (float): 範囲の終了時刻の UNIX タイムスタンプ
+        source_counts (dict[str, int]): 範囲内に投稿されたコメント数を数える、取得元の名前ごとのコメント数
+
+    Yields:
+        tuple[float, XMLCompatibleComment]: 範囲内に投稿されたコメントの投稿日時とコメント
+
+    Raises:
+        UnsortedSourceError: 取得元のコメントが投稿日時昇順に並んでいなかった場合
+    """
+
+    previous_date_with_usec = -math.inf
+    for raw_comment in source:
+        comment = converter(raw_comment)
+        date_with_usec = comment.date_with_usec
+        if date_with_usec < previous_date_with_usec:
+            raise UnsortedSourceError(f'Comments of {name} are not sorted by date.')
+        previous_date_with_usec = date_with_usec
+        if start <= date_with_usec < end:
+            source_counts[name] += 1
+            yield date_with_usec, comment
+
+
+def _merge_streams(streams: list[Iterable[tuple[float, XMLCompatibleComment]]]) -> Iterator[XMLCompatibleComment]:
+    """
+    投稿日時昇順に並んだ (投稿日時, コメント) の並びを k-way マージする
+
+    Args:
+        streams (list[Iterable[tuple[float, XMLCompatibleComment]]]): 取得元ごとの (投稿日時, コメント) の並び
+
+    Returns:
+        Iterator[XMLCompatibleComment]: マージしたコメントのイテレーター (投稿日時昇順)
+    """
+
+    # 取得元が1つだけなら、マージせずにそのまま返す
+    if len(streams) == 1:
+        return (comment for _, comment in streams[0])
+    return (comment for _, comment in heapq.merge(*streams, key=itemgetter(0)))
@@ -0,0 +1,282 @@
+from __future__ import annotations
+
+import json
+import os
+import socket
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Any
+
+import anyio
+
+from jkcommentcrawler.utils import write_file_atomically
+
+
+class RunMetrics:
+    """
+    1回のクロール実行の、段階 (スレッドの検索・コメントのダウンロード・マージ・XML への変換・ファイルへの書き込みなど) ごとの
+    所要時間・バイト数・コメント数と、リトライ回数などのカウンターを記録するクラス
+    記録した内容は、JSON Lines 形式の実行ログと、Prometheus (node_exporter) の textfile collector 形式のファイルに出力できる
+    """
+
+    # Prometheus のメトリクス名の接頭辞
+    PROMETHEUS_PREFIX = 'jkcommentcrawler'
+
+    # Prometheus に出力するラベル (取得元ごとのラベルはカーディナリティが高すぎるため、JSON Lines にのみ出力する)
+    PROMETHEUS_LABELS = ('stage', 'channel')
+
+    def __init__(self) -> None:
+        """
+        RunMetrics のコンストラクタ
+        """
+
+        # 実行を識別する ID と、実行を開始した日時
+        self.started_at = time.time()
+        self.run_id = f'{time.strftime("%Y%m%d%H%M%S", time.localtime(self.started_at))}-{os.getpid()}'
+
+        # 段階ごとの計測結果のリスト (記録した順)
+        self.events: list[dict[str, Any]] = []
+
+        # (カウンター名, ラベル) ごとのカウンターの値
+        self.counters: dict[tuple[str, tuple[tuple[str, str], ...]], float] = {}
+
+    @contextmanager
+    def measure(self, stage: str, **labels: Any) -> Iterator[dict[str, Any]]:
+        """
+        with ブロック内の処理を1つの段階として、所要時間と成否を記録する
+        with ブロック内で、返された辞書の 'bytes' 'comments' に処理したバイト数・コメント数を設定できる
+
+        Args:
+            stage (str): 段階の名前 (ex: nx_download)
+            **labels (Any): 実況チャンネル ID・日付・取得元などのラベル
+
+        Yields:
+            dict[str, Any]: 記録する計測結果
+        """
+
+        event: dict[str, Any] = {
+            'type': 'stage',
+            'run_id': self.run_id,
+            'stage': stage,
+            **{key: str(value) for key, value in labels.items()},
+            'started_at': time.time(),
+            'duration': 0.0,
+            'bytes': 0,
+            'comments': 0,
+            'status': 'ok',
+        }
+        start = time.perf_counter()
+        try:
+            yield event
+        except BaseException:
+            event['status'] = 'error'
+            raise
+        finally:
+            event['duration'] = time.perf_counter() - start
+            self.events.append(event)
+
+    def record(self, stage: str, duration: float, byte_count: int = 0, comment_count: int = 0, **labels: Any) -> None:
+        """
+        別のプロセスで計測した段階の所要時間を、measure() と同じ形式で記録する
+
+        Args:
+            stage (str): 段階の名前 (ex: serialize)
+            duration (float): 所要時間 (秒)
+            byte_count (int, default=0): 処理したバイト数
+            comment_count (int, default=0): 処理したコメント数
+            **labels (Any): 実況チャンネル ID・日付・取得元などのラベル
+        """
+
+        self.events.append(
+            {
+                'type': 'stage',
+                'run_id': self.run_id,
+                'stage': stage,
+                **{key: str(value) for key, value in labels.items()},
+                'started_at': time.time() - duration,
+                'duration': duration,
+                'bytes': byte_count,
+                'comments': comment_count,
+                'status': 'ok',
+            }
+        )
+
+    def increment(self, name: str, value: float = 1, **labels: Any) -> None:
+        """
+        カウンターの値を増やす
+
+        Args:
+            name (str): カウンター名 (ex: retries)
+            value (float, default=1): 増やす値
+            **labels (Any): 実況チャンネル ID などのラベル
+        """
+
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels: Any) -> None:
+        """
+        カウンターの値を設定する (HTTP コネクションプールの統計など、実行の最後にまとめて集計した値を記録するために使う)
+
+        Args:
+            name (str): カウンター名
+            value (float): 設定する値
+            **labels (Any): ラベル
+        """
+
+        key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+        self.counters[key] = value
+
+    def getSummary(self) -> dict[str, Any]:
+        """
+        実行全体の概要を返す (JSON Lines の最後の行に出力する)
+
+        Returns:
+            dict[str, Any]: 実行全体の所要時間・段階ごとの合計・カウンターの値
+        """
+
+        stages: dict[str, dict[str, Any]] = {}
+        for event in self.events:
+            stage = stages.setdefault(
+                event['stage'], {'count': 0, 'errors': 0, 'duration': 0.0, 'bytes': 0, 'comments': 0}
+            )
+            stage['count'] += 1
+            stage['errors'] += 1 if event['status'] != 'ok' else 0
+            stage['duration'] += event['duration']
+            stage['bytes'] += event['bytes']
+            stage['comments'] += event['comments']
+
+        finished_at = time.time()
+        return {
+            'type': 'run',
+            'run_id': self.run_id,
+            'hostname': socket.gethostname(),
+            'started_at': self.started_at,
+            'finished_at': finished_at,
+            'duration': finished_at - self.started_at,
+            'stages': stages,
+            'counters': [
+                {'name': name, **dict(labels), 'value': value} for (name, labels), value in self.counters.items()
+            ],
+        }
+
+    async def writeJSONLines(self, path: anyio.Path) -> None:
+        """
+        段階ごとの計測結果と実行全体の概要を、JSON Lines 形式で実行ログに追記する
+        実行ログは実行ごとに上書きせず追記するため、過去の実行と比較できる
+
+        Args:
+            path (anyio.Path): 実行ログのパス
+        """
+
+        lines = [json.dumps(event, ensure_ascii=False) for event in self.events]
+        lines.append(json.dumps(self.getSummary(), ensure_ascii=False))
+        await path.parent.mkdir(parents=True, exist_ok=True)
+        async with await path.open('a', encoding='utf-8') as f:
+            await f.write(''.join(f'{line}\n' for line in lines))
+
+    async def writePrometheus(self, path: anyio.Path) -> None:
+        """
+        段階ごとの計測結果を実況チャンネルごとに集計し、Prometheus の textfile collector 形式のファイルにアトミックに書き込む
+        ファイルは実行ごとに置き換えるため、全てのメトリクスは直近の実行の値を示す gauge として出力する
+        textfile collector が書き込み途中のファイルを読み込まないよう、一時ファイルに書き込んでからリネームする
+
+        Args:
+            path (anyio.Path): 出力するファイルのパス (拡張子は .prom にする)
+        """
+
+        prefix = self.PROMETHEUS_PREFIX
+
+        # 段階・実況チャンネルごとに集計する
+        aggregated: dict[tuple[tuple[str, str], ...], dict[str, float]] = {}
+        for event in self.events:
+            labels = tuple((label, event[label]) for label in self.PROMETHEUS_LABELS if label in event)
+            values = aggregated.setdefault(
+                labels, {'duration': 0.0, 'count': 0, 'errors': 0, 'bytes': 0, 'comments': 0}
+            )
+            values['duration'] += event['duration']
+            values['count'] += 1
+            values['errors'] += 1 if event['status'] != 'ok' else 0
+            values['bytes'] += event['bytes']
+            values['comments'] += event['comments']
+
+        metrics: list[tuple[str, str, str, list[tuple[tuple[tuple[str, str], ...], float]]]] = [
+            (
+                f'{prefix}_stage_duration_seconds',
+                'gauge',
+                'Total time spent in each stage of the last run.',
+                [(labels, values['duration']) for labels, values in aggregated.items()],
+            ),
+            (
+                f'{prefix}_stage_runs',
+                'gauge',
+                'Number of times each stage ran in the last run.',
+                [(labels, values['count']) for labels, values in aggregated.items()],
+            ),
+            (
+                f'{prefix}_stage_errors',
+                'gauge',
+                'Number of times each stage failed in the last run.',
+                [(labels, values['errors']) for labels, values in aggregated.items()],
+            ),
+            (
+                f'{prefix}_stage_bytes',
+                'gauge',
+                'Bytes processed by each stage in the last run.',
+                [(labels, values['bytes']) for labels, values in aggregated.items()],
+            ),
+            (
+                f'{prefix}_stage_comments',
+                'gauge',
+                'Comments processed by each stage in the last run.',
+                [(labels, values['comments']) for labels, values in aggregated.items()],
+            ),
+        ]
+
+        # カウンターはカウンター名ごとに1つのメトリクスにまとめる
+        counters: dict[str, list[tuple[tuple[tuple[str, str], ...], float]]] = {}
+        for (name, labels), value in self.counters.items():
+            counters.setdefault(name, []).append((labels, value))
+        for name, samples in sorted(counters.items()):
+            metrics.append((f'{prefix}_{name}', 'gauge', f'Value of {name} in the last run.', samples))
+
+        finished_at = time.time()
+        metrics.append(
+            (f'{prefix}_run_start_timestamp_seconds', 'gauge', 'Start time of the last run.', [((), self.started_at)])
+        )
+        metrics.append(
+            (
+                f'{prefix}_run_duration_seconds',
+                'gauge',
+                'Duration of the last run.',
+                [((), finished_at - self.started_at)],
+            )
+        )
+
+        lines: list[str] = []
+        for name, metric_type, help_text, samples in metrics:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for labels, value in sorted(samples):
+                label_text = ','.join(
+                    f'{label}="{self._escapeLabelValue(label_value)}"' for label, label_value in labels
+                )
+                lines.append(f'{name}{{{label_text}}} {value}' if label_text != '' else f'{name} {value}')
+
+        await path.parent.mkdir(parents=True, exist_ok=True)
+        await write_file_atomically(path, ''.join(f'{line}\n' for line in lines).encode('utf-8'))
+
+    @staticmethod
+    def _escapeLabelValue(value: str) -> str:
+        """
+        Prometheus のラベルの値をエスケープする
+
+        Args:
+            value (str): ラベルの値
+
+        Returns:
+            str: エスケープしたラベルの値
+        """
+
+        return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
@@ -0,0 +1,384 @@
+from __future__ import annotations
+
+import bisect
+import os
+import re
+import struct
+from array import array
+from collections.abc import AsyncIterator, Iterator
+from datetime import date
+
+import anyio
+
+from jkcommentcrawler.merge import get_date_bounds
+from jkcommentcrawler.utils import write_file_atomically
+
+
+async def append_xml_content(nicojk_path: anyio.Path, xml_content: bytes) -> int:
+    """
+    既存の .nicojk ファイルを書き換えずに、NDGRClient.convertToXMLString() で変換した XML 文字列 (UTF-8) を末尾に追記する
+    追記後のファイルが、全コメントを一度に変換した場合と同じ内容になるよう、必要に応じて <chat> 要素の間に改行を補う
+    追記した内容は fsync してから戻るため、戻った時点でチェックポイントに追記後のサイズを記録してよい
+    追記の途中で強制終了した場合は、次回追記する前に truncate_xml_content() でチェックポイントのサイズまで切り詰める
+
+    Args:
+        nicojk_path (anyio.Path): 追記する .nicojk ファイルのパス
+        xml_content (bytes): 追記する XML 文字列を UTF-8 でエンコードしたバイト列
+
+    Returns:
+        int: 追記後のファイルのサイズ (バイト)
+    """
+
+    def append() -> int:
+        with open(nicojk_path, 'ab+') as f:
+            file_size = f.seek(0, os.SEEK_END)
+            separator = b''
+            if file_size > 0 and len(xml_content) > 0:
+                f.seek(file_size - 1)
+                if f.read(1) != b'\n':
+                    separator = b'\n'
+            # 追記モードで開いているため、読み込んだ位置によらず末尾に書き込まれる
+            content = separator + xml_content
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        return file_size + len(content)
+
+    return await anyio.to_thread.run_sync(append)
+
+
+async def truncate_xml_content(nicojk_path: anyio.Path, file_size: int) -> bool:
+    """
+    追記の途中で強制終了した .nicojk ファイルを、最後に追記を終えた時点 (チェックポイントに記録したサイズ) まで切り詰める
+    .nicojk ファイルへの追記以外の書き込みはファイル全体をアトミックに置き換えるため、チェックポイントより後ろは追記途中の内容になる
+
+    Args:
+        nicojk_path (anyio.Path): 切り詰める .nicojk ファイルのパス
+        file_size (int): 最後に追記を終えた時点のファイルのサイズ (バイト)
+
+    Returns:
+        bool: 切り詰めたなら True (ファイルがそのサイズ以下なら何もせずに False)
+    """
+
+    def truncate() -> bool:
+        with open(nicojk_path, 'rb+') as f:
+            if f.seek(0, os.SEEK_END) <= file_size:
+                return False
+            f.truncate(file_size)
+            f.flush()
+            os.fsync(f.fileno())
+        return True
+
+    return await anyio.to_thread.run_sync(truncate)
+
+
+# <chat> 要素の開始タグと、その投稿日時 (date・date_usec 属性)
+## 属性値・本文中の < > は実体参照にエスケープされているため、<chat  が現れるのは要素の先頭だけになる
+CHAT_START_TAG_PATTERN = re.compile(rb'<chat [^>]*?\bdate="(\d+)"(?:[^>]*?\bdate_usec="(\d+)")?')
+
+
+def iter_chat_dates(data: bytes) -> Iterator[tuple[int, float]]:
+    """
+    .nicojk ファイルの内容 (またはその一部) に含まれる <chat> 要素の開始位置と投稿日時を、出現順に返す
+
+    Args:
+        data (bytes): .nicojk ファイルの内容 (<chat> 要素の途中で区切られていないこと)
+
+    Yields:
+        tuple[int, float]: <chat> 要素の開始位置 (data の先頭からのバイト数) と、投稿日時の UNIX タイムスタンプ (マイクロ秒まで)
+    """
+
+    for match in CHAT_START_TAG_PATTERN.finditer(data):
+        date_usec = match.group(2)
+        yield match.start(), int(match.group(1)) + (int(date_usec) / 1000000 if date_usec is not None else 0)
+
+
+class NicojkIndex:
+    """
+    .nicojk ファイルと同じフォルダに保存する、1分ごとの <chat> 要素の位置の索引 (.nicojk.idx)
+    日付の 00:00 から1分ごとに、その時刻以降に投稿された最初のコメントのバイト位置と、何番目のコメントか (0 始まり) を記録する
+    これを使うと、1日分の過去ログ全体を読み込まずに、指定した時間帯のコメントだけを読み込める
+
+    ファイルのフォーマット (リトルエンディアン):
+        ヘッダー: マジックナンバー (b'NJKI')・バージョン (uint16)・予約 (uint16)・日付の開始時刻の UNIX タイムスタンプ (int64)・
+            分の数 (uint32)・コメント数 (uint32)・索引を作成した時点の .nicojk ファイルのサイズ (uint64)
+        エントリ: 分の数 + 1 個の、バイト位置 (uint64)・何番目のコメントか (uint32)
+            (i 番目のエントリは i 分目以降の最初のコメントを指し、以降にコメントがなければファイルの末尾を指す)
+    ヘッダーのファイルサイズが実際の .nicojk ファイルのサイズと一致しない場合は、索引が古くなっているとみなす
+    """
+
+    MAGIC = b'NJKI'
+
+    # 索引ファイルのフォーマットのバージョン
+    VERSION = 1
+
+    HEADER = struct.Struct('<4sHHqIIQ')
+    ENTRY = struct.Struct('<QI')
+
+    def __init__(self, day_start: int, minutes: int, offsets: array[int], indices: array[int], file_size: int) -> None:
+        """
+        NicojkIndex のコンストラクタ
+
+        Args:
+            day_start (int): 日付の開始時刻 (ローカルタイムゾーンの 00:00) の UNIX タイムスタンプ
+            minutes (int): 日付の分の数 (通常は 1440)
+            offsets (array[int]): 分ごとの、その時刻以降に投稿された最初のコメントのバイト位置 (minutes + 1 個)
+            indices (array[int]): 分ごとの、その時刻以降に投稿された最初のコメントが何番目のコメントか (minutes + 1 個)
+            file_size (int): 索引を作成した時点の .nicojk ファイルのサイズ (バイト)
+        """
+
+        self.day_start = day_start
+        self.minutes = minutes
+        self.offsets = offsets
+        self.indices = indices
+        self.file_size = file_size
+
+    @property
+    def comment_count(self) -> int:
+        """索引を作成した時点の .nicojk ファイルに含まれるコメント数"""
+
+        return self.indices[self.minutes]
+
+    @staticmethod
+    def getIndexPath(nicojk_path: anyio.Path) -> anyio.Path:
+        """
+        .nicojk ファイルの索引ファイルのパスを返す
+
+        Args:
+            nicojk_path (anyio.Path): .nicojk ファイルのパス
+
+        Returns:
+            anyio.Path: 索引ファイルのパス ({nicojk_path}.idx)
+        """
+
+        return nicojk_path.with_name(f'{nicojk_path.name}.idx')
+
+    @classmethod
+    def build(cls, target_date: date, data: bytes) -> NicojkIndex:
+        """
+        .nicojk ファイルの内容全体から索引を作成する
+
+        Args:
+            target_date (date): .nicojk ファイルの日付
+            data (bytes): .nicojk ファイルの内容
+
+        Returns:
+            NicojkIndex: 作成した索引
+        """
+
+        day_start, day_end = get_date_bounds(target_date)
+        minutes = int(day_end - day_start) // 60
+        index = cls(int(day_start), minutes, array('Q', [0] * (minutes + 1)), array('I', [0] * (minutes + 1)), 0)
+        index._fill(0, data, 0, 0)
+        return index
+
+    def extend(self, data: bytes, offset: int) -> None:
+        """
+        .nicojk ファイルの末尾に追記した内容を索引に反映する
+        追記したコメントは、全て既存のコメントより後に投稿されている必要がある
+
+        Args:
+            data (bytes): 追記した内容 (区切りの改行を含んでいてもよい)
+            offset (int): 追記した内容の、ファイルの先頭からのバイト位置
+        """
+
+        # 既存のコメントより後の時刻の分は、全てファイルの末尾を指しているため、そこから埋め直す
+        minute = bisect.bisect_left(self.offsets, self.file_size)
+        self._fill(minute, data, offset, self.comment_count)
+
+    def getByteRange(self, start: float, end: float) -> tuple[int, int]:
+        """
+        指定された時間帯に投稿されたコメントを全て含む、.nicojk ファイルのバイト範囲を返す
+        範囲は分単位で切り上げ・切り捨てるため、前後の時間帯のコメントを含むことがある
+
+        Args:
+            start (float): 時間帯の開始時刻の UNIX タイムスタンプ
+            end (float): 時間帯の終了時刻の UNIX タイムスタンプ (この時刻ちょうどに投稿されたコメントは含まない)
+
+        Returns:
+            tuple[int, int]: バイト範囲の開始位置と終了位置 (終了位置のバイトは含まない)
+        """
+
+        first_minute = min(max(int((start - self.day_start) // 60), 0), self.minutes)
+        last_minute = min(max(-int((self.day_start - end) // 60), 0), self.minutes)
+        return self.offsets[first_minute], max(self.offsets[last_minute], self.offsets[first_minute])
+
+    def toBytes(self) -> bytes:
+        """
+        索引をファイルに保存する形式のバイト列に変換する
+
+        Returns:
+            bytes: 索引ファイルの内容
+        """
+
+        header = self.HEADER.pack(
+            self.MAGIC, self.VERSION, 0, self.day_start, self.minutes, self.comment_count, self.file_size
+        )
+        return header + b''.join(
+            self.ENTRY.pack(offset, comment_index)
+            for offset, comment_index in zip(self.offsets, self.indices, strict=True)
+        )
+
+    @classmethod
+    def fromBytes(cls, data: bytes) -> NicojkIndex | None:
+        """
+        索引ファイルの内容から索引を読み込む
+
+        Args:
+            data (bytes): 索引ファイルの内容
+
+        Returns:
+            NicojkIndex | None: 読み込んだ索引 (フォーマットが異なるか壊れている場合は None)
+        """
+
+        if len(data) < cls.HEADER.size:
+            return None
+        magic, version, _, day_start, minutes, comment_count, file_size = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            return None
+        if len(data) != cls.HEADER.size + cls.ENTRY.size * (minutes + 1):
+            return None
+        offsets: array[int] = array('Q')
+        indices: array[int] = array('I')
+        for offset, comment_index in cls.ENTRY.iter_unpack(data[cls.HEADER.size :]):
+            offsets.append(offset)
+            indices.append(comment_index)
+        if indices[minutes] != comment_count:
+            return None
+        return cls(day_start, minutes, offsets, indices, file_size)
+
+    @classmethod
+    async def load(cls, index_path: anyio.Path) -> NicojkIndex | None:
+        """
+        索引ファイルを読み込む
+
+        Args:
+            index_path (anyio.Path): 索引ファイルのパス
+
+        Returns:
+            NicojkIndex | None: 読み込んだ索引 (存在しないか壊れている場合は None)
+        """
+
+        try:
+            return cls.fromBytes(await index_path.read_bytes())
+        except FileNotFoundError:
+            return None
+
+    @classmethod
+    async def readFileSize(cls, index_path: anyio.Path) -> int | None:
+        """
+        索引ファイルのヘッダーだけを読み込み、索引を作成した時点の .nicojk ファイルのサイズを返す
+        索引を読み込まずに、索引が .nicojk ファイルと対応しているかを確かめるために使う
+
+        Args:
+            index_path (anyio.Path): 索引ファイルのパス
+
+        Returns:
+            int | None: 索引を作成した時点の .nicojk ファイルのサイズ (存在しないか壊れている場合は None)
+        """
+
+        try:
+            async with await index_path.open('rb') as f:
+                header = await f.read(cls.HEADER.size)
+        except FileNotFoundError:
+            return None
+        if len(header) < cls.HEADER.size:
+            return None
+        magic, version, _, _, _, _, file_size = cls.HEADER.unpack(header)
+        if magic != cls.MAGIC or version != cls.VERSION:
+            return None
+        return file_size
+
+    async def save(self, index_path: anyio.Path) -> None:
+        """
+        索引ファイルをアトミックに保存する
+
+        Args:
+            index_path (anyio.Path): 索引ファイルのパス
+        """
+
+        await write_file_atomically(index_path, self.toBytes())
+
+    def _fill(self, minute: int, data: bytes, offset: int, comment_index: int) -> None:
+        """
+        指定された分以降のエントリを、data に含まれるコメントで埋める
+
+        Args:
+            minute (int): 埋め始める分
+            data (bytes): 指定された分以降に投稿されたコメントを含む .nicojk ファイルの末尾の内容
+            offset (int): data の、ファイルの先頭からのバイト位置
+            comment_index (int): data の最初のコメントが何番目のコメントか
+        """
+
+        for chat_offset, chat_date in iter_chat_dates(data):
+            # このコメントの投稿時刻以前に始まる分のうち、まだ埋まっていない分は全てこのコメントを指す
+            while minute <= self.minutes and self.day_start + minute * 60 <= chat_date:
+                self.offsets[minute] = offset + chat_offset
+                self.indices[minute] = comment_index
+                minute += 1
+            comment_index += 1
+        self.file_size = offset + len(data)
+        for remaining_minute in range(minute, self.minutes + 1):
+            self.offsets[remaining_minute] = self.file_size
+            self.indices[remaining_minute] = comment_index
+
+
+async def read_chat_elements(
+    nicojk_path: anyio.Path,
+    target_date: date,
+    start: float,
+    end: float,
+    chunk_size: int = 64 * 1024,
+) -> AsyncIterator[str]:
+    """
+    .nicojk ファイルから、指定された時間帯に投稿されたコメントの <chat> 要素だけを、ファイル全体を読み込まずに順に返す
+    索引ファイル (.nicojk.idx) で時間帯のバイト範囲にシークし、その範囲だけを少しずつ読み込む
+    索引ファイルがないか .nicojk ファイルと対応していない場合は、ファイル全体からメモリ上で索引を作成して使う
+
+    Args:
+        nicojk_path (anyio.Path): .nicojk ファイルのパス
+        target_date (date): .nicojk ファイルの日付 (索引ファイルを使えない場合に索引を作成するために使う)
+        start (float): 時間帯の開始時刻の UNIX タイムスタンプ
+        end (float): 時間帯の終了時刻の UNIX タイムスタンプ (この時刻ちょうどに投稿されたコメントは含まない)
+        chunk_size (int, default=64KiB): 一度に読み込むバイト数
+
+    Yields:
+        str: 時間帯に投稿されたコメントの <chat> 要素 (投稿日時昇順)
+    """
+
+    file_size = (await nicojk_path.stat()).st_size
+    index = await NicojkIndex.load(NicojkIndex.getIndexPath(nicojk_path))
+    if index is None or index.file_size != file_size:
+        index = NicojkIndex.build(target_date, await nicojk_path.read_bytes())
+    start_offset, end_offset = index.getByteRange(start, end)
+
+    def split(data: bytes) -> Iterator[str]:
+        # <chat> 要素は改行区切りで並んでいるが、本文にも改行が含まれうるため、次の要素の開始タグの手前で区切る
+        for element_offset, element in enumerate(data.split(b'\n<chat ')):
+            if element_offset > 0:
+                element = b'<chat ' + element
+            element = element.rstrip(b'\n')
+            for _, chat_date in iter_chat_dates(element):
+                if start <= chat_date < end:
+                    yield element.decode('utf-8')
+
+    buffer = b''
+    async with await nicojk_path.open('rb') as f:
+        await f.seek(start_offset)
+        remaining = end_offset - start_offset
+        while remaining > 0:
+            chunk = await f.read(min(chunk_size, remaining))
+            if len(chunk) == 0:
+                break
+            remaining -= len(chunk)
+            buffer += chunk
+            # 最後の要素は途中で区切られている可能性があるため、次の読み込みまで残しておく
+            cut = buffer.rfind(b'\n<chat ')
+            if cut <= 0:
+                continue
+            for element in split(buffer[:cut]):
+                yield element
+            buffer = buffer[cut + 1 :]
+    if len(buffer) > 0:
+        for element in split(buffer):
+            yield element
@@ -1,13 +1,17 @@
 from __future__ import annotations
 
+import asyncio
 import io
+import json
 import warnings
+from collections.abc import AsyncIterator
+from contextlib import nullcontext
 from datetime import date, datetime
 from pathlib import Path
 from typing import Any, Literal
 
 import anyio
-import curl_cffi.requests as requests
+import websockets
 from ndgr_client import XMLCompatibleComment
 from pydantic import BaseModel, TypeAdapter
 from rich import print
@@ -15,6 +19,13 @@ from rich.rule import Rule
 from rich.style import Style
 
 from jkcommentcrawler import __version__
+from jkcommentcrawler.comment_batch import CommentBatch
+from jkcommentcrawler.comment_cache import CommentCache
+from jkcommentcrawler.http_pool import HTTPConnectionPool
+from jkcommentcrawler.json_stream import StreamingJSONObjectDecoder
+from jkcommentcrawler.log_sink import BufferedLogSink
+from jkcommentcrawler.retry import RetryPolicy, is_retryable
+from jkcommentcrawler.thread_index import ThreadIndex
 
 
 class NXClient:
@@ -29,6 +40,12 @@ class NXClient:
     # NX-Jikkyo 通信時の User-Agent
     USER_AGENT = f'JKCommentCrawler/{__version__}'
 
+    # NX-Jikkyo API のベース URL
+    API_BASE_URL = 'https://nx-jikkyo.tsukumijima.net/api/v1'
+
+    # コメントサーバーに購読の開始を要求してから、応答を待つ時間 (秒)
+    COMMENT_SERVER_SUBSCRIBE_TIMEOUT = 30.0
+
     # NX-Jikkyo で運用されているニコニコ実況チャンネル ID のリスト (2024/08/15 時点)
     JIKKYO_CHANNEL_ID_LIST: list[str] = [
         'jk1',
@@ -73,6 +90,8 @@ class NXClient:
         verbose: bool = False,
         console_output: bool = False,
         log_path: Path | anyio.Path | None = None,
+        http_pool: HTTPConnectionPool | None = None,
+        comment_cache: CommentCache | None = None,
     ) -> None:
         """
         NXClient のコンストラクタ
@@ -82,6 +101,8 @@ class NXClient:
             verbose (bool, default=False): 詳細な動作ログを出力するかどうか
             console_output (bool, default=False): 動作ログをコンソールに出力するかどうか
             log_path (Path | anyio.Path | None, default=None): 動作ログをファイルに出力する場合のパス (show_log と併用可能)
+            http_pool (HTTPConnectionPool | None, default=None): 共有する HTTP コネクションプール (指定されない場合はインスタンスごとに作成する)
+            comment_cache (CommentCache | None, default=None): 放送が終了したスレッドのコメントを保存するキャッシュ (指定されない場合は毎回ダウンロードする)
         """
 
         self.thread_id = thread_id
@@ -90,8 +111,30 @@ class NXClient:
         # pathlib.Path が渡された場合は anyio.Path に変換して保持する
         self.log_path: anyio.Path | None = anyio.Path(log_path) if isinstance(log_path, Path) else log_path
 
-        # curl-cffi の非同期 HTTP クライアントのインスタンスを作成
-        self.http_client = requests.AsyncSession(headers={'User-Agent': self.USER_AGENT})
+        # ログファイルのパスが指定されている場合は、ファイルを開いたまま書き込みをまとめるバッファ付きのシンクを使う
+        self.log_sink: BufferedLogSink | None = BufferedLogSink(self.log_path) if self.log_path is not None else None
+
+        # HTTP コネクションプールが渡された場合はそれを使い回し、渡されなかった場合はこのインスタンス専用のものを作成する
+        ## 渡されたコネクションプールは呼び出し元が所有しているため、close() では解放しない
+        self._owns_http_pool = http_pool is None
+        self.http_pool = http_pool if http_pool is not None else HTTPConnectionPool(user_agent=self.USER_AGENT)
+
+        # 放送が終了したスレッドのコメントを保存するキャッシュ
+        self.comment_cache = comment_cache
+
+        # スレッド取得 API から受信したレスポンスボディのバイト数と、コメントをキャッシュから読み込んだかどうか
+        ## 実行ごとのメトリクスの記録に使う
+        self.received_bytes: int = 0
+        self.loaded_from_cache: bool = False
+
+        # 最後にダウンロードしたスレッドのステータスと放送終了日時
+        ## ACTIVE なスレッドのコメントを WebSocket で受信し続けるかどうか、いつまで受信するかの判断に使う
+        self.thread_status: Literal['ACTIVE', 'UPCOMING', 'PAST'] | None = None
+        self.thread_end_at: datetime | None = None
+
+        # 最後にダウンロードしたスレッドのタイトルと放送開始日時 (放送が終了したスレッドをコメントキャッシュに保存する際に使う)
+        self.thread_title: str | None = None
+        self.thread_start_at: datetime | None = None
 
         # close() が呼び出されたかどうかを追跡するフラグ
         ## 複数回 close() が呼び出されても安全に動作するようにするために使用する
@@ -122,13 +165,23 @@ class NXClient:
         await self.close()
 
     @classmethod
-    async def getThreadIDsOnDate(cls, jikkyo_channel_id: str, date: date) -> list[int]:
+    async def getThreadIDsOnDate(
+        cls,
+        jikkyo_channel_id: str,
+        date: date,
+        http_pool: HTTPConnectionPool | None = None,
+        thread_index_dir: anyio.Path | None = None,
+    ) -> list[int]:
         """
         指定した日付に少なくとも一部が放送されている/放送された NX-Jikkyo スレッドの ID を取得する
+        thread_index_dir が指定された場合は、ディスクに保存したスレッドインデックスから検索し、
+        インデックスだけでは判断できない場合に限りスレッド一覧を取得し直す
 
         Args:
             jikkyo_channel_id (str): ニコニコ実況互換のチャンネル ID
             date (date): NX-Jikkyo のスレッド (通常毎日 04:00 ~ 翌日 04:00) を取得する日付
+            http_pool (HTTPConnectionPool | None, default=None): 共有する HTTP コネクションプール (指定されない場合は使い捨てのものを作成する)
+            thread_index_dir (anyio.Path | None, default=None): スレッドインデックスを保存するフォルダのパス (指定されない場合は毎回スレッド一覧を取得する)
 
         Returns:
             list[int]: 指定した日付に少なくとも一部が放送されている/放送された NX-Jikkyo スレッドの ID のリスト (放送開始日時昇順)
@@ -138,39 +191,72 @@ class NXClient:
             curl_cffi.requests.exceptions.HTTPError: NX-Jikkyo API へのリクエストに失敗した場合
         """
 
+        thread_ids = await cls.getThreadIDsOnDates(
+            jikkyo_channel_id, [date], http_pool=http_pool, thread_index_dir=thread_index_dir
+        )
+        return thread_ids[date]
+
+    @classmethod
+    async def getThreadIDsOnDates(
+        cls,
+        jikkyo_channel_id: str,
+        dates: list[date],
+        http_pool: HTTPConnectionPool | None = None,
+        thread_index_dir: anyio.Path | None = None,
+    ) -> dict[date, list[int]]:
+        """
+        指定した複数の日付それぞれに少なくとも一部が放送されている/放送された NX-Jikkyo スレッドの ID を取得する
+        スレッドインデックスの読み込みとスレッド一覧の再取得は、日付の数によらず最大1回しか行わない
+
+        Args:
+            jikkyo_channel_id (str): ニコニコ実況互換のチャンネル ID
+            dates (list[date]): NX-Jikkyo のスレッド (通常毎日 04:00 ~ 翌日 04:00) を取得する日付のリスト
+            http_pool (HTTPConnectionPool | None, default=None): 共有する HTTP コネクションプール (指定されない場合は使い捨てのものを作成する)
+            thread_index_dir (anyio.Path | None, default=None): スレッドインデックスを保存するフォルダのパス (指定されない場合は毎回スレッド一覧を取得する)
+
+        Returns:
+            dict[date, list[int]]: 日付ごとの、少なくとも一部が放送されている/放送された NX-Jikkyo スレッドの ID のリスト (放送開始日時昇順)
+
+        Raises:
+            ValueError: ニコニコ実況互換のチャンネル ID が指定されていない場合
+            curl_cffi.requests.exceptions.HTTPError: NX-Jikkyo API へのリクエストに失敗した場合
+        """
+
         if jikkyo_channel_id.startswith('jk') is False:
             raise ValueError(f'Invalid jikkyo_channel_id: {jikkyo_channel_id}')
 
-        class ThreadInfo(BaseModel):
-            id: int
-            start_at: datetime
-            end_at: datetime
-            title: str
-            description: str
-            status: str
+        # スレッドインデックスを読み込む
+        ## thread_index_dir が指定されていない場合は、ディスクに保存しない空のインデックスを使う
+        if thread_index_dir is None:
+            thread_index = ThreadIndex(jikkyo_channel_id)
+        else:
+            thread_index = await ThreadIndex.load(jikkyo_channel_id, thread_index_dir)
 
-        # クラスメソッドから self.http_client にはアクセスできないため、新しい AsyncSession を作成している
-        async with requests.AsyncSession(headers={'User-Agent': cls.USER_AGENT}) as client:
+        # インデックスだけではいずれかの日付のスレッドを特定できない場合のみ、スレッド一覧を取得し直す
+        ## スレッド一覧には過去全スレッドが含まれるため、1回取得し直せば全ての日付のスレッドを特定できる
+        if any(thread_index.isFresh(date) is False for date in dates):
             # スレッド情報取得 API にリクエスト
             ## 実況チャンネル ID に紐づく過去全スレッドの情報を取得できる
             ## 割と重いのでタイムアウトを 30 秒まで余裕を持って設定している
-            response = await client.get(
-                f'https://nx-jikkyo.tsukumijima.net/api/v1/channels/{jikkyo_channel_id}/threads',
-                timeout=30,
-            )
-            response.raise_for_status()
-            threads = TypeAdapter(list[ThreadInfo]).validate_json(response.content or b'')
+            ## HTTP コネクションプールが渡されなかった場合は、使い捨てのコネクションプールを作成する
+            async with (
+                HTTPConnectionPool(user_agent=cls.USER_AGENT) if http_pool is None else nullcontext(http_pool) as pool
+            ):
+                response = await pool.get(f'{cls.API_BASE_URL}/channels/{jikkyo_channel_id}/threads', timeout=30)
+                response.raise_for_status()
 
-        # 指定された日付に放送されているスレッドをフィルタリングし、その ID をリストで返す
-        threads = [thread for thread in threads if thread.start_at.date() <= date <= thread.end_at.date()]
+            # インデックスに既にある放送終了済みのスレッドは検証を省き、新しいスレッドと ACTIVE / UPCOMING のスレッドだけを更新する
+            thread_index.update(json.loads(response.content or b'[]'))
+            await thread_index.save()
 
-        # ID を放送開始日時が早い順に並べ替えてから返す
-        threads.sort(key=lambda x: x.start_at)
-        return [thread.id for thread in threads]
+        # 各日付に放送されているスレッドを放送区間の二分探索で検索し、その ID を放送開始日時が早い順に返す
+        return {date: [thread.id for thread in thread_index.search(date)] for date in dates}
 
     async def downloadBackwardComments(self, ignore_nicolive_comments: bool = True) -> list[XMLCompatibleComment]:
         """
         NX-Jikkyo メッセージサーバーから過去に投稿されたコメントを遡ってダウンロードする
+        コメントキャッシュが指定されている場合、放送が終了したスレッドのコメントはキャッシュから読み込む
+        downloadBackwardCommentBatch() で取得したコメントを XMLCompatibleComment のリストに変換する薄いラッパー
 
         Args:
             ignore_nicolive_comments (bool, default=True): ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外するかどうか
@@ -183,19 +269,107 @@ class NXClient:
             AssertionError: 解析に失敗した場合
         """
 
-        class CommentResponse(BaseModel):
-            id: int
-            thread_id: int
-            no: int
-            vpos: int
-            date: datetime
-            mail: str
-            user_id: str
-            premium: bool
-            anonymity: bool
-            content: str
-
-        class ThreadResponse(BaseModel):
+        return (await self.downloadBackwardCommentBatch(ignore_nicolive_comments)).toComments()
+
+    async def downloadBackwardCommentBatch(self, ignore_nicolive_comments: bool = True) -> CommentBatch:
+        """
+        NX-Jikkyo メッセージサーバーから過去に投稿されたコメントを遡ってダウンロードし、1つの CommentBatch にまとめて返す
+        XMLCompatibleComment をコメントごとに作成しないため、コメントを大量に保持する場合のメモリ使用量と CPU 負荷を抑えられる
+        コメントキャッシュが指定されている場合、放送が終了したスレッドのコメントはまとめたコメントをそのままキャッシュに保存する
+
+        Args:
+            ignore_nicolive_comments (bool, default=True): ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外するかどうか
+
+        Returns:
+            CommentBatch: 過去に投稿されたコメントの集合 (投稿日時昇順)
+
+        Raises:
+            curl_cffi.requests.exceptions.HTTPError: HTTP リクエストが失敗した場合
+            AssertionError: 解析に失敗した場合
+        """
+
+        # コメントキャッシュに保存する場合は、ニコニコ実況由来のコメントも含めて1つにまとめる
+        ## キャッシュに保存するコメントと返すコメントを別々にまとめると、1スレッド分のコメントを二重に保持することになるため
+        keep_nicolive_comments = self.comment_cache is not None and ignore_nicolive_comments is True
+        comments = CommentBatch()
+        async for batch in self.iterBackwardCommentBatches(
+            ignore_nicolive_comments, keep_nicolive_comments=keep_nicolive_comments
+        ):
+            comments.extend(batch)
+
+        # 基本投稿日時昇順で返されるはずだが、念のためここでもソートする
+        ## 既に投稿日時昇順になっていれば並び替えずにそのまま返す
+        comments = comments.sort()
+
+        # 放送が終了したスレッドのコメントは二度と変化しないため、まとめたコメントをそのままキャッシュに保存する
+        if (
+            self.comment_cache is not None
+            and self.loaded_from_cache is False
+            and self.thread_status == 'PAST'
+            and self.thread_title is not None
+            and self.thread_start_at is not None
+            and self.thread_end_at is not None
+        ):
+            await self.comment_cache.put(
+                self.thread_id,
+                self.thread_title,
+                self.thread_status,
+                self.thread_start_at,
+                self.thread_end_at,
+                comments,
+            )
+
+        # キャッシュに保存した後で、ニコニコ実況由来のコメントを除外する
+        if keep_nicolive_comments is True:
+            return comments.excludeNicoliveComments()
+        return comments
+
+    async def iterBackwardComments(self, ignore_nicolive_comments: bool = True) -> AsyncIterator[XMLCompatibleComment]:
+        """
+        NX-Jikkyo メッセージサーバーから過去に投稿されたコメントを遡ってダウンロードし、変換できたコメントから順に返す
+        iterBackwardCommentBatches() で受け取ったコメントを1つずつ XMLCompatibleComment に変換して返す
+
+        Args:
+            ignore_nicolive_comments (bool, default=True): ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外するかどうか
+
+        Yields:
+            XMLCompatibleComment: 過去に投稿されたコメント (サーバーが返した順で、通常は投稿日時昇順)
+
+        Raises:
+            curl_cffi.requests.exceptions.HTTPError: HTTP リクエストが失敗した場合
+            AssertionError: 解析に失敗した場合
+        """
+
+        async for batch in self.iterBackwardCommentBatches(ignore_nicolive_comments):
+            for comment in batch:
+                yield comment
+
+    async def iterBackwardCommentBatches(
+        self,
+        ignore_nicolive_comments: bool = True,
+        keep_nicolive_comments: bool = False,
+    ) -> AsyncIterator[CommentBatch]:
+        """
+        NX-Jikkyo メッセージサーバーから過去に投稿されたコメントを遡ってダウンロードし、受信したチャンクごとに CommentBatch として返す
+        レスポンスボディ全体を受信するのを待たず、受信したチャンクからコメント配列を少しずつデコード・変換するため、
+        ピークメモリ使用量はスレッドのコメント数ではなく、受信するチャンクの大きさで抑えられる
+        コメントキャッシュが指定されている場合、放送が終了したスレッドのコメントはキャッシュから読み込む
+        (キャッシュへの保存は、スレッドの全コメントをまとめる downloadBackwardCommentBatch() で行う)
+
+        Args:
+            ignore_nicolive_comments (bool, default=True): ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外するかどうか
+            keep_nicolive_comments (bool, default=False): ignore_nicolive_comments で除外するコメントも含めて返すかどうか
+                (動作ログと取得したコメント数は除外した場合と同じになる、コメントキャッシュに保存するために使う)
+
+        Yields:
+            CommentBatch: 過去に投稿されたコメントの集合 (サーバーが返した順で、通常は投稿日時昇順)
+
+        Raises:
+            curl_cffi.requests.exceptions.HTTPError: HTTP リクエストが失敗した場合
+            AssertionError: 解析に失敗した場合
+        """
+
+        class ThreadMetadata(BaseModel):
             id: int
             channel_id: str
             start_at: datetime
@@ -204,56 +378,359 @@ class NXClient:
             title: str
             description: str
             status: Literal['ACTIVE', 'UPCOMING', 'PAST']
-            comments: list[CommentResponse]
+
+        retrieved_count = 0
+
+        # 放送が終了したスレッドのコメントがキャッシュされていれば、ネットワークリクエストも検証もせずにキャッシュから読み込む
+        cached_thread = await self.comment_cache.get(self.thread_id) if self.comment_cache is not None else None
+        if cached_thread is not None:
+            self.loaded_from_cache = True
+            self._setThreadMetadata(cached_thread.title, 'PAST', cached_thread.start_at, cached_thread.end_at)
+            await self._printThreadInfo(
+                cached_thread.title, cached_thread.status, cached_thread.start_at, cached_thread.end_at
+            )
+            batch = await self._filterBatch(cached_thread.comments, ignore_nicolive_comments)
+            retrieved_count += len(batch)
+            yield cached_thread.comments if keep_nicolive_comments is True else batch
+            await self.print(f'Retrieved a total of {retrieved_count} comments.')
+            await self.print(Rule(characters='-', style=Style(color='#E33157')))
+            return
+
+        metadata_adapter = TypeAdapter(ThreadMetadata)
+        decoder = StreamingJSONObjectDecoder(array_key='comments')
+        metadata: ThreadMetadata | None = None
+
+        def parse_metadata() -> ThreadMetadata | None:
+            # コメント配列以外のスレッドの情報が揃ったら検証する
+            if any(key not in decoder.fields for key in ThreadMetadata.model_fields):
+                return None
+            return metadata_adapter.validate_python(decoder.fields)
 
         # スレッド取得 API にリクエスト
         ## 割と重いのでタイムアウトを 30 秒まで余裕を持って設定している
-        response = await self.http_client.get(
-            f'https://nx-jikkyo.tsukumijima.net/api/v1/threads/{self.thread_id}',
-            timeout=30,
-        )
-        response.raise_for_status()
-        thread: ThreadResponse = TypeAdapter(ThreadResponse).validate_json(response.content or b'')
-        await self.print(f'Title:  {thread.title} [{thread.status}] ({thread.id})')
+        ## レスポンスボディは受信しながら少しずつデコードする
+        async with self.http_pool.stream(
+            'GET', f'{self.API_BASE_URL}/threads/{self.thread_id}', timeout=30
+        ) as response:
+            response.raise_for_status()
+            chunks = response.aiter_content()
+            while True:
+                chunk = await anext(chunks, None)
+                if chunk is not None:
+                    self.received_bytes += len(chunk)
+                    self.http_pool.received_bytes += len(chunk)
+                raw_comments = decoder.feed(chunk) if chunk is not None else decoder.close()
+
+                # スレッドの情報が揃い次第、コメントより先にスレッドの情報を表示する
+                if metadata is None and (metadata := parse_metadata()) is not None:
+                    self._setThreadMetadata(metadata.title, metadata.status, metadata.start_at, metadata.end_at)
+                    await self._printThreadInfo(metadata.title, metadata.status, metadata.start_at, metadata.end_at)
+
+                # NX-Jikkyo から取得したコメントデータを、pydantic モデルを経由せずにニコニコ XML 互換コメント形式の列に変換する
+                if len(raw_comments) > 0:
+                    batch = CommentBatch()
+                    for raw_comment in raw_comments:
+                        batch.appendNXJikkyoComment(raw_comment)
+                    filtered_batch = await self._filterBatch(batch, ignore_nicolive_comments)
+                    retrieved_count += len(filtered_batch)
+                    if keep_nicolive_comments is False:
+                        batch = filtered_batch
+                    if len(batch) > 0:
+                        yield batch
+
+                if chunk is None:
+                    break
+
+        # スレッドの情報がレスポンスに含まれていない場合は、ここで検証エラーになる
+        if metadata is None:
+            metadata = metadata_adapter.validate_python(decoder.fields)
+            self._setThreadMetadata(metadata.title, metadata.status, metadata.start_at, metadata.end_at)
+            await self._printThreadInfo(metadata.title, metadata.status, metadata.start_at, metadata.end_at)
+
+        await self.print(f'Retrieved a total of {retrieved_count} comments.')
+        await self.print(Rule(characters='-', style=Style(color='#E33157')))
+
+    def getCommentServerURL(self, jikkyo_channel_id: str) -> str:
+        """
+        実況チャンネルの NX-Jikkyo コメントサーバー (WebSocket) の URL を返す
+        API のベース URL のスキームを WebSocket のものに置き換えて求める (スタンドインサーバーに向ける場合も URL を揃えるため)
+
+        Args:
+            jikkyo_channel_id (str): ニコニコ実況互換のチャンネル ID
+
+        Returns:
+            str: コメントサーバーの URL
+        """
+
+        base_url = self.API_BASE_URL.replace('https://', 'wss://', 1).replace('http://', 'ws://', 1)
+        return f'{base_url}/channels/{jikkyo_channel_id}/ws/comment'
+
+    async def streamCommentBatches(
+        self,
+        jikkyo_channel_id: str,
+        after_no: int = 0,
+        ignore_nicolive_comments: bool = True,
+        batch_interval: float = 1.0,
+        batch_size: int = 1000,
+        reconnect_policy: RetryPolicy | None = None,
+    ) -> AsyncIterator[CommentBatch]:
+        """
+        ACTIVE な NX-Jikkyo スレッドのコメントサーバー (WebSocket) に接続し、新しく投稿されたコメントを受信した順に返す
+        コメントサーバーへの接続のたびに、購読を開始してからスレッド取得 API で全コメントを取得し直し (再同期)、
+        前回までに返したコメントより新しいコメントだけを返す (購読を開始してから取得し直すため、再接続の間のコメントも取りこぼさない)
+        再同期以外はスレッド取得 API を呼び出さないため、コメント数によらず、新しく投稿されたコメントの分だけの通信量で済む
+        スレッドの放送が終了した場合 (ACTIVE でなくなった場合) に終了する
+
+        Args:
+            jikkyo_channel_id (str): スレッドが属するニコニコ実況互換のチャンネル ID
+            after_no (int, default=0): このコメント番号以前のコメントは取得済みとして返さない
+            ignore_nicolive_comments (bool, default=True): ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外するかどうか
+            batch_interval (float, default=1.0): 受信したコメントをまとめて返す間隔 (秒) (追記の回数を抑えるため)
+            batch_size (int, default=1000): まとめて返すコメント数の上限 (これに達したら間隔を待たずに返す)
+            reconnect_policy (RetryPolicy | None, default=None): 接続が切れた場合に再接続するまでの待機時間と、連続して失敗できる回数の設定
+
+        Yields:
+            CommentBatch: 新しく投稿されたコメントの集合 (投稿日時昇順、コメント番号は前回返したコメントより大きい)
+
+        Raises:
+            curl_cffi.requests.exceptions.HTTPError: 再同期のための HTTP リクエストが再接続しても失敗した場合
+            websockets.exceptions.WebSocketException: コメントサーバーとの通信が再接続しても失敗した場合
+        """
+
+        policy = reconnect_policy if reconnect_policy is not None else RetryPolicy(max_retries=5)
+        last_no = after_no
+        retry_count = 0
+
+        def take_new_comments(batch: CommentBatch) -> CommentBatch:
+            nonlocal last_no
+            new_batch = batch.take(index for index, comment_no in enumerate(batch.no) if comment_no > last_no)
+            if len(new_batch) > 0:
+                last_no = max(new_batch.no)
+            return new_batch
+
+        while True:
+            try:
+                async with websockets.connect(
+                    self.getCommentServerURL(jikkyo_channel_id), user_agent_header=self.USER_AGENT
+                ) as websocket:
+                    # 2024/06/08 以前のニコニコ生放送と同じ形式で、スレッドのコメントの購読を開始する
+                    ## 過去のコメントはスレッド取得 API で取得し直すため、購読開始前のコメントはほとんど受け取らない
+                    await websocket.send(
+                        json.dumps(
+                            [
+                                {'ping': {'content': 'rs:0'}},
+                                {'ping': {'content': 'ps:0'}},
+                                {
+                                    'thread': {
+                                        'version': '20061206',
+                                        'thread': str(self.thread_id),
+                                        'threadkey': '',
+                                        'user_id': '',
+                                        'res_from': -1,
+                                        'with_global': 1,
+                                        'scores': 1,
+                                        'nicoru': 0,
+                                    }
+                                },
+                                {'ping': {'content': 'pf:0'}},
+                                {'ping': {'content': 'rf:0'}},
+                            ]
+                        )
+                    )
+
+                    # 購読が開始されたことを確かめてから再同期する (購読の開始前に投稿されたコメントを取りこぼさないようにするため)
+                    ## 購読の開始を待つ間に受信したコメントは、再同期の後に受信したコメントと一緒に返す
+                    batch = CommentBatch()
+                    subscribed = False
+                    while subscribed is False:
+                        message = await asyncio.wait_for(
+                            websocket.recv(), timeout=self.COMMENT_SERVER_SUBSCRIBE_TIMEOUT
+                        )
+                        subscribed = self._handleCommentServerMessage(message, batch)
+
+                    # スレッド取得 API で全コメントを取得し直し、前回までに返したコメントより新しいコメントだけを返す
+                    ## 前回返したコメントとの比較はニコニコ実況由来のコメントも含めたコメント番号で行うため、除外はその後で行う
+                    ## API のページごとに返すと追記の回数が増えるため、batch_size 件に達するまでまとめてから返す
+                    new_comments = CommentBatch()
+                    async for resynced_batch in self.iterBackwardCommentBatches(ignore_nicolive_comments=False):
+                        resynced_batch = take_new_comments(resynced_batch)
+                        if ignore_nicolive_comments is True:
+                            resynced_batch = resynced_batch.excludeNicoliveComments()
+                        new_comments.extend(resynced_batch)
+                        if len(new_comments) >= batch_size:
+                            yield new_comments
+                            new_comments = CommentBatch()
+                    if len(new_comments) > 0:
+                        yield new_comments
+                    if self.thread_status != 'ACTIVE' or self.thread_end_at is None:
+                        return
+                    retry_count = 0
+
+                    # 以降はコメントサーバーから受信したコメントだけを返す
+                    ## 最初のコメントを受信してから batch_interval 秒の間に受信したコメントは、まとめて1つの CommentBatch で返す
+                    ## batch_interval 秒が経つ前に batch_size 件に達した場合は、その時点で返す
+                    loop = asyncio.get_running_loop()
+                    flush_at: float | None = loop.time() if len(batch) > 0 else None
+                    while True:
+                        now = datetime.now(self.thread_end_at.tzinfo)
+                        timeout = (self.thread_end_at - now).total_seconds()
+                        if flush_at is not None:
+                            timeout = min(timeout, flush_at - loop.time())
+                        try:
+                            message = await asyncio.wait_for(websocket.recv(), timeout=max(timeout, 0))
+                        except TimeoutError:
+                            message = None
+
+                        if message is not None:
+                            received_count = len(batch)
+                            self._handleCommentServerMessage(message, batch)
+                            if flush_at is None and len(batch) > received_count:
+                                flush_at = loop.time() + batch_interval
+
+                        # まとめて返す間隔が過ぎたら、受信したコメントを返す
+                        if flush_at is not None and (
+                            message is None or loop.time() >= flush_at or len(batch) >= batch_size
+                        ):
+                            new_batch = await self._filterBatch(
+                                take_new_comments(batch.sort()), ignore_nicolive_comments
+                            )
+                            if len(new_batch) > 0:
+                                yield new_batch
+                            batch = CommentBatch()
+                            flush_at = None
+
+                        # スレッドの放送終了日時を過ぎたら終了する
+                        if datetime.now(self.thread_end_at.tzinfo) >= self.thread_end_at:
+                            await self.print(f'Thread {self.thread_id} has ended. Closing the comment stream.')
+                            return
+
+            except Exception as ex:
+                # 接続が切れた場合は、待機してから再接続し、スレッド取得 API で再同期する
+                if retry_count >= policy.max_retries or is_retryable(ex) is False:
+                    raise
+                delay = policy.getDelay(retry_count, ex)
+                retry_count += 1
+                await self.print(
+                    f'[{datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f")}] Comment stream of thread {self.thread_id} '
+                    f'disconnected ({ex!r}). Reconnecting ({retry_count}/{policy.max_retries}) after {delay:.1f} seconds ...'
+                )
+                await asyncio.sleep(delay)
+
+    def _handleCommentServerMessage(self, message: str | bytes, batch: CommentBatch) -> bool:
+        """
+        コメントサーバーから受信したメッセージを処理し、含まれる chat メッセージを CommentBatch に追加する
+
+        Args:
+            message (str | bytes): 受信したメッセージ
+            batch (CommentBatch): chat メッセージを追加する CommentBatch
+
+        Returns:
+            bool: 購読の開始を知らせる thread メッセージが含まれていたなら True
+
+        Raises:
+            websockets.exceptions.WebSocketException: スレッドの購読に失敗した場合
+        """
+
+        subscribed = False
+        for data in self._parseCommentServerMessage(message):
+            if 'chat' in data:
+                batch.appendChatMessage(data['chat'])
+            elif 'thread' in data:
+                if data['thread'].get('resultcode', 0) != 0:
+                    raise websockets.exceptions.WebSocketException(
+                        f'Failed to subscribe to thread {self.thread_id}: {data["thread"]!r}'
+                    )
+                subscribed = True
+        return subscribed
+
+    @staticmethod
+    def _parseCommentServerMessage(message: str | bytes) -> list[dict[str, Any]]:
+        """
+        コメントサーバーから受信したメッセージを解析する
+        メッセージは1つのオブジェクトか、複数のオブジェクトの配列のいずれかで送信される
+
+        Args:
+            message (str | bytes): 受信したメッセージ
+
+        Returns:
+            list[dict[str, Any]]: メッセージに含まれるオブジェクトのリスト (ex: [{"chat": {...}}])
+        """
+
+        data = json.loads(message)
+        if isinstance(data, list):
+            return [item for item in data if isinstance(item, dict)]
+        return [data] if isinstance(data, dict) else []
+
+    def _setThreadMetadata(
+        self,
+        title: str,
+        status: Literal['ACTIVE', 'UPCOMING', 'PAST'],
+        start_at: datetime,
+        end_at: datetime,
+    ) -> None:
+        """
+        最後にダウンロードしたスレッドの情報として、スレッドのタイトル・ステータス・放送期間を記録する
+
+        Args:
+            title (str): スレッドのタイトル
+            status (Literal['ACTIVE', 'UPCOMING', 'PAST']): スレッドのステータス
+            start_at (datetime): スレッドの放送開始日時
+            end_at (datetime): スレッドの放送終了日時
+        """
+
+        self.thread_title = title
+        self.thread_status = status
+        self.thread_start_at = start_at
+        self.thread_end_at = end_at
+
+    async def _printThreadInfo(self, title: str, status: str, start_at: datetime, end_at: datetime) -> None:
+        """
+        スレッドのタイトル・ステータス・放送期間を表示する
+
+        Args:
+            title (str): スレッドのタイトル
+            status (str): スレッドのステータス
+            start_at (datetime): スレッドの放送開始日時
+            end_at (datetime): スレッドの放送終了日時
+        """
+
+        await self.print(f'Title:  {title} [{status}] ({self.thread_id})')
         await self.print(
-            f'Period: {thread.start_at.strftime("%Y-%m-%d %H:%M:%S")} ~ {thread.end_at.strftime("%Y-%m-%d %H:%M:%S")} '
-            f'({thread.end_at - thread.start_at}h)'
+            f'Period: {start_at.strftime("%Y-%m-%d %H:%M:%S")} ~ {end_at.strftime("%Y-%m-%d %H:%M:%S")} '
+            f'({end_at - start_at}h)'
         )
         await self.print(Rule(characters='-', style=Style(color='#E33157')), verbose_log=True)
 
-        # 基本投稿日時昇順でソートされているはずだが、念のためここでもソートする
-        ## この後の処理で date は秒単位とミリ秒単位に分割するため、ここでソートしておかないと色々面倒
-        thread.comments.sort(key=lambda x: x.date)
-
-        # NX-Jikkyo から取得したコメントデータをニコニコ XML 互換コメント形式に変換する
-        xml_compatible_comments: list[XMLCompatibleComment] = []
-        for comment in thread.comments:
-            xml_comment = XMLCompatibleComment(
-                # スレッド ID は NX-Jikkyo のスレッド ID を文字列化したものをそのまま入れる
-                thread=str(comment.thread_id),
-                no=comment.no,
-                vpos=comment.vpos,
-                date=int(comment.date.timestamp()),
-                date_usec=int((comment.date.timestamp() % 1) * 1000000),
-                mail=comment.mail,
-                user_id=comment.user_id,
-                premium=1 if comment.premium is True else None,
-                anonymity=1 if comment.anonymity is True else None,
-                content=comment.content,
-            )
-            # ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外する
-            if ignore_nicolive_comments is True and comment.user_id.startswith('nicolive:') is True:
-                xml_comment.user_id = xml_comment.user_id.replace('nicolive:', '')
-                await self.print(str(xml_comment), verbose_log=True)
-                await self.print('[yellow]Skipped a comment from nicolive.[/yellow]', verbose_log=True)
-            else:
-                await self.print(str(xml_comment), verbose_log=True)
-                xml_compatible_comments.append(xml_comment)
-            await self.print(Rule(characters='-', style=Style(color='#E33157')), verbose_log=True)
-
-        await self.print(f'Retrieved a total of {len(xml_compatible_comments)} comments.')
-        await self.print(Rule(characters='-', style=Style(color='#E33157')))
-        return xml_compatible_comments
+    async def _filterBatch(self, batch: CommentBatch, ignore_nicolive_comments: bool) -> CommentBatch:
+        """
+        コメントを詳細な動作ログに出力し、呼び出し元に返すべきコメントだけに絞り込む
+        詳細な動作ログを出力しない場合は、XMLCompatibleComment を作成せずに列のまま絞り込む
+
+        Args:
+            batch (CommentBatch): 絞り込むコメントの集合
+            ignore_nicolive_comments (bool): ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外するかどうか
+
+        Returns:
+            CommentBatch: 呼び出し元に返すべきコメントの集合
+        """
+
+        # 詳細な動作ログがどこにも出力されない場合は、XMLCompatibleComment の作成や文字列の構築自体を省略する
+        if self.isLogging(verbose_log=True) is True:
+            mask = batch.getNicoliveMask() if ignore_nicolive_comments is True else [False] * len(batch)
+            for index, is_nicolive in enumerate(mask):
+                xml_comment = batch.getComment(index)
+                if is_nicolive is True:
+                    xml_comment.user_id = xml_comment.user_id.replace('nicolive:', '')
+                    await self.print(str(xml_comment), verbose_log=True)
+                    await self.print('[yellow]Skipped a comment from nicolive.[/yellow]', verbose_log=True)
+                else:
+                    await self.print(str(xml_comment), verbose_log=True)
+                await self.print(Rule(characters='-', style=Style(color='#E33157')), verbose_log=True)
+
+        # ニコニコ実況に投稿され NX-Jikkyo にリアルタイムマージされたコメントを除外する
+        if ignore_nicolive_comments is True:
+            return batch.excludeNicoliveComments()
+        return batch
 
     async def print(self, *args: Any, verbose_log: bool = False, **kwargs: Any) -> None:
         """
@@ -272,13 +749,28 @@ class NXClient:
             print(*args, **kwargs)
 
         # ログファイルのパスが指定されている場合は、ログをファイルにも出力
-        # anyio.Path を使って非同期でファイルに書き込むことで、イベントループのブロックを回避する
-        if self.log_path is not None:
-            async with await self.log_path.open('a') as f:
-                # print() の出力を文字列として構築してからファイルに書き込む
-                string_buffer = io.StringIO()
-                print(*args, **kwargs, file=string_buffer)
-                await f.write(string_buffer.getvalue())
+        ## 1行ごとにファイルを開閉せず、バッファ付きのシンクにまとめて書き込む
+        if self.log_sink is not None:
+            # print() の出力を文字列として構築してからシンクに書き込む
+            string_buffer = io.StringIO()
+            print(*args, **kwargs, file=string_buffer)
+            await self.log_sink.write(string_buffer.getvalue())
+
+    def isLogging(self, verbose_log: bool = False) -> bool:
+        """
+        print() で出力したログがどこかに出力されるかどうかを返す
+        どこにも出力されないログは、文字列の構築自体を省略できる
+
+        Args:
+            verbose_log (bool, default=False): 詳細な動作ログかどうか
+
+        Returns:
+            bool: ログがコンソールかファイルに出力される場合は True
+        """
+
+        if verbose_log is True and self.verbose is False:
+            return False
+        return self.show_log is True or self.log_sink is not None
 
     async def close(self) -> None:
         """
@@ -288,14 +780,20 @@ class NXClient:
         NXClient の使用が完了した後は、必ずこのメソッドを呼び出してリソースを解放する必要がある。
         リソースを解放しないと、未解放の curl-cffi `AsyncSession` が蓄積し、
         メモリリークやパフォーマンス劣化の原因となる。
+        外部から渡された HTTP コネクションプールは呼び出し元が所有しているため、ここでは解放しない。
         """
 
         # 既にクローズ済みの場合は何もしない (冪等性の保証)
         if self._is_closed is True:
             return
 
-        # curl-cffi の AsyncSession.close() を呼び出して HTTP クライアントのリソースを解放する
-        await self.http_client.close()
+        # バッファに残っている動作ログを書き出し、ログファイルを閉じる
+        if self.log_sink is not None:
+            await self.log_sink.close()
+
+        # このインスタンス専用の HTTP コネクションプールを解放する
+        if self._owns_http_pool is True:
+            await self.http_pool.close()
 
         # curl-cffi の AsyncSession.close() と同様に、クローズ成功後にフラグを立てる
         ## close() が失敗した場合にリトライ可能にし、__del__ の ResourceWarning も抑制されないようにする
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import asyncio
+import random
+import time
+from collections.abc import Awaitable, Callable
+from email.utils import parsedate_to_datetime
+from typing import Any, NamedTuple, TypeVar
+
+
+T = TypeVar('T')
+
+# リトライしても結果が変わらない HTTP ステータスコード以外で、リトライする 4xx の HTTP ステータスコード
+## 408: Request Timeout / 425: Too Early / 429: Too Many Requests
+RETRYABLE_CLIENT_ERROR_STATUS_CODES = {408, 425, 429}
+
+
+class RetryPolicy(NamedTuple):
+    """リトライの回数と、リトライまでの待機時間 (指数バックオフ + ジッター) の設定"""
+
+    max_retries: int = 3  # 最初の試行が失敗した後にリトライする最大回数
+    base_delay: float = 1.0  # 1回目のリトライまでの待機時間の基準 (秒)
+    max_delay: float = 60.0  # リトライまでの待機時間の上限 (秒) (Retry-After で指定された待機時間にも適用する)
+
+    def getDelay(self, retry_count: int, exception: BaseException | None = None) -> float:
+        """
+        リトライまでの待機時間を返す
+        例外が Retry-After ヘッダー付きの HTTP レスポンスによるものであれば、その待機時間に従う
+        それ以外の場合は、リトライごとに待機時間を倍にしつつ、同時に失敗したリクエストのリトライが重ならないようジッターを加える
+
+        Args:
+            retry_count (int): 何回目のリトライか (0 始まり)
+            exception (BaseException | None, default=None): 失敗の原因になった例外
+
+        Returns:
+            float: リトライまでの待機時間 (秒)
+        """
+
+        retry_after = get_retry_after(exception) if exception is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        # 待機時間の半分は固定し、残りの半分をランダムにする (Equal Jitter)
+        delay = min(self.base_delay * (2**retry_count), self.max_delay)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+
+def get_retry_after(exception: BaseException) -> float | None:
+    """
+    例外の原因になった HTTP レスポンスの Retry-After ヘッダーから、リトライまでの待機時間を求める
+    curl_cffi・httpx など、例外の response 属性に HTTP レスポンスを持つ HTTP クライアントの例外に対応する
+
+    Args:
+        exception (BaseException): 失敗の原因になった例外
+
+    Returns:
+        float | None: リトライまでの待機時間 (秒) (Retry-After ヘッダーがない・解釈できない場合は None)
+    """
+
+    response: Any = getattr(exception, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers is None:
+        return None
+    retry_after = headers.get('Retry-After')
+    if retry_after is None:
+        return None
+
+    # Retry-After は秒数か HTTP-date のいずれかで指定される
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(exception: BaseException) -> bool:
+    """
+    例外の原因になった処理をリトライすべきかどうかを返す
+    HTTP レスポンスが 4xx (リクエストのタイムアウトとレート制限を除く) の場合は、リトライしても結果は変わらないためリトライしない
+    それ以外の例外 (接続エラー・タイムアウト・5xx・予期しないエラーなど) はリトライする
+
+    Args:
+        exception (BaseException): 失敗の原因になった例外
+
+    Returns:
+        bool: リトライすべきなら True
+    """
+
+    response: Any = getattr(exception, 'response', None)
+    status_code = getattr(response, 'status_code', None)
+    if isinstance(status_code, int) and 400 <= status_code < 500:
+        return status_code in RETRYABLE_CLIENT_ERROR_STATUS_CODES
+    return True
+
+
+async def retry_async(
+    func: Callable[[], Awaitable[T]],
+    policy: RetryPolicy,
+    on_retry: Callable[[int, Exception, float], Any] | None = None,
+    should_retry: Callable[[Exception], bool] = is_retryable,
+) -> T:
+    """
+    非同期処理を実行し、失敗した場合は RetryPolicy に従って待機してからリトライする
+    リトライすべきでない例外の場合や、リトライの回数が上限に達した場合は、最後の例外をそのまま送出する
+
+    Args:
+        func (Callable[[], Awaitable[T]]): 実行する処理 (リトライごとに呼び出し直す)
+        policy (RetryPolicy): リトライの回数と待機時間の設定
+        on_retry (Callable[[int, Exception, float], Any] | None, default=None): リトライする前に、
+            何回目のリトライか (1 始まり)・失敗の原因になった例外・待機時間 (秒) を受け取って呼び出される関数
+        should_retry (Callable[[Exception], bool], default=is_retryable): 例外を受け取り、リトライすべきかどうかを返す関数
+
+    Returns:
+        T: 処理の結果
+    """
+
+    retry_count = 0
+    while True:
+        try:
+            return await func()
+        except Exception as ex:
+            if retry_count >= policy.max_retries or should_retry(ex) is False:
+                raise
+            delay = policy.getDelay(retry_count, ex)
+            retry_count += 1
+            if on_retry is not None:
+                on_retry(retry_count, ex, delay)
+            await asyncio.sleep(delay)
@@ -0,0 +1,302 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import multiprocessing
+import pickle
+import time
+from collections.abc import Callable, Iterator, Mapping, Sequence
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from typing import Any, BinaryIO, NamedTuple
+
+import anyio
+from ndgr_client import NDGRClient, XMLCompatibleComment
+from rich import print
+
+from jkcommentcrawler.comment_batch import CommentBatch
+from jkcommentcrawler.merge import UnsortedSourceError, iter_merged_comment_sources
+from jkcommentcrawler.nicojk import NicojkIndex
+
+
+class SerializedLog(NamedTuple):
+    """取得元ごとのコメントをマージし、ニコニコ XML 互換形式に変換した結果"""
+
+    xml_bytes: (
+        bytes  # XML 文字列を UTF-8 でエンコードしたバイト列 (コメントがない場合と、一時ファイルに書き込んだ場合は空)
+    )
+    size: int  # XML 文字列を UTF-8 でエンコードしたバイト列のサイズ
+    temp_path: (
+        str | None
+    )  # XML 文字列を書き込んだ一時ファイルのパス (一時ファイルに書き込まなかった場合とコメントがない場合は None)
+    index_bytes: (
+        bytes | None
+    )  # 一時ファイルの内容の索引ファイルの内容 (一時ファイルに書き込まなかった場合とコメントがない場合は None)
+    chars: int  # XML 文字列の文字数
+    sha256: str  # XML 文字列のバイト列の SHA-256 ハッシュ
+    comment_count: int  # マージしたコメント数
+    source_counts: dict[str, int]  # 取得元ごとのマージしたコメント数
+    first_date_with_usec: float | None  # 最初のコメントの投稿日時 (コメントがない場合は None)
+    last_date_with_usec: float | None  # 最後のコメントの投稿日時 (コメントがない場合は None)
+    merge_duration: float  # コメントの変換・絞り込み・マージに掛かった時間の合計 (秒)
+    serialize_duration: float  # XML 文字列への変換とハッシュの計算 (と一時ファイルへの書き込み) に掛かった時間 (秒)
+
+
+def serialize_comment_sources(
+    sources: Mapping[str, Sequence[Any] | CommentBatch],
+    target_date: date,
+    converter: Callable[[Any], XMLCompatibleComment],
+    temp_path: str | None = None,
+    chunk_size: int = 10000,
+) -> SerializedLog:
+    """
+    取得元ごとのコメントを XMLCompatibleComment に変換し、指定された日付に投稿されたコメントだけを投稿日時昇順にマージして、
+    ニコニコ XML 互換形式のバイト列に変換する
+    CPU 負荷の高い処理をまとめて行うため、プロセスプールのワーカープロセスからも呼び出せるよう、引数・戻り値は全て pickle できる
+
+    ニコニコ生放送のコメントは、マージしたコメントを取り出しながら1件ずつ XMLCompatibleComment に変換する
+    temp_path が指定された場合は、マージしたコメントを chunk_size 件ずつ XML 文字列に変換しながら、
+    temp_path の一時ファイルに書き込む (ハッシュと索引も書き込みながら求める)
+    1日分の XML 文字列をメモリ上に持たないため、ピークメモリ使用量がその日のコメント数に比例しない
+    一時ファイルはリネームしないため、呼び出し元で replace_file() で .nicojk ファイルを置き換えるか、削除する必要がある
+
+    Args:
+        sources (Mapping[str, Sequence[Any] | CommentBatch]): 取得元の名前ごとのコメント
+            (ニコニコ生放送のコメントは変換前のリスト、NX-Jikkyo のコメントは CommentBatch)
+        target_date (date): 絞り込む日付
+        converter (Callable[[Any], XMLCompatibleComment]): 変換前のコメントを XMLCompatibleComment に変換する関数
+            (NDGRClient.convertToXMLCompatibleComment)
+        temp_path (str | None, default=None): XML 文字列を書き込む一時ファイルのパス (None ならバイト列として返す)
+        chunk_size (int, default=10000): 一度に XML 文字列に変換するコメント数
+
+    Returns:
+        SerializedLog: マージ・変換した結果
+    """
+
+    try:
+        return _serialize_comments(
+            iter_merged_comment_sources(sources, target_date, converter), target_date, temp_path, chunk_size
+        )
+
+    # 万が一投稿日時昇順になっていない取得元があれば、変換前のコメントを全て変換し、並び替えてからマージし直す
+    ## 全て変換するのに掛かった時間は、マージの所要時間に含める
+    except UnsortedSourceError:
+        start = time.perf_counter()
+        converted_sources: dict[str, Sequence[XMLCompatibleComment] | CommentBatch] = {
+            source: comments if isinstance(comments, CommentBatch) else [converter(comment) for comment in comments]
+            for source, comments in sources.items()
+        }
+        merged = iter_merged_comment_sources(converted_sources, target_date)
+        return _serialize_comments(merged, target_date, temp_path, chunk_size, time.perf_counter() - start)
+
+
+def _serialize_comments(
+    merged: tuple[Iterator[XMLCompatibleComment], dict[str, int]],
+    target_date: date,
+    temp_path: str | None,
+    chunk_size: int,
+    merge_duration: float = 0.0,
+) -> SerializedLog:
+    """
+    マージしたコメントを取り出しながら、chunk_size 件ずつ XML 文字列に変換する (serialize_comment_sources() の本体)
+    マージしたコメントをイテレーターから取り出すのに掛かった時間と、XML 文字列に変換して書き込むのに掛かった時間を別々に計測する
+
+    Args:
+        merged (tuple[Iterator[XMLCompatibleComment], dict[str, int]]): iter_merged_comment_sources() の戻り値
+        target_date (date): 絞り込む日付
+        temp_path (str | None): XML 文字列を書き込む一時ファイルのパス (None ならバイト列として返す)
+        chunk_size (int): 一度に XML 文字列に変換するコメント数
+        merge_duration (float, default=0.0): 呼び出し前にマージに掛かった時間 (秒)
+
+    Returns:
+        SerializedLog: マージ・変換した結果
+    """
+
+    comments, source_counts = merged
+    serialize_duration = 0.0
+    hasher = hashlib.sha256()
+    xml_chunks: list[bytes] = []
+    temp_file_path = Path(temp_path) if temp_path is not None else None
+    index = NicojkIndex.build(target_date, b'')
+    f: BinaryIO | None = None
+    chars = 0
+    size = 0
+    comment_count = 0
+    first_date_with_usec: float | None = None
+    last_date_with_usec: float | None = None
+    ends_with_newline = True
+    try:
+        while True:
+            # 取得元のコメントの XMLCompatibleComment への変換とマージは、イテレーターから取り出した時点で行われる
+            start = time.perf_counter()
+            chunk = list(islice(comments, chunk_size))
+            merge_duration += time.perf_counter() - start
+            if len(chunk) == 0:
+                break
+
+            start = time.perf_counter()
+            xml_content = NDGRClient.convertToXMLString(chunk)
+            # 全コメントを一度に変換した場合と同じ内容になるよう、<chat> 要素の間に改行を補う
+            if ends_with_newline is False:
+                xml_content = '\n' + xml_content
+            ends_with_newline = xml_content.endswith('\n')
+            xml_chunk = xml_content.encode('utf-8')
+            hasher.update(xml_chunk)
+
+            if temp_file_path is None:
+                xml_chunks.append(xml_chunk)
+            else:
+                # 一時ファイルは最初のコメントを書き込む時に作成する
+                if f is None:
+                    temp_file_path.parent.mkdir(parents=True, exist_ok=True)
+                    f = open(temp_file_path, 'wb')
+                f.write(xml_chunk)
+                index.extend(xml_chunk, size)
+
+            chars += len(xml_content)
+            size += len(xml_chunk)
+            comment_count += len(chunk)
+            if first_date_with_usec is None:
+                first_date_with_usec = chunk[0].date_with_usec
+            last_date_with_usec = chunk[-1].date_with_usec
+            serialize_duration += time.perf_counter() - start
+
+    # 変換・書き込みに失敗した場合は、書き込み途中の一時ファイルを残さない
+    except BaseException:
+        if f is not None and temp_file_path is not None:
+            f.close()
+            temp_file_path.unlink(missing_ok=True)
+        raise
+    if f is not None:
+        f.close()
+
+    return SerializedLog(
+        xml_bytes=b''.join(xml_chunks),
+        size=size,
+        temp_path=temp_path if f is not None else None,
+        index_bytes=index.toBytes() if f is not None else None,
+        chars=chars,
+        sha256=hasher.hexdigest(),
+        comment_count=comment_count,
+        source_counts=source_counts,
+        first_date_with_usec=first_date_with_usec,
+        last_date_with_usec=last_date_with_usec,
+        merge_duration=merge_duration,
+        serialize_duration=serialize_duration,
+    )
+
+
+def _serialize_pickled_comment_sources(payload: bytes) -> SerializedLog:
+    """
+    プロセスプールのワーカープロセスで、pickle 済みの引数を復元して serialize_comment_sources() を実行する
+
+    Args:
+        payload (bytes): serialize_comment_sources() の引数のタプルを pickle したバイト列
+
+    Returns:
+        SerializedLog: マージ・変換した結果
+    """
+
+    return serialize_comment_sources(*pickle.loads(payload))
+
+
+class CommentSerializer:
+    """
+    serialize_comment_sources() を、指定された数のワーカープロセスを持つプロセスプールで実行するクラス
+    巨大な実況チャンネルのコメントの変換中もイベントループが止まらず、他の実況チャンネルの通信を進められるようにし、複数の CPU コアを使う
+    ワーカー数が 0 の場合や、プロセスプールが使えなくなった場合は、イベントループを止めないようワーカースレッドで実行する
+    """
+
+    # プロセスプールで実行するコメント数の下限
+    ## これより少ないコメント (差分モードや tail で追記するコメントなど) は、pickle とプロセス間通信の方が高く付くため、ワーカースレッドで実行する
+    POOL_MIN_COMMENTS = 10000
+
+    def __init__(self, workers: int = 0) -> None:
+        """
+        CommentSerializer のコンストラクタ
+
+        Args:
+            workers (int, default=0): ワーカープロセスの数 (0 ならプロセスプールを使わずにワーカースレッドで実行する)
+        """
+
+        if workers < 0:
+            raise ValueError('workers must be 0 or greater.')
+
+        self.workers = workers
+
+        # プロセスプール (最初に使う時に作成する)
+        ## fork はスレッド (anyio のワーカースレッドなど) を持つプロセスでは安全でないため、spawn でワーカープロセスを起動する
+        self._pool: ProcessPoolExecutor | None = None
+        self._pool_disabled = workers == 0
+
+    async def serialize(
+        self,
+        sources: Mapping[str, Sequence[Any] | CommentBatch],
+        target_date: date,
+        converter: Callable[[Any], XMLCompatibleComment],
+        temp_path: str | None = None,
+    ) -> SerializedLog:
+        """
+        取得元ごとのコメントをマージし、ニコニコ XML 互換形式のバイト列に変換する (または一時ファイルに書き込む)
+        ワーカープロセスには、CommentBatch を列ごとのコンパクトなバイト列 (CommentBatch.toBytes()) として渡す
+        引数はワーカープロセスに渡す前に pickle し、pickle できない場合だけワーカースレッドで実行する
+        コメント数が POOL_MIN_COMMENTS 未満の場合は、プロセスプールを使わずにワーカースレッドで実行する
+        (ワーカープロセス内で発生した例外は、そのまま呼び出し元に送出する)
+
+        Args:
+            sources (Mapping[str, Sequence[Any] | CommentBatch]): 取得元の名前ごとのコメント
+            target_date (date): 絞り込む日付
+            converter (Callable[[Any], XMLCompatibleComment]): 変換前のコメントを XMLCompatibleComment に変換する関数
+            temp_path (str | None, default=None): XML 文字列を書き込む一時ファイルのパス (None ならバイト列として返す)
+
+        Returns:
+            SerializedLog: マージ・変換した結果
+        """
+
+        if (
+            self._pool_disabled is False
+            and sum(len(comments) for comments in sources.values()) >= self.POOL_MIN_COMMENTS
+        ):
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            # ワーカープロセスに渡せない (pickle できない) コメントが含まれていた場合は、今回だけワーカースレッドで実行する
+            ## pickle できないオブジェクトによって PicklingError・AttributeError・TypeError のいずれかが送出される
+            payload: bytes | None = None
+            try:
+                payload = await anyio.to_thread.run_sync(
+                    partial(pickle.dumps, (dict(sources), target_date, converter, temp_path), pickle.HIGHEST_PROTOCOL)
+                )
+            except (pickle.PicklingError, AttributeError, TypeError) as ex:
+                print(f'Comments cannot be sent to the process pool ({ex}). Serializing sequentially.')
+            if payload is not None:
+                try:
+                    return await asyncio.get_running_loop().run_in_executor(
+                        self._pool, partial(_serialize_pickled_comment_sources, payload)
+                    )
+                # ワーカープロセスが異常終了した (メモリ不足で強制終了された、など) 場合は、以降はプロセスプールを使わない
+                except BrokenProcessPool as ex:
+                    print(f'Process pool is not available ({ex}). Falling back to sequential serialization.')
+                    await self.close()
+                    self._pool_disabled = True
+
+        # コメントの変換や一時ファイルへの書き込みの間もイベントループを止めないよう、ワーカースレッドで実行する
+        return await anyio.to_thread.run_sync(
+            partial(serialize_comment_sources, sources, target_date, converter, temp_path)
+        )
+
+    async def close(self) -> None:
+        """
+        プロセスプールを終了する
+        このメソッドは冪等であり、複数回呼び出しても安全に動作する
+        """
+
+        if self._pool is not None:
+            pool = self._pool
+            self._pool = None
+            await anyio.to_thread.run_sync(pool.shutdown)
@@ -0,0 +1,89 @@
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+
+class SourceCache:
+    """
+    クロール実行中に、ダウンロードした取得元 (ニコニコ生放送番組・NX-Jikkyo スレッド) のコメントを日付をまたいで共有するキャッシュ
+    NX-Jikkyo のスレッド (通常毎日 04:00 ~ 翌日 04:00) のように日付をまたいで放送された取得元は、複数の日付の収集で必要になる
+    事前にその取得元を使う日付の数だけ参照を登録しておき、ダウンロードは最初に必要になった時に1回だけ行い、
+    全ての日付の収集が終わって参照がなくなった時点でメモリから解放する
+    """
+
+    def __init__(self) -> None:
+        """
+        SourceCache のコンストラクタ
+        """
+
+        # 取得元の名前ごとの、ダウンロード中またはダウンロード済みのコメント
+        ## 同時に複数の日付の収集から要求された場合でも1回しかダウンロードしないよう、Future で保持する
+        self._sources: dict[str, asyncio.Future[Any]] = {}
+
+        # 取得元の名前ごとの、まだ収集が終わっていない日付の数
+        self._references: dict[str, int] = {}
+
+    def retain(self, source: str) -> None:
+        """
+        取得元を使う日付の収集を1つ登録する
+
+        Args:
+            source (str): 取得元の名前 (ex: nicolive:lv345479988, nx-jikkyo:1234)
+        """
+
+        self._references[source] = self._references.get(source, 0) + 1
+
+    def release(self, source: str) -> None:
+        """
+        取得元を使う日付の収集が1つ終わったことを通知する
+        参照がなくなった取得元のコメントはメモリから解放する
+
+        Args:
+            source (str): 取得元の名前
+        """
+
+        references = self._references.get(source, 0) - 1
+        if references > 0:
+            self._references[source] = references
+        else:
+            self._references.pop(source, None)
+            self._sources.pop(source, None)
+
+    async def get(self, source: str, download: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        取得元のコメントを返す
+        まだダウンロードしていない場合は download() でダウンロードし、参照が残っている間は以降の呼び出しで使い回す
+        ダウンロードに失敗した場合はキャッシュせず、次の呼び出しでダウンロードし直す
+
+        Args:
+            source (str): 取得元の名前
+            download (Callable[[], Awaitable[Any]]): 取得元のコメントをダウンロードするコルーチン関数
+
+        Returns:
+            Any: 取得元のコメント
+        """
+
+        future = self._sources.get(source)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            # 参照が登録されていない取得元は、他の日付の収集と共有しないためキャッシュに保持しない
+            if source in self._references:
+                self._sources[source] = future
+            try:
+                future.set_result(await download())
+            except asyncio.CancelledError:
+                if self._sources.get(source) is future:
+                    del self._sources[source]
+                future.cancel()
+                raise
+            except Exception as ex:
+                if self._sources.get(source) is future:
+                    del self._sources[source]
+                # 同じ取得元のダウンロードを待っている他の日付の収集にも例外を伝える
+                future.set_exception(ex)
+                # 待っている呼び出しがない場合に "Future exception was never retrieved" の警告が出ないようにする
+                future.exception()
+                raise
+        return await future
@@ -0,0 +1,240 @@
+from __future__ import annotations
+
+import json
+import time
+from bisect import bisect_left
+from datetime import date, datetime, timedelta, timezone
+from itertools import accumulate
+from typing import Any, NamedTuple
+
+import anyio
+from pydantic import BaseModel, TypeAdapter
+
+from jkcommentcrawler.utils import write_file_atomically
+
+
+# NX-Jikkyo のスレッドの放送日時は日本標準時で管理されている
+JST = timezone(timedelta(hours=9))
+
+
+class ThreadInfo(BaseModel):
+    """NX-Jikkyo のスレッド情報取得 API が返すスレッドの情報"""
+
+    id: int
+    start_at: datetime
+    end_at: datetime
+    title: str
+    description: str
+    status: str
+
+
+class ThreadInterval(NamedTuple):
+    """スレッドインデックスに保持するスレッドの放送区間"""
+
+    id: int
+    start_at: float  # 放送開始日時 (UNIX 時間)
+    end_at: float  # 放送終了日時 (UNIX 時間)
+    status: str  # ACTIVE / UPCOMING / PAST
+
+
+class ThreadIndex:
+    """
+    NX-Jikkyo の実況チャンネルごとのスレッド一覧を、放送開始日時昇順に並べた放送区間として保持するインデックス
+    放送が終了した (PAST の) スレッドは二度と変化しないものとして扱い、スレッド一覧の再取得時も ACTIVE / UPCOMING のスレッドだけを更新する
+    日付ごとのスレッドの検索は、全件を走査する代わりに放送区間の二分探索で行う
+    """
+
+    # インデックスファイルのフォーマットのバージョン
+    VERSION = 1
+
+    # ACTIVE / UPCOMING のスレッドを含む日付について、スレッド一覧を再取得するまでの間隔 (秒)
+    ## スレッドの放送区間は作成後に変化しないため、ステータスの更新のためだけに毎回スレッド一覧を取得する必要はない
+    REFRESH_INTERVAL = 60 * 60
+
+    def __init__(self, jikkyo_channel_id: str, index_path: anyio.Path | None = None) -> None:
+        """
+        ThreadIndex のコンストラクタ
+
+        Args:
+            jikkyo_channel_id (str): ニコニコ実況互換のチャンネル ID
+            index_path (anyio.Path | None, default=None): インデックスを保存するファイルのパス (None の場合はディスクに保存しない)
+        """
+
+        self.jikkyo_channel_id = jikkyo_channel_id
+        self.index_path = index_path
+
+        # 放送開始日時昇順に並べたスレッドの放送区間
+        self.threads: list[ThreadInterval] = []
+
+        # 最後にスレッド一覧を取得した日時 (UNIX 時間)
+        self.refreshed_at: float = 0.0
+
+        # 二分探索用に、放送開始日時のリストと放送終了日時の累積最大値のリストを保持する
+        self._start_ats: list[float] = []
+        self._max_end_ats: list[float] = []
+
+    @classmethod
+    async def load(cls, jikkyo_channel_id: str, index_dir: anyio.Path) -> ThreadIndex:
+        """
+        ディスクに保存されたスレッドインデックスを読み込む
+        インデックスファイルが存在しないか壊れている場合は、空のインデックスを返す
+
+        Args:
+            jikkyo_channel_id (str): ニコニコ実況互換のチャンネル ID
+            index_dir (anyio.Path): インデックスファイルを保存するフォルダのパス
+
+        Returns:
+            ThreadIndex: 読み込んだスレッドインデックス
+        """
+
+        index = cls(jikkyo_channel_id, index_dir / f'{jikkyo_channel_id}.json')
+        assert index.index_path is not None
+        if not await index.index_path.exists():
+            return index
+
+        try:
+            data = json.loads(await index.index_path.read_bytes())
+            if data['version'] != cls.VERSION or data['channel_id'] != jikkyo_channel_id:
+                return index
+            index.refreshed_at = float(data['refreshed_at'])
+            index._setThreads([ThreadInterval(int(t[0]), float(t[1]), float(t[2]), str(t[3])) for t in data['threads']])
+        except (ValueError, KeyError, IndexError, TypeError):
+            # 壊れたインデックスは破棄してスレッド一覧を取得し直す
+            return cls(jikkyo_channel_id, index.index_path)
+
+        return index
+
+    async def save(self) -> None:
+        """
+        スレッドインデックスをディスクにアトミックに保存する
+        """
+
+        if self.index_path is None:
+            return
+        await self.index_path.parent.mkdir(parents=True, exist_ok=True)
+        data = {
+            'version': self.VERSION,
+            'channel_id': self.jikkyo_channel_id,
+            'refreshed_at': self.refreshed_at,
+            'threads': [list(thread) for thread in self.threads],
+        }
+        await write_file_atomically(self.index_path, json.dumps(data, separators=(',', ':')).encode('utf-8'))
+
+    @staticmethod
+    def getDateRange(date: date) -> tuple[float, float]:
+        """
+        指定した日付の開始日時と翌日の開始日時を UNIX 時間で返す
+
+        Args:
+            date (date): 日付
+
+        Returns:
+            tuple[float, float]: 日付の開始日時と翌日の開始日時 (UNIX 時間)
+        """
+
+        day_start = datetime(date.year, date.month, date.day, tzinfo=JST).timestamp()
+        return day_start, day_start + 24 * 60 * 60
+
+    def search(self, date: date) -> list[ThreadInterval]:
+        """
+        指定した日付に少なくとも一部が放送されている/放送されたスレッドを、放送区間の二分探索で検索する
+
+        Args:
+            date (date): 検索する日付
+
+        Returns:
+            list[ThreadInterval]: 指定した日付に少なくとも一部が放送されているスレッドのリスト (放送開始日時昇順)
+        """
+
+        day_start, day_end = self.getDateRange(date)
+
+        # 翌日の開始日時より前に放送が始まったスレッドの範囲
+        right = bisect_left(self._start_ats, day_end)
+        # 放送終了日時の累積最大値が日付の開始日時以上になる最初の位置より前のスレッドは、すべて日付より前に終わっている
+        left = bisect_left(self._max_end_ats, day_start, hi=right)
+
+        return [thread for thread in self.threads[left:right] if thread.end_at >= day_start]
+
+    def isFresh(self, date: date, now: float | None = None) -> bool:
+        """
+        指定した日付のスレッドを、スレッド一覧を再取得せずにインデックスから検索できるかどうかを返す
+
+        Args:
+            date (date): 検索する日付
+            now (float | None, default=None): 現在日時 (UNIX 時間) (主にテスト用)
+
+        Returns:
+            bool: スレッド一覧を再取得する必要がなければ True
+        """
+
+        if now is None:
+            now = time.time()
+        day_start, day_end = self.getDateRange(date)
+        threads = self.search(date)
+
+        # 日付全体がスレッドの放送区間で隙間なく覆われているかを確認する
+        covered_until = day_start
+        for thread in threads:
+            if thread.start_at > covered_until:
+                break
+            covered_until = max(covered_until, thread.end_at)
+        is_covered = covered_until >= day_end
+
+        # 日付が終わった後にスレッド一覧を取得済みなら、その日付に新たなスレッドが作られることはない
+        is_closed = is_covered or self.refreshed_at >= day_end
+
+        # 放送が終了したスレッドしかない場合は、二度とスレッド一覧を取得し直す必要はない
+        if is_closed and all(thread.status == 'PAST' for thread in threads):
+            return True
+
+        # 日付全体を覆うスレッドが揃っていない場合は、新たなスレッドが作られている可能性があるため常に取得し直す
+        if not is_closed:
+            return False
+
+        # ACTIVE / UPCOMING のスレッドを含む場合は、一定間隔でステータスを更新する
+        return now - self.refreshed_at < self.REFRESH_INTERVAL
+
+    def update(self, raw_threads: list[dict[str, Any]], now: float | None = None) -> None:
+        """
+        スレッド情報取得 API のレスポンスでインデックスを更新する
+        放送が終了した (PAST の) スレッドは二度と変化しないため、インデックスに既にあるものは検証せずにそのまま使う
+
+        Args:
+            raw_threads (list[dict[str, Any]]): スレッド情報取得 API のレスポンスを JSON としてデコードしたもの
+            now (float | None, default=None): 現在日時 (UNIX 時間) (主にテスト用)
+        """
+
+        past_threads = {thread.id: thread for thread in self.threads if thread.status == 'PAST'}
+        thread_info_adapter = TypeAdapter(ThreadInfo)
+
+        threads: list[ThreadInterval] = []
+        for raw_thread in raw_threads:
+            past_thread = past_threads.get(raw_thread.get('id'))  # type: ignore
+            if past_thread is not None:
+                threads.append(past_thread)
+                continue
+            # 新しく作られたスレッドや ACTIVE / UPCOMING のスレッドだけを検証する
+            thread_info = thread_info_adapter.validate_python(raw_thread)
+            threads.append(
+                ThreadInterval(
+                    id=thread_info.id,
+                    start_at=thread_info.start_at.timestamp(),
+                    end_at=thread_info.end_at.timestamp(),
+                    status=thread_info.status,
+                )
+            )
+
+        self._setThreads(threads)
+        self.refreshed_at = time.time() if now is None else now
+
+    def _setThreads(self, threads: list[ThreadInterval]) -> None:
+        """
+        スレッドの放送区間を放送開始日時昇順に並べ替えて設定し、二分探索用のリストを構築する
+
+        Args:
+            threads (list[ThreadInterval]): スレッドの放送区間のリスト
+        """
+
+        self.threads = sorted(threads, key=lambda thread: thread.start_at)
+        self._start_ats = [thread.start_at for thread in self.threads]
+        self._max_end_ats = list(accumulate((thread.end_at for thread in self.threads), max))
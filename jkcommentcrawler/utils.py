@@ -0,0 +1,108 @@
+from __future__ import annotations
+
+import os
+import shutil
+import threading
+from pathlib import Path
+
+import anyio
+
+
+def get_temp_path(path: Path) -> Path:
+    """
+    ファイルをアトミックに置き換えるために、同じフォルダに作成する一時ファイルのパスを返す
+    同時に複数のスレッドやプロセスから書き込まれても衝突しないよう、一時ファイル名にプロセス ID とスレッド ID を含める
+
+    Args:
+        path (Path): 置き換えるファイルのパス
+
+    Returns:
+        Path: 一時ファイルのパス
+    """
+
+    return path.with_name(f'.{path.name}.{os.getpid()}-{threading.get_ident()}.tmp')
+
+
+def replace_file(temp_path: Path, path: Path, fsync: bool = False) -> None:
+    """
+    書き込み終えた一時ファイルをリネームし、ファイルをアトミックに置き換える
+    fsync が True の場合は、リネーム前に一時ファイルを、リネーム後にフォルダを fsync する
+    電源断などで OS ごと停止しても、置き換え前か置き換え後のどちらかの内容が完全な状態で残る
+    一時ファイルが別のファイルシステムにある (リネームできない) 場合は、置き換えるファイルと同じフォルダにコピーしてからリネームする
+
+    Args:
+        temp_path (Path): 書き込み終えた一時ファイルのパス
+        path (Path): 置き換えるファイルのパス
+        fsync (bool, default=False): 一時ファイルとフォルダを fsync するかどうか
+    """
+
+    if temp_path.parent != path.parent and temp_path.stat().st_dev != path.parent.stat().st_dev:
+        local_temp_path = get_temp_path(path)
+        try:
+            shutil.copyfile(temp_path, local_temp_path)
+            replace_file(local_temp_path, path, fsync=fsync)
+        except BaseException:
+            local_temp_path.unlink(missing_ok=True)
+            raise
+        temp_path.unlink(missing_ok=True)
+        return
+
+    if fsync is True:
+        # Windows では書き込み権限のないファイルディスクリプタを fsync できないため、読み書き両用で開く
+        fd = os.open(temp_path, os.O_RDWR)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    os.replace(temp_path, path)
+
+    # リネームしたことを確実に永続化するため、フォルダも fsync する
+    ## Windows ではフォルダを開けないため行わない (NTFS ではリネームがメタデータのジャーナルで保護される)
+    if fsync is True and os.name != 'nt':
+        fd = os.open(path.parent, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+async def remove_temp_files(path: anyio.Path | Path) -> None:
+    """
+    書き込み途中で強制終了したプロセスが残した、ファイルを置き換えるための一時ファイルを削除する
+    同じファイルに書き込む処理が他に実行されていない状態で呼び出す必要がある
+
+    Args:
+        path (anyio.Path | Path): 置き換えるファイルのパス
+    """
+
+    target = anyio.Path(path)
+    if await target.parent.is_dir() is False:
+        return
+    async for temp_path in target.parent.glob(f'.{target.name}.*.tmp'):
+        await temp_path.unlink(missing_ok=True)
+
+
+async def write_file_atomically(path: anyio.Path | Path, content: bytes, fsync: bool = False) -> None:
+    """
+    同じフォルダに作成した一時ファイルに書き込んでからリネームすることで、ファイルをアトミックに置き換える
+    書き込み中にプロセスが終了しても、書き込み途中のファイルが残ることはない
+
+    Args:
+        path (anyio.Path | Path): 書き込むファイルのパス
+        content (bytes): 書き込む内容
+        fsync (bool, default=False): リネーム前に一時ファイルを、リネーム後にフォルダを fsync するかどうか
+    """
+
+    def write() -> None:
+        target = Path(path)
+        temp_path = get_temp_path(target)
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(content)
+            replace_file(temp_path, target, fsync=fsync)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+
+    await anyio.to_thread.run_sync(write)